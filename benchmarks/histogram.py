@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Compares the jpeg and the raw luma histogram path of the camera sensor.
+
+Runs both paths on synthetic frames at common Pi camera resolutions and
+prints the CPU time per frame and the peak memory allocated by a frame.
+
+    python -m benchmarks.histogram
+"""
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from sensorpi.sensors import camera
+
+RESOLUTIONS = [(640, 480), (1296, 972), (1920, 1080), (2592, 1944)]
+
+
+def synthetic_frame(width: int, height: int) -> camera.Frame:
+    """A padded I420 frame with a gradient and some noise."""
+    fwidth, fheight = (width + 31) // 32 * 32, (height + 15) // 16 * 16
+    rng = np.random.default_rng(0)
+    yuv = np.full((fheight * 3 // 2, fwidth), 128, dtype=np.uint8)
+    gradient = np.linspace(0, 255, fwidth, dtype=np.float32)
+    noise = rng.normal(0, 8, size=(fheight, fwidth))
+    yuv[:fheight] = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    return camera.Frame(yuv, width, height)
+
+
+def jpeg_path(jpeg: bytes) -> float:
+    """What hist_as_json did before: decode, rotate, histogram of channel 0."""
+    image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), 1)
+    image = cv2.rotate(image, cv2.ROTATE_180)
+    return float(camera.integrate_histogram(camera.calc_histogram(image)))
+
+
+def luma_path(frame: camera.Frame) -> float:
+    return float(camera.integrate_histogram(camera.luma_histogram(frame.luma)))
+
+
+def measure(func, arg, repeat: int):
+    """Returns CPU seconds per call and peak bytes allocated by one call."""
+    func(arg)  # warm up
+    start = time.process_time()
+    for _ in range(repeat):
+        func(arg)
+    cpu = (time.process_time() - start) / repeat
+    tracemalloc.start()
+    func(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return cpu, peak
+
+
+def main(repeat: int = 20):
+    print(f"{'resolution':>12} {'path':>5} {'cpu ms/frame':>13} {'peak MiB':>9}")
+    for width, height in RESOLUTIONS:
+        frame = synthetic_frame(width, height)
+        # the camera encodes the jpeg, so it is not counted for the jpeg path
+        jpeg = cv2.imencode(".jpg", frame.bgr(rotate=False))[1].tobytes()
+        for name, func, arg in (("jpeg", jpeg_path, jpeg), ("luma", luma_path, frame)):
+            cpu, peak = measure(func, arg, repeat)
+            print(f"{width:>6}x{height:<5} {name:>5} {cpu * 1000:>13.2f} {peak / 1024**2:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class InfluxStub:
+    """A local stand-in for the influx write endpoint.
+
+    Accepts every write with 204 and counts the requests, the connections
+    and the received lines, and the most requests answered at the same
+    time in max_active. Connections are kept alive (HTTP/1.1), so a
+    client that reuses its connection only shows up once in connections.
+
+    Args:
+        delay: Seconds to wait before answering a write.
+        status: The status code to answer with.
+
+    Examples:
+        with InfluxStub() as stub:
+            send(stub.url)
+            assert stub.requests == 1
+
+    """
+
+    def __init__(self, delay: float = 0.0, status: int = 204):
+        self.delay = delay
+        self.status = status
+        self.requests = 0
+        self.connections = 0
+        self.lines = []
+        self.active = 0  # requests being answered right now
+        self.max_active = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub._lock:
+                    stub.active += 1
+                    stub.max_active = max(stub.max_active, stub.active)
+                if stub.delay:
+                    threading.Event().wait(stub.delay)
+                with stub._lock:
+                    stub.active -= 1
+                    stub.requests += 1
+                    stub.lines.extend(body.decode().splitlines())
+                self.send_response(stub.status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
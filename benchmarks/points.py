@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Compares the old dict path with Point and LineProtocolEncoder.
+
+A cycle is what happens to the readings of all sensors of one tick: the
+drivers' dicts are stamped and serialized to line protocol. Prints the
+points per second and the peak memory allocated per cycle of both paths.
+
+    python -m benchmarks.points
+"""
+import time
+import tracemalloc
+
+from influxdb_client import Point as InfluxPoint
+
+from sensorpi.points import LineProtocolEncoder, Point
+
+SENSORS = 20  # sensors per cycle
+
+
+def driver_output(i: int) -> list:
+    """What a driver's as_json returns."""
+    return [{"measurement": "greenhouse",
+             "tags": {"sensor": f"BME280_{i}",
+                      "comment": None},
+             "fields": {"temperature": 21.5 + i,
+                        "pressure": 1013.25,
+                        "relative humidity": 45.0}}]
+
+
+def old_cycle(readings: list, timestamp: float) -> bytes:
+    data = [d | {"time": round(timestamp * 1e9)} for reading in readings for d in reading]
+    return "\n".join(InfluxPoint.from_dict(d).to_line_protocol() for d in data).encode()
+
+
+def new_cycle(readings: list, timestamp: float, encoder=LineProtocolEncoder("ms")) -> bytes:
+    time_ns = round(timestamp * 1e9)
+    return encoder.encode([Point.from_dict(d, time_ns) for reading in readings for d in reading])
+
+
+def measure(cycle, readings, seconds: float = 2.0):
+    timestamp = time.time()
+    cycle(readings, timestamp)  # warm up
+    cycles = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        cycle(readings, timestamp)
+        cycles += 1
+    points_per_second = cycles * SENSORS / (time.perf_counter() - start)
+    tracemalloc.start()
+    cycle(readings, timestamp)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return points_per_second, peak
+
+
+def main():
+    readings = [driver_output(i) for i in range(SENSORS)]
+    print(f"{'path':>5} {'points/s':>10} {'peak KiB/cycle':>15}")
+    for name, cycle in (("old", old_cycle), ("new", new_cycle)):
+        points_per_second, peak = measure(cycle, readings)
+        print(f"{name:>5} {points_per_second:>10.0f} {peak / 1024:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Compares the region analytics of the camera sensor with one copy per region.
+
+Computes mean, percentiles, saturation and 16 bin histograms of several
+overlapping regions on synthetic frames at common Pi camera resolutions,
+once with camera.roi_fields (one bincount over a label map) and once by
+copying every region out of the frame and using numpy on the copies.
+Prints the CPU time per frame and the peak memory allocated by a frame.
+
+    python -m benchmarks.rois
+"""
+import numpy as np
+
+from sensorpi.sensors import camera
+from sensorpi.sensors.analytics import parse_rect
+
+from .histogram import RESOLUTIONS, measure, synthetic_frame
+
+METRICS = ["mean", "p5", "p50", "p95", "saturated", "hist"]
+
+
+def regions(count: int) -> dict:
+    """count overlapping regions: a grid of horizontal bands plus the whole frame."""
+    rois = {"frame": [0.0, 0.0, 1.0, 1.0]}
+    for i in range(count - 1):
+        rois[f"band{i}"] = [0.0, i / count, 1.0, 2 / count]
+    return rois
+
+
+def copies_path(frame: camera.Frame, rois: dict) -> dict:
+    """The metrics with a copy of every region."""
+    fields = {}
+    luma = frame.luma
+    for name, rect in rois.items():
+        x0, y0, x1, y1 = parse_rect(rect, frame.width, frame.height)
+        region = luma[y0:y1, x0:x1].ravel().copy()
+        fields[f"{name}_mean"] = float(region.mean())
+        for q in (5, 50, 95):
+            fields[f"{name}_p{q}"] = float(np.percentile(region, q))
+        fields[f"{name}_saturated"] = float((region >= 250).mean())
+        hist = np.histogram(region, bins=16, range=(0, 256))[0]
+        fields.update({f"{name}_hist_y{b}": h / region.size for b, h in enumerate(hist)})
+    return fields
+
+
+def labels_path(frame: camera.Frame, rois: dict) -> dict:
+    return camera.roi_fields(frame, rois, METRICS, rotate=False)
+
+
+def main(repeat: int = 10, count: int = 8):
+    rois = regions(count)
+    print(f"{count} regions, metrics {' '.join(METRICS)}")
+    print(f"{'resolution':>12} {'path':>7} {'cpu ms/frame':>13} {'peak MiB':>9}")
+    for width, height in RESOLUTIONS:
+        frame = synthetic_frame(width, height)
+        for name, func in (("copies", copies_path), ("labels", labels_path)):
+            cpu, peak = measure(lambda f: func(f, rois), frame, repeat)
+            print(f"{width:>6}x{height:<5} {name:>7} {cpu * 1000:>13.2f} {peak / 1024**2:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
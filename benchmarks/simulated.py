@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Simulated sensor drivers, so sensorpi can be benchmarked without a Pi.
+
+Every driver sleeps for a configurable latency with some jitter, fails at a
+configurable rate and returns points that look like the ones of the real
+driver. install() registers them in the registry under the keys of the real
+drivers, so a normal config.edn can be used.
+"""
+import random
+import threading
+import time
+
+from sensorpi.sensors import handler
+
+# Typical read times in seconds and the fields of the real drivers.
+PROFILES = {
+    "ds18b20": (0.75, {"temperature": 21.5}),  # 12 bit conversion
+    "dht11": (0.25, {"temperature": 21.0, "humidity": 45.0}),
+    "tsl2591": (0.1, {"lux": 250.0, "infrared": 120, "visible": 400, "full_spectrum": 520}),
+    "bmp280i2c": (0.01, {"temperature": 21.5, "pressure": 1013.25}),
+    "bmp280spi": (0.005, {"temperature": 21.5, "pressure": 1013.25}),
+    "bme280i2c": (0.01, {"temperature": 21.5, "pressure": 1013.25, "relative humidity": 45.0}),
+    "bme280spi": (0.005, {"temperature": 21.5, "pressure": 1013.25, "relative humidity": 45.0}),
+    "camera": (0.5, {"integrated histogram": 1.2e6}),
+}
+
+
+class SimulatedDriver:
+    """A sensor function with a configurable latency, jitter and failure rate.
+
+    Args:
+        latency: Seconds a read takes.
+        fields: The fields of the returned point, values are varied a bit.
+        jitter: Relative jitter of the latency, 0.1 is +-10%.
+        failure_rate: Share of reads that raise a RuntimeError.
+        seed: Seed of the random numbers, for reproducible runs.
+
+    Attributes:
+        reads: Number of reads.
+        failures: Number of failed reads.
+
+    """
+
+    def __init__(self, latency: float, fields: dict, jitter: float = 0.1,
+                 failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.fields = fields
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.reads = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()  # reads of different sensors run in parallel
+
+    def __call__(self, measurement: str, sensor_name: str = None, comment: str = None,
+                 **kwargs) -> list:
+        with self._lock:
+            self.reads += 1
+            delay = self.latency * (1 + self._random.uniform(-self.jitter, self.jitter))
+            failed = self._random.random() < self.failure_rate
+            noise = self._random.gauss(0, 0.1)
+            if failed:
+                self.failures += 1
+        time.sleep(max(0.0, delay))
+        if failed:
+            raise RuntimeError(f"Simulated read error of {sensor_name}")
+        return [{"measurement": measurement,
+                 "tags": {"sensor": sensor_name, "comment": comment},
+                 "fields": {k: v + noise if isinstance(v, float) else v
+                            for k, v in self.fields.items()}}]
+
+
+def install(registry=None, scale: float = 1.0, jitter: float = 0.1,
+            failure_rate: float = 0.0, seed: int = 0) -> dict:
+    """Registers a simulated driver for every sensor type.
+
+    Args:
+        registry: The registry to install into, handler.sensor_funcs by default.
+        scale: Factor for the latencies of PROFILES, 0.1 runs ten times faster.
+        jitter: Relative jitter of the latencies.
+        failure_rate: Share of reads that fail.
+        seed: Seed of the random numbers.
+
+    Returns:
+        drivers: Dictionary of sensor key -> SimulatedDriver.
+
+    """
+    registry = handler.sensor_funcs if registry is None else registry
+    drivers = {}
+    for i, (key, (latency, fields)) in enumerate(PROFILES.items()):
+        drivers[key] = SimulatedDriver(latency * scale, fields, jitter, failure_rate, seed + i)
+        registry[key] = drivers[key]
+    return drivers
+
+
+def sensors(count: int, interval: float = None) -> dict:
+    """Returns the sensors part of a config with count sensors of all types.
+
+    Args:
+        count: Number of sensors.
+        interval: The :interval of every sensor, None for the default interval.
+
+    """
+    keys = list(PROFILES)
+    config = {}
+    for i in range(count):
+        key = keys[i % len(keys)]
+        sensor = {"type": key[:-3] if key.endswith(("i2c", "spi")) else key}
+        if key.endswith(("i2c", "spi")):
+            sensor["protocol"] = key[-3:]
+        if interval is not None:
+            sensor["interval"] = interval
+        config[f"{key}_{i}"] = sensor
+    return config
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""End to end benchmarks of sensorpi with simulated sensors.
+
+Runs without a Pi: the drivers are replaced by simulated ones (see
+benchmarks.simulated) and the points are written to a local stand-in of
+the influx write endpoint. Scenarios:
+
+    collect     handler.collect_measurements, sensors read one after another
+    collect-N   handler.collect_measurements with N worker threads
+    loop        the main loop with InfluxWriter, from tick to database
+    loop-spool  the main loop with a SpooledWriter
+    loop-profile the main loop with the profiler on, every 5th cycle under cProfile
+
+For every scenario the cycle latency percentiles, the points per second,
+the CPU time per cycle and the RSS are reported. The results are written as
+json (by default to benchmarks/results/<version>.json), an older result can
+be given with --compare to print the change.
+
+    python -m benchmarks.suite --sensors 16 --workers 4
+    python -m benchmarks.suite --compare benchmarks/results/0.1.6.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+from sensorpi import __version__
+from sensorpi import __main__ as sensorpi_main
+from sensorpi.config import compile_config
+from sensorpi.profiling import profiler
+from sensorpi.sensors import handler
+from sensorpi.spool import Spool, SpooledWriter
+from sensorpi.writer import InfluxWriter
+
+from . import simulated
+from .influx_stub import InfluxStub
+
+MEASUREMENT = "bench"
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest rank percentile of the values, q between 0 and 100."""
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, round(q / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def rss_mib() -> float:
+    """Returns the current resident set size in MiB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except OSError:  # not linux, use the peak instead
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(latencies: list, points: int, seconds: float, cpu: float,
+              failures: int) -> dict:
+    """Returns the metrics of a scenario, latencies in seconds."""
+    cycles = len(latencies)
+    return {"cycles": cycles,
+            "points": points,
+            "failures": failures,
+            "p50_ms": percentile(latencies, 50) * 1000 if cycles else None,
+            "p95_ms": percentile(latencies, 95) * 1000 if cycles else None,
+            "p99_ms": percentile(latencies, 99) * 1000 if cycles else None,
+            "max_ms": max(latencies) * 1000 if cycles else None,
+            "points_per_s": points / seconds if seconds else None,
+            "cpu_ms_per_cycle": cpu / cycles * 1000 if cycles else None,
+            "rss_mib": rss_mib()}
+
+
+def _failures(drivers: dict) -> int:
+    return sum(driver.failures for driver in drivers.values())
+
+
+def bench_collect(sensors: dict, drivers: dict, cycles: int, workers: int = 0) -> dict:
+    """Reads all sensors cycles times with handler.collect_measurements."""
+    failures = _failures(drivers)
+    latencies = []
+    points = 0
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for _ in range(cycles):
+        cycle_start = time.perf_counter()
+        points += len(handler.collect_measurements(sensors, MEASUREMENT, time.time(), workers))
+        latencies.append(time.perf_counter() - cycle_start)
+    return summarize(latencies, points, time.perf_counter() - start,
+                     time.process_time() - cpu, _failures(drivers) - failures)
+
+
+class _StopAfter:
+    """Wraps a writer, records the cycle latency and stops the loop after cycles writes.
+
+    The latency of a cycle is the time from its tick (the time of its points)
+    until its points are handed to the writer.
+
+    """
+
+    def __init__(self, writer, cycles: int):
+        self.writer = writer
+        self.cycles = cycles
+        self.latencies = []
+
+    def write(self, data: list):
+        now = time.time_ns()
+        if data:
+            self.latencies.append((now - data[0].time) / 1e9)
+        self.writer.write(data)
+        if len(self.latencies) >= self.cycles:
+            raise KeyboardInterrupt  # ends the loop like Ctrl-C
+
+    def close(self):
+        self.writer.close()
+
+
+def bench_loop(sensors: dict, drivers: dict, cycles: int, interval: float,
+               workers: int = 0, spool: bool = False, profile: bool = False) -> dict:
+    """Runs the main loop against a local influx stub until cycles were written."""
+    config = {"influxdb": {"db": MEASUREMENT}, "sensors": sensors}
+    plan = compile_config(config, interval)
+    failures = _failures(drivers)
+    with InfluxStub() as stub, tempfile.TemporaryDirectory() as tmp:
+        writer = InfluxWriter(MEASUREMENT, influx_url=stub.url)
+        if spool:
+            writer = SpooledWriter(writer, Spool(tmp))
+        writer = _StopAfter(writer, cycles)
+        if profile:
+            profiler.start(os.path.join(tmp, "trace.json"), sample_every=5)
+        cpu = time.process_time()
+        start = time.perf_counter()
+        try:
+            sensorpi_main.loop(interval, plan.sensors, MEASUREMENT, plan.config, writer, workers)
+        finally:
+            writer.close()  # flushes, so every point has reached the stub
+            profiler.stop()
+        seconds = time.perf_counter() - start
+        return summarize(writer.latencies, len(stub.lines), seconds,
+                         time.process_time() - cpu, _failures(drivers) - failures)
+
+
+def run(sensor_count: int = 16, cycles: int = 20, loop_cycles: int = 10,
+        interval: float = 0.5, workers: int = 4, scale: float = 0.1,
+        jitter: float = 0.1, failure_rate: float = 0.01, seed: int = 0) -> dict:
+    """Runs all scenarios and returns the results.
+
+    Args:
+        sensor_count: Number of simulated sensors.
+        cycles: Cycles of the collect scenarios.
+        loop_cycles: Cycles of the loop scenarios.
+        interval: Seconds between two cycles of the loop.
+        workers: Worker threads of the parallel scenarios.
+        scale: Factor for the latencies of the real sensors.
+        jitter: Relative jitter of the latencies.
+        failure_rate: Share of reads that fail.
+        seed: Seed of the random numbers.
+
+    """
+    drivers = simulated.install(scale=scale, jitter=jitter,
+                                failure_rate=failure_rate, seed=seed)
+    sensors = simulated.sensors(sensor_count)
+    scenarios = {
+        "collect": bench_collect(sensors, drivers, cycles),
+        f"collect-{workers}": bench_collect(sensors, drivers, cycles, workers),
+        "loop": bench_loop(sensors, drivers, loop_cycles, interval, workers),
+        "loop-spool": bench_loop(sensors, drivers, loop_cycles, interval, workers, spool=True),
+        "loop-profile": bench_loop(sensors, drivers, loop_cycles, interval, workers,
+                                   profile=True),
+    }
+    return {"version": __version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "parameters": {"sensors": sensor_count, "cycles": cycles,
+                           "loop_cycles": loop_cycles, "interval": interval,
+                           "workers": workers, "scale": scale, "jitter": jitter,
+                           "failure_rate": failure_rate, "seed": seed},
+            "scenarios": scenarios}
+
+
+def print_results(results: dict, baseline: dict = None):
+    """Prints a table of the results, with the change to baseline if given."""
+    metrics = ["p50_ms", "p95_ms", "p99_ms", "points_per_s", "cpu_ms_per_cycle", "rss_mib"]
+    print(f"sensorpi {results['version']} on {results['machine']}, python {results['python']}")
+    print(f"{'scenario':>12}" + "".join(f"{m:>18}" for m in metrics))
+    for name, scenario in results["scenarios"].items():
+        old = (baseline or {}).get("scenarios", {}).get(name, {})
+        cells = []
+        for metric in metrics:
+            value = scenario.get(metric)
+            cell = "-" if value is None else f"{value:.1f}"
+            if value is not None and old.get(metric):
+                cell += f" ({(value / old[metric] - 1) * 100:+.0f}%)"
+            cells.append(f"{cell:>18}")
+        print(f"{name:>12}" + "".join(cells))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sensors", type=int, default=16, help="number of simulated sensors")
+    parser.add_argument("--cycles", type=int, default=20, help="cycles of the collect scenarios")
+    parser.add_argument("--loop-cycles", type=int, default=10, help="cycles of the loop scenarios")
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between loop cycles")
+    parser.add_argument("--workers", type=int, default=4, help="threads of the parallel scenarios")
+    parser.add_argument("--scale", type=float, default=0.1, help="factor for the sensor latencies")
+    parser.add_argument("--jitter", type=float, default=0.1, help="relative latency jitter")
+    parser.add_argument("--failure-rate", type=float, default=0.01, help="share of failing reads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="json file of the results, "
+                        "default benchmarks/results/<version>.json")
+    parser.add_argument("--compare", type=argparse.FileType("r"), help="json results to compare to")
+    args = parser.parse_args(argv)
+    # the loop logs every cycle and every simulated failure
+    loggers = (sensorpi_main.log, handler.log)
+    levels = [logger.level for logger in loggers]
+    for logger in loggers:
+        logger.setLevel(logging.ERROR)
+    try:
+        results = run(args.sensors, args.cycles, args.loop_cycles, args.interval, args.workers,
+                      args.scale, args.jitter, args.failure_rate, args.seed)
+    finally:
+        for logger, level in zip(loggers, levels):
+            logger.setLevel(level)
+    baseline = json.load(args.compare) if args.compare else None
+    print_results(results, baseline)
+    output = args.output or os.path.join(os.path.dirname(__file__), "results",
+                                         f"{results['version']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
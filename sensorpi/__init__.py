@@ -1,3 +1,12 @@
 __version__ = '0.1.6'
 
-from .sensors import ds18b20, tsl2591, dht11, camera, handler
+import importlib
+
+_DRIVERS = ("ds18b20", "tsl2591", "dht11", "camera", "handler")
+
+
+def __getattr__(name):
+    """Imports the sensor modules on first access, they pull in heavy libraries."""
+    if name in _DRIVERS:
+        return importlib.import_module(f".sensors.{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,12 +1,26 @@
 #!/usr/bin/env python3
 import glob
-import edn_format
 from influxdb_client import InfluxDBClient
 from .sensors import handler
+from .config import (ConfigError, ConfigWatcher, compile_config, edn_to_map,  # noqa: F401
+                     load_config, read_config)
+from .writer import InfluxWriter
+from .spool import Spool, SpooledWriter
+from .metrics import MetricsServer, Reporter, metrics
+from .deadband import DeadbandFilter
+from .sinks import FanOut
+from .pipeline import (RELOAD_INTERVAL, create_aggregator, create_scheduler, destination,
+                       process)
+from .profiling import profiler
+from . import trace
 import logging
+import signal
+import sys
 import time
 from datetime import datetime
 import argparse
+import asyncio
+import json
 
 
 log = logging.getLogger(__name__)
@@ -14,27 +28,6 @@ log.setLevel(logging.INFO)
 hdlr = logging.StreamHandler()
 log.addHandler(hdlr)
 
-
-def edn_to_map(x) -> dict:
-    """Helper function to turn edn to a python dict.
-
-    Taken from:
-    https://github.com/swaroopch/edn_format/issues/76#issuecomment-749618312
-
-    Args:
-        x: An edn map from edn_format.
-
-    """
-    if isinstance(x, edn_format.ImmutableDict):
-        return {edn_to_map(k): edn_to_map(v) for k, v in x.items()}
-    elif isinstance(x, edn_format.ImmutableList):
-        return [edn_to_map(v) for v in x]
-    elif isinstance(x, edn_format.Keyword):
-        return x.name
-    else:
-        return x
-
-
 def find_config() -> str:
     """Tries to find the config file.
 
@@ -81,26 +74,6 @@ def create_config(path):
         log.error(f"Could not create config file at {path}!")
 
 
-def read_config(config_path: str) -> dict:
-    """Reads the given config file and parses it.
-
-    The config should contain data about the influxdb and the sensors.
-    This data is read and put into a dictionary that is used for further usage.
-
-    Args:
-        edn: The path of the config.edn file.
-
-    Returns:
-        config: A dict containing the config data
-
-    """
-    with open(config_path, "r") as f:
-        lines = f.read()
-        config = edn_format.loads(lines)
-    config_dict = edn_to_map(config)
-    return config_dict
-
-
 def send_to_db(data, db, user=None, password=None,
                influx_url="http://localhost:8086",
                org="-", retention_policy="autogen"):
@@ -115,66 +88,476 @@ def send_to_db(data, db, user=None, password=None,
             write_api.write(bucket=f"{db}/{retention_policy}", record=data)
 
 
-def create_db(db, influx_host="localhost", influx_port=8086):
-    """Creates a new database if not already existing
+def create_db(db, user=None, password=None, influx_url="http://localhost:8086", org="-"):
+    """Creates the database (a bucket in influxdb >= 2) if it does not exist yet.
+
+    Args:
+        db: Name of the database.
+        user: Username for the database.
+        password: Password for the database.
+        influx_url: Url of the influxdb.
+        org: Organization the bucket belongs to.
 
     """
     try:
-        client = InfluxDBClient(host=influx_host, port=influx_port)
-        dbs = [db["name"] for db in client.get_list_database()]
-        if db not in dbs:
-            client.create_database(db)
-            print(f"Database {db} created.")
-        else:
-            print(f"Database {db} already exists!")
-    except Exception:
+        with InfluxDBClient(url=influx_url, token=f"{user}:{password}", org=org) as client:
+            buckets = client.buckets_api()
+            if buckets.find_bucket_by_name(db) is None:
+                buckets.create_bucket(bucket_name=db, org=org)
+                log.info(f"Database {db} created.")
+            else:
+                log.info(f"Database {db} already exists!")
+    except Exception as e:
+        log.error(e)
         log.error("Error while creating database!")
 
 
-def loop(seconds, sensors, measurement, config):
-    """The main loop which is taking a measurement at a given interval.
+def create_writer(influxdb: dict) -> InfluxWriter:
+    """Creates the long-lived writer from the influxdb part of the config.
+
+    Args:
+        influxdb: The influxdb map of the config.
+
+    Returns:
+        writer: The writer used for the whole run.
+
+    """
+    return InfluxWriter(influxdb["db"],
+                        user=influxdb.get("user"),
+                        password=influxdb.get("password"),
+                        influx_url=influxdb.get("url", "http://localhost:8086"),
+                        org=influxdb.get("org", "-"),
+                        retention_policy=influxdb.get("retention-policy", "autogen"),
+                        batch_size=influxdb.get("batch-size", 500),
+                        flush_interval=influxdb.get("flush-interval", 10.0),
+                        precision=influxdb.get("precision", "ms"))
+
+
+def create_async_writer(influxdb: dict):
+    """Creates the writer of the asyncio runtime from the influxdb part of the config.
+
+    Args:
+        influxdb: The influxdb map of the config.
+
+    Returns:
+        writer: An AsyncInfluxWriter.
+
+    """
+    from .aio import AsyncInfluxWriter
+    return AsyncInfluxWriter(influxdb["db"],
+                             user=influxdb.get("user"),
+                             password=influxdb.get("password"),
+                             influx_url=influxdb.get("url", "http://localhost:8086"),
+                             org=influxdb.get("org", "-"),
+                             retention_policy=influxdb.get("retention-policy", "autogen"),
+                             batch_size=influxdb.get("batch-size", 500),
+                             flush_interval=influxdb.get("flush-interval", 10.0),
+                             precision=influxdb.get("precision", "ms"),
+                             max_in_flight=influxdb.get("max-in-flight", 2))
+
+
+def create_spooled_writer(writer: InfluxWriter, spool: dict) -> SpooledWriter:
+    """Puts a disk spool in front of the writer, from the spool part of the config.
+
+    Args:
+        writer: The writer the spooled points are sent with.
+        spool: The spool map of the config.
+
+    Returns:
+        spooled_writer: A writer sending every point through the spool.
+
+    """
+    return SpooledWriter(writer,
+                         Spool(spool["path"],
+                               segment_bytes=spool.get("segment-bytes", 4 * 1024**2),
+                               max_bytes=spool.get("max-bytes", 256 * 1024**2),
+                               fsync_interval=spool.get("fsync-interval", 5.0)),
+                         chunk_size=spool.get("chunk-size", 500),
+                         rate=spool.get("rate", 2000.0),
+                         retry_interval=spool.get("retry-interval", 5.0))
+
+
+def create_sinks(config: dict, sensors) -> FanOut:
+    """Creates the sinks of the config, every one with its own queue and thread.
+
+    An influx sink takes the :influxdb and :spool of the config, unless it
+    has its own options.
+
+    Args:
+        config: The config with {:sinks {name {:type ...}}}.
+        sensors: The sensors from config, their :sinks choose where they are written to.
+
+    Returns:
+        writer: A FanOut, used like the InfluxWriter.
+
+    """
+    from .sinks import QUEUE_OPTIONS, SINKS, InfluxSink, QueuedSink
+    sinks = {}
+    try:
+        for name, options in config["sinks"].items():
+            name = str(name)
+            if options["type"] == "influx":
+                influxdb = {**config.get("influxdb", {}), **options}
+                writer = create_writer(influxdb)
+                spool = options.get("spool", config.get("spool"))
+                if spool:
+                    writer = create_spooled_writer(writer, spool)
+                sink = InfluxSink(name, writer)
+            else:
+                sink = SINKS[options["type"]](name, **{
+                    k.replace("-", "_"): v for k, v in options.items()
+                    if k != "type" and k not in QUEUE_OPTIONS})
+            sinks[name] = QueuedSink(sink, **{k.replace("-", "_"): options[k]
+                                              for k in QUEUE_OPTIONS if k in options})
+    except Exception:
+        FanOut(sinks, {}).close()
+        raise
+    return FanOut(sinks, sensors)
+
+
+def create_metrics(options: dict, writer):
+    """Sets up the self-metrics from the metrics part of the config.
+
+    The metrics are written as their own measurement every :interval seconds
+    and, if a :port is given, served for scraping at http://host:port/metrics.
 
     Args:
-        seconds: The time between measurements
-        sensors: The list of sensors from config
+        options: The metrics map of the config.
+        writer: The InfluxWriter, SpooledWriter or FanOut, its queue depth is a gauge.
+
+    Returns:
+        reporter: The Reporter for the main loop.
+        server: The MetricsServer, None without a :port.
+
+    """
+    if isinstance(writer, FanOut):
+        pass  # every sink has its own gauges
+    elif isinstance(writer, SpooledWriter):
+        metrics.gauge("spool", "queue_bytes", writer.spool.__len__)
+        metrics.gauge(writer.writer.name, "queue_points", writer.writer.__len__)
+    else:
+        metrics.gauge(writer.name, "queue_points", writer.__len__)
+    reporter = Reporter(metrics, options.get("interval", 60.0),
+                        options.get("measurement", "sensorpi"))
+    server = None
+    if "port" in options:
+        server = MetricsServer(metrics, options["port"], options.get("host", "127.0.0.1"))
+    return reporter, server
+
+
+def create_store(options: dict):
+    """Opens the local store from the store part of the config.
+
+    Args:
+        options: The store map of the config.
+
+    Returns:
+        store: The LocalStore.
+
+    """
+    from .store import LocalStore
+    return LocalStore(options["path"], max_bytes=options.get("max-bytes", 64 * 1024**2))
+
+
+def loop(seconds, sensors, measurement, config, writer, workers=0, watcher=None,
+         reporter=None, store=None, recorder=None):
+    """The main loop which is taking measurements at the sensors' intervals.
+
+    Args:
+        seconds: The time between measurements, for sensors without :interval
+        sensors: The sensors from config, or the sensors of a compiled Plan
         measurement: The name of the measurement
         config: the config file
+        writer: The InfluxWriter, SpooledWriter or FanOut the data is written to
+        workers: Number of threads reading the sensors in parallel.
+            0 reads them one after another.
+        watcher: A ConfigWatcher, its changed sensors are used without restarting.
+        reporter: A metrics Reporter, its points are written with the measurements.
+        store: A LocalStore, every reading is kept in it as well.
+        recorder: A trace.Recorder, the readings of every cycle are recorded.
 
     """
+    aggregator = None
     try:
+        scheduler = create_scheduler(seconds, sensors, config)
+        aggregator = create_aggregator(seconds, sensors)
+        deadband = DeadbandFilter(sensors)
         log.info(f"Program running!"
                  f" Taking measurement every {seconds} seconds."
-                 f" Writing to database {config['influxdb']['db']} as measurement {measurement}"
+                 f" Writing to {destination(config)} as measurement {measurement}"
                  "\nPress Ctrl-C to exit.")
         while True:
-            timestamp = time.time()
-            data = handler.collect_measurements(sensors, measurement, timestamp)
-            try:
-                send_to_db(data, config["influxdb"]["db"])
-                log.info(f"{datetime.now().strftime('%H:%M:%S')} Wrote to database.")
-            except Exception as e:
-                log.warning(e)
-                log.warning("Could not send data to database! Is it online?")
-            time.sleep(seconds - (time.time() - timestamp))  # wait 'seconds' without time used to measure
+            tick = scheduler.next_tick(timeout=RELOAD_INTERVAL if watcher else None)
+            if watcher is not None:
+                plan = watcher.poll()
+                if plan is not None:
+                    sensors = plan.sensors
+                    scheduler.update({name: sensors[name].interval for name in sensors})
+                    aggregator = create_aggregator(seconds, sensors, aggregator)
+                    deadband.update(sensors)
+                    if isinstance(writer, FanOut):
+                        writer.update(sensors)
+            if tick is None:
+                continue
+            log.debug(f"Tick for {len(tick.names)} sensors fired {tick.lateness * 1000:.1f} ms late.")
+            due = {name: sensors[name] for name in tick.names if name in sensors}
+            with profiler.cycle():
+                data = handler.collect_measurements(due, measurement, tick.timestamp, workers)
+                if recorder is not None:
+                    recorder.record(tick.timestamp, data)
+                written = process(data, tick.timestamp, writer, store, aggregator, deadband,
+                                  reporter)
+            if written is not None:
+                log.info(f"{datetime.now().strftime('%H:%M:%S')} Queued {written} points for database.")
     except KeyboardInterrupt:
         log.warning("Program is exiting...")
     except KeyError as e:
         log.error(e)
         log.error("Your config has some error, try to fix it!")
+    finally:
+        if aggregator is not None:
+            try:
+                writer.write(aggregator.flush())  # the unfinished windows
+            except Exception as e:
+                log.warning(e)
 
 
-def main(seconds, measurement, config, verbose):
-    """Main function which reads the config file and then starts a loop.
+def create_output(config: dict, sensors, runtime: str = "threads"):
+    """Creates the writer the points are written to, from the config.
+
+    Args:
+        config: The config.
+        sensors: The sensors from config, for the routes of the sinks.
+        runtime: "asyncio" uses the AsyncInfluxWriter.
+
+    Returns:
+        writer: A FanOut with :sinks, a SpooledWriter with :spool, else an influx writer.
 
     """
+    if "sinks" in config:
+        return create_sinks(config, sensors)
+    if "spool" in config:
+        # the spool is drained by its own thread in both runtimes
+        return create_spooled_writer(create_writer(config["influxdb"]), config["spool"])
+    if runtime == "asyncio":
+        return create_async_writer(config["influxdb"])
+    return create_writer(config["influxdb"])
+
+
+def main(seconds, measurement, config, verbose, workers=0, config_path=None, digest="",
+         runtime="threads", record=None):
+    """Main function which compiles the config and then starts a loop.
+
+    Args:
+        config_path: The path of the config. If given, the file is watched
+            and changed sensors are reloaded while running.
+        digest: The sha256 of the config file.
+        runtime: "threads" runs the blocking loop, "asyncio" the loop of sensorpi.aio.
+        record: Path of a trace the readings are recorded to, see sensorpi.trace.
+
+    """
+    try:
+        with profiler.span("config", stage="compile"):
+            plan = compile_config(config, seconds, digest)
+    except ConfigError as e:
+        log.error(e)
+        log.error("Your config has some error, try to fix it!")
+        return
+    watcher = ConfigWatcher(config_path, plan, seconds) if config_path else None
+    # systemd stops us with SIGTERM, exit normally so the writer gets flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    writer = create_output(config, plan.sensors, runtime)
+    recorder = trace.Recorder(record) if record else None
+    reporter = server = None
+    if "metrics" in config:
+        reporter, server = create_metrics(config["metrics"], writer)
+    store = create_store(config["store"]) if "store" in config else None
+    try:
+        if runtime == "asyncio":
+            from . import aio
+            aio.run(seconds, plan.sensors, measurement, plan.config, writer, workers,
+                    watcher, reporter, store, recorder)  # closes the writer when done
+        else:
+            loop(seconds, plan.sensors, measurement, plan.config, writer, workers,
+                 watcher, reporter, store, recorder)
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if server is not None:
+            server.close()
+        if store is not None:
+            store.close()
+        if runtime != "asyncio":
+            writer.close()
+
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_time(text: str, now: float) -> float:
+    """Returns the unix time of a duration before now (15m, 2h, 1d), or of a unix time."""
+    if text[-1:] in DURATION_UNITS:
+        return now - float(text[:-1]) * DURATION_UNITS[text[-1]]
+    return float(text)
+
+
+def format_rows(rows: list, fmt: str) -> str:
+    """Formats the rows of a store query as a table, csv or json lines."""
+    if fmt == "json":
+        return "\n".join(json.dumps(row._asdict()) for row in rows)
+    lines = []
+    for row in rows:
+        tags = ",".join(f"{k}={v}" for k, v in sorted(row.tags.items()))
+        values = (datetime.fromtimestamp(row.time).isoformat(timespec="milliseconds"),
+                  row.measurement, tags, row.field, f"{row.mean:.6g}", f"{row.min:.6g}",
+                  f"{row.max:.6g}", str(row.count))
+        lines.append(",".join(values) if fmt == "csv" else "  ".join(values))
+    if fmt == "csv":
+        lines.insert(0, "time,measurement,tags,field,mean,min,max,count")
+    return "\n".join(lines)
+
+
+def query_with_prompt(argv: list):
+    """The query subcommand, prints readings kept in the local store."""
+    parser = argparse.ArgumentParser(
+        prog="sensorpi query", description="Print readings from the local store.")
+    parser.add_argument("--config", "-c", type=str,
+                        help="config.edn file with the :store to read.")
+    parser.add_argument("--db", type=str, help="Path of the store, instead of the config.")
+    parser.add_argument("--sensor", "-s", type=str, help="Only readings of this sensor.")
+    parser.add_argument("--field", "-f", type=str, help="Only this field.")
+    parser.add_argument("--measurement", "-m", type=str, help="Only this measurement.")
+    parser.add_argument("--since", type=str, default="1h",
+                        help="Start, a duration before now like 15m, 2h, 1d or a unix time.")
+    parser.add_argument("--until", type=str, help="End, like --since. Default is now.")
+    parser.add_argument("--every", "-e", type=float,
+                        help="Downsample to the mean, min and max of buckets of these seconds.")
+    parser.add_argument("--list", "-l", action="store_true", help="List the stored series.")
+    parser.add_argument("--format", choices=["table", "csv", "json"], default="table")
+    args = parser.parse_args(argv)
+    path = args.db
+    if path is None:
+        config, _ = load_config(args.config or find_config())
+        if "store" not in config:
+            parser.error("The config has no :store, use --db.")
+        path = config["store"]["path"]
+    from .store import LocalStore
+    with LocalStore(path) as store:
+        if args.list:
+            for measurement, tags, field, count, first, last in store.series():
+                tags = ",".join(f"{k}={v}" for k, v in sorted(tags.items()))
+                print(f"{measurement}  {tags}  {field}  {count} samples  "
+                      f"{datetime.fromtimestamp(first).isoformat(timespec='seconds')} - "
+                      f"{datetime.fromtimestamp(last).isoformat(timespec='seconds')}")
+            return
+        now = datetime.now().timestamp()
+        rows = store.query(args.sensor, args.field, args.measurement,
+                           parse_time(args.since, now),
+                           parse_time(args.until, now) if args.until else None, args.every)
+    output = format_rows(rows, args.format)
+    if output:
+        print(output)
+
+
+def replay_trace(path: str, sensors, writer, seconds: float = 10.0, speed: float = 1.0,
+                 retime: bool = False, store=None) -> int:
+    """Sends the cycles of a recorded trace through the pipeline to the writer.
+
+    The sensors are not read, their config is only needed for the
+    aggregation and the deadband.
+
+    Args:
+        path: The path of the trace.
+        sensors: The sensors from config.
+        writer: The writer the points are written to.
+        seconds: The interval of sensors without their own :interval.
+        speed: Factor of the pace, 0 replays as fast as possible.
+        retime: Shifts the times of the points, as if the first cycle was now.
+        store: A LocalStore, every reading is kept in it as well.
+
+    Returns:
+        cycles: The number of cycles replayed.
+
+    """
+    aggregator = create_aggregator(seconds, sensors)
+    deadband = DeadbandFilter(sensors)
+    cycles = points = 0
+    start = time.perf_counter()
+    try:
+        for cycle in trace.replay(path, speed, retime):
+            points += process(cycle.points, cycle.timestamp, writer, store, aggregator,
+                              deadband) or 0
+            cycles += 1
+    except KeyboardInterrupt:
+        log.warning("Replay stopped.")
+    finally:
+        if aggregator is not None:
+            writer.write(aggregator.flush())
+    log.info(f"Replayed {cycles} cycles, {points} points in {time.perf_counter() - start:.1f} s.")
+    return cycles
+
+
+def replay_with_prompt(argv: list):
+    """The replay subcommand, sends a recorded trace through the pipeline."""
+    parser = argparse.ArgumentParser(
+        prog="sensorpi replay", description="Send a recorded trace through the pipeline.")
+    parser.add_argument("trace", help="The trace, recorded with --record.")
+    parser.add_argument("--config", "-c", type=str,
+                        help="config.edn with the sensors and where to write to.")
+    parser.add_argument("--speed", "-s", type=float, default=1.0,
+                        help="Replay this many times faster than recorded, 0 as fast as possible.")
+    parser.add_argument("--interval", "-i", type=float, default=10.0,
+                        help="Interval of sensors without their own :interval.")
+    parser.add_argument("--retime", action="store_true",
+                        help="Shift the times of the points, as if the trace started now.")
+    parser.add_argument("--stdout", action="store_true",
+                        help="Print the points as line protocol instead of writing them.")
+    args = parser.parse_args(argv)
+    config, _ = load_config(args.config or find_config())
+    sensors = config.get("sensors") or {}
+    if args.stdout:
+        from .sinks import QueuedSink, StdoutSink
+        writer = FanOut({"stdout": QueuedSink(StdoutSink("stdout"), flush_interval=0.1)}, sensors)
+    else:
+        writer = create_output(config, sensors)
     try:
-        sensors = config["sensors"]
-        loop(seconds, sensors, measurement, config)
-    except KeyError:
-        log.warning("No sensors defined. Add them in the config.edn file!")
+        replay_trace(args.trace, sensors, writer, args.interval, args.speed, args.retime)
+    finally:
+        writer.close()
+
+
+def relay_with_prompt(argv: list):
+    """The relay subcommand, writes the points of many nodes to influx together."""
+    from .relay import PORT, Relay
+    parser = argparse.ArgumentParser(
+        prog="sensorpi relay",
+        description="Receive the points of many nodes and write them to influx in large batches.")
+    parser.add_argument("--config", "-c", type=str,
+                        help="config.edn with the :influxdb and the :relay options.")
+    parser.add_argument("--host", type=str, help="Address to listen on, default 0.0.0.0.")
+    parser.add_argument("--port", "-p", type=int, help=f"Port to listen on, default {PORT}.")
+    args = parser.parse_args(argv)
+    config, _ = load_config(args.config or find_config())
+    options = {k.replace("-", "_"): v for k, v in (config.get("relay") or {}).items()}
+    if args.host is not None:
+        options["host"] = args.host
+    if args.port is not None:
+        options["port"] = args.port
+    # the nodes send nanoseconds, the relay writes the lines as they are
+    writer = create_writer({**config["influxdb"], "precision": "ns"})
+    try:
+        asyncio.run(Relay(writer, **options).run())
+    finally:
+        writer.close()
 
 
 def main_with_prompt():
+    if sys.argv[1:2] == ["query"]:
+        return query_with_prompt(sys.argv[2:])
+    if sys.argv[1:2] == ["replay"]:
+        return replay_with_prompt(sys.argv[2:])
+    if sys.argv[1:2] == ["relay"]:
+        return relay_with_prompt(sys.argv[2:])
     parser = argparse.ArgumentParser(
         description="Run measurements from different sensors and send data to an influx db.")
     parser.add_argument("--config", "-c", type=argparse.FileType("r"),
@@ -183,8 +566,21 @@ def main_with_prompt():
                         help="Measurement name.")
     parser.add_argument("--newconfig", "-n", type=str,
                         help="Creates a new config at the given path.")
-    parser.add_argument("--interval", "-i", type=int,
-                        help="Interval between measurements in seconds.")
+    parser.add_argument("--interval", "-i", type=float,
+                        help="Interval between measurements in seconds, "
+                        "for sensors without their own :interval.")
+    parser.add_argument("--workers", "-w", type=int, default=0,
+                        help="Read sensors in parallel with this many threads.")
+    parser.add_argument("--runtime", choices=["threads", "asyncio"], default="threads",
+                        help="asyncio runs the reads as tasks and never waits for the database.")
+    parser.add_argument("--record", type=str,
+                        help="Record the readings to this trace, for sensorpi replay.")
+    parser.add_argument("--profile", type=str,
+                        help="Write how long every stage of the cycles takes to this Chrome "
+                        "trace, open it in ui.perfetto.dev or chrome://tracing.")
+    parser.add_argument("--profile-every", type=int, default=0,
+                        help="With --profile, run every Nth cycle under cProfile. The 5 slowest "
+                        "are kept as .prof files next to the trace.")
     parser.add_argument("--verbose", "-v", action="count", default=0)
     args = parser.parse_args()
     if args.newconfig is not None:
@@ -195,13 +591,21 @@ def main_with_prompt():
     if args.measurement is None:
         args.measurement = input("Name of the measurement: ")
     if args.interval is None:
-        args.interval = int(input("Wait seconds between measurements: "))
+        args.interval = float(input("Wait seconds between measurements: "))
     if args.config is None:
-        config = read_config(find_config())
+        config_path = find_config()
     else:
         args.config.close()  # We actually dont need the stream, just the name.
-        config = read_config(args.config.name)
-    main(args.interval, args.measurement, config, args.verbose)
+        config_path = args.config.name
+    if args.profile:
+        profiler.start(args.profile, sample_every=args.profile_every)
+    try:
+        with profiler.span("config", stage="read"):
+            config, digest = load_config(config_path)
+        main(args.interval, args.measurement, config, args.verbose, args.workers,
+             config_path, digest, args.runtime, args.record)
+    finally:
+        profiler.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+import logging
+import math
+import numbers
+
+import numpy as np
+
+from .points import Point
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+
+class RingBuffer:
+    """Fixed-size buffer of samples with several fields each.
+
+    The samples are rows of a preallocated float array, missing fields are
+    NaN. When the buffer is full the oldest sample is overwritten.
+
+    Args:
+        capacity: Maximum number of samples.
+        columns: Number of fields, more are added with add_column().
+
+    """
+
+    def __init__(self, capacity: int, columns: int = 1):
+        self.capacity = capacity
+        self.values = np.full((capacity, columns), np.nan)
+        self.start = 0
+        self.size = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.size
+
+    def add_column(self):
+        self.values = np.hstack([self.values, np.full((self.capacity, 1), np.nan)])
+
+    def append(self) -> np.ndarray:
+        """Returns the row of a new sample, filled with NaN."""
+        if self.size == self.capacity:
+            self.start = (self.start + 1) % self.capacity
+            self.dropped += 1
+        else:
+            self.size += 1
+        row = self.values[(self.start + self.size - 1) % self.capacity]
+        row.fill(np.nan)
+        return row
+
+    def window(self) -> np.ndarray:
+        """Returns all samples, oldest first. A view if they do not wrap around."""
+        end = self.start + self.size
+        if end <= self.capacity:
+            return self.values[self.start:end]
+        return np.concatenate([self.values[self.start:], self.values[:end - self.capacity]])
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
+
+
+def summarize(window: np.ndarray):
+    """Returns mean, min, max, population stddev and count of every column, ignoring NaN."""
+    valid = ~np.isnan(window)
+    count = valid.sum(axis=0)
+    filled = np.where(valid, window, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = filled.sum(axis=0) / count
+        std = np.sqrt((np.where(valid, window - mean, 0.0) ** 2).sum(axis=0) / count)
+    low = np.where(valid, window, np.inf).min(axis=0)
+    high = np.where(valid, window, -np.inf).max(axis=0)
+    return mean, low, high, std, count
+
+
+class _Series:
+    """The window of one measurement and tag set."""
+    __slots__ = ("buffer", "columns", "others", "window")
+
+    def __init__(self, capacity: int, window: int):
+        self.buffer = RingBuffer(capacity, 0)
+        self.columns = {}  # field -> column
+        self.others = {}  # last value of fields that are not numbers
+        self.window = window  # index of the current window
+
+
+class Aggregator:
+    """Aggregates the points of oversampled sensors over fixed windows.
+
+    Sensors with {:aggregate {:window 60}} in the config are sampled at
+    their :interval, but instead of every sample only one point per window
+    is written, with the fields <field>_mean, <field>_min, <field>_max,
+    <field>_std and <field>_count. The mean is a float, it has its own name
+    so it does not clash with integer fields of the raw samples in the same
+    measurement. Fields that are not numbers keep their last value. The
+    aggregated points get the tag window (e.g. "60s") and the start of the
+    window as time.
+
+    With {:aggregate {:window 60 :raw true}} the samples are written as well.
+    Points of other sensors are passed through unchanged.
+
+    The samples of each window are kept in a RingBuffer with room for twice
+    the samples expected per window.
+
+    Args:
+        sensors: The sensors of the config, or the sensors of a compiled Plan.
+        default_interval: The interval of sensors without :interval.
+
+    Examples:
+        aggregator = Aggregator(sensors, seconds)
+        writer.write(aggregator.add(data))
+        writer.write(aggregator.flush())
+
+    """
+
+    def __init__(self, sensors, default_interval: float):
+        self._series = {}  # (measurement, tags) -> _Series
+        self._options = {}  # sensor name -> (window in ns, raw, capacity)
+        self.update(sensors, default_interval)
+
+    def update(self, sensors, default_interval: float):
+        """Takes the options of changed sensors, the windows of unchanged ones are kept."""
+        old, self._options = self._options, {}
+        for name in sensors:
+            options = sensors[name].get("aggregate")
+            if not options:
+                continue
+            window = options["window"]
+            interval = sensors[name].get("interval", default_interval)
+            capacity = max(16, 2 * math.ceil(window / interval))
+            self._options[str(name)] = (round(window * 1e9), options.get("raw", False), capacity)
+        for key in list(self._series):
+            sensor = self._sensor(key)
+            if self._options.get(sensor) != old.get(sensor):
+                del self._series[key]
+
+    @staticmethod
+    def _sensor(key) -> str:
+        return str(dict(key[1]).get("sensor"))
+
+    def add(self, points: list) -> list:
+        """Adds the points of a cycle and returns the points to write.
+
+        Args:
+            points: Points as returned by handler.collect_measurements.
+
+        Returns:
+            points: The points of not aggregated sensors, the raw points if
+                enabled, and the aggregated points of windows that ended.
+
+        """
+        if not self._options:
+            return points
+        out = []
+        for point in points:
+            options = self._options.get(str(dict(point.tags).get("sensor")))
+            if options is None or point.time is None:
+                out.append(point)
+                continue
+            window_ns, raw, capacity = options
+            if raw:
+                out.append(point)
+            key = (point.measurement, point.tags)
+            index = point.time // window_ns
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(capacity, index)
+            elif index != series.window:
+                aggregated = self._emit(key, series, window_ns)
+                if aggregated is not None:
+                    out.append(aggregated)
+                series.window = index
+            self._append(series, point)
+        return out
+
+    def flush(self) -> list:
+        """Returns the aggregated points of all windows, also the unfinished ones."""
+        out = []
+        for key, series in self._series.items():
+            window_ns = self._options[self._sensor(key)][0]
+            aggregated = self._emit(key, series, window_ns)
+            if aggregated is not None:
+                out.append(aggregated)
+        return out
+
+    def _append(self, series: _Series, point: Point):
+        values = {}
+        for field, value in point.fields.items():
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, numbers.Real):
+                series.others[field] = value
+            else:
+                values[field] = value
+        for field in values:
+            if field not in series.columns:
+                series.columns[field] = len(series.columns)
+                series.buffer.add_column()
+        if values:
+            row = series.buffer.append()
+            for field, value in values.items():
+                row[series.columns[field]] = value
+
+    def _emit(self, key, series: _Series, window_ns: int):
+        """Returns the aggregated point of the window of the series and clears it."""
+        buffer = series.buffer
+        if not len(buffer) and not series.others:
+            return None
+        if buffer.dropped:
+            log.warning(f"{buffer.dropped} samples of {dict(key[1])} did not fit into the window "
+                        f"and were dropped, is the :interval right?")
+            buffer.dropped = 0
+        fields = {}
+        if len(buffer):
+            mean, low, high, std, count = summarize(buffer.window())
+            for field, column in series.columns.items():
+                if count[column]:
+                    fields[f"{field}_mean"] = float(mean[column])
+                    fields[f"{field}_min"] = float(low[column])
+                    fields[f"{field}_max"] = float(high[column])
+                    fields[f"{field}_std"] = float(std[column])
+                    fields[f"{field}_count"] = int(count[column])
+        fields.update(series.others)
+        buffer.clear()
+        series.others = {}
+        measurement, tags = key
+        window_s = window_ns / 1e9
+        tags = dict(tags, window=f"{window_s:g}s")
+        return Point(measurement, tags, fields, series.window * window_ns)
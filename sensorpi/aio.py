@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""The asyncio runtime, selected with --runtime asyncio.
+
+The scheduler runs in the event loop and starts every tick as a task, the
+blocking driver calls run in worker threads. Points are sent by an
+AsyncInfluxWriter over keep-alive connections, with at most max_in_flight
+requests at a time, so neither slow sensors nor a slow database delay the
+next tick.
+"""
+import asyncio
+import logging
+import signal
+import time
+import urllib.parse
+from concurrent import futures
+from datetime import datetime
+
+from . import pipeline
+from .deadband import DeadbandFilter
+from .metrics import metrics
+from .points import LineProtocolEncoder
+from .profiling import profiler
+from .sensors import handler
+from .sinks import FanOut
+from .writer import rejected
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+DEFAULT_WORKERS = 4  # threads reading sensors, if --workers is not given
+
+
+class DatabaseError(RuntimeError):
+    """The database answered a write with an error status.
+
+    Args:
+        status: The HTTP status of the answer.
+        message: The error message.
+
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncInfluxWriter:
+    """Buffers points and sends them in batches without blocking the event loop.
+
+    Works like the InfluxWriter, but with a small HTTP/1.1 client on asyncio
+    streams instead of the blocking influxdb client. Batches are sent by a
+    sender task when batch_size points are waiting or the oldest point is
+    older than flush_interval seconds. At most max_in_flight requests run at
+    the same time, each on its own keep-alive connection. Points of a failed
+    request are put back into the buffer and retried after flush_interval,
+    unless the database rejected them (see writer.rejected()), then they
+    are dropped.
+
+    start() has to be awaited in the event loop before the first write.
+
+    Args:
+        db: Name of the database.
+        user: Username for the database.
+        password: Password for the database.
+        influx_url: Url of the influxdb.
+        org: Organization, "-" for a v1.8 influxdb.
+        retention_policy: The retention policy of the database.
+        batch_size: Number of points that trigger a flush.
+        flush_interval: Maximum age of a buffered point in seconds.
+        max_buffer: Maximum number of points kept while the database is offline.
+        precision: Precision of the timestamps sent, "s", "ms", "us" or "ns".
+        max_in_flight: Maximum number of concurrent requests.
+        timeout: Seconds until a request counts as failed.
+
+    """
+
+    def __init__(self, db: str, user: str = None, password: str = None,
+                 influx_url: str = "http://localhost:8086",
+                 org: str = "-", retention_policy: str = "autogen",
+                 batch_size: int = 500, flush_interval: float = 10.0,
+                 max_buffer: int = 50_000, precision: str = "ms",
+                 max_in_flight: int = 2, timeout: float = 30.0):
+        url = urllib.parse.urlsplit(influx_url)
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == "https" else 80)
+        self.ssl = url.scheme == "https"
+        query = urllib.parse.urlencode({"org": org, "bucket": f"{db}/{retention_policy}",
+                                        "precision": precision})
+        self.path = f"{url.path.rstrip('/')}/api/v2/write?{query}"
+        self.token = f"{user}:{password}"
+        self.name = "influx"  # of the sink in the metrics
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.encoder = LineProtocolEncoder(precision)
+        self._buffer = []
+        self._oldest = None  # monotonic time of the oldest buffered point
+        self._retry_at = 0.0  # no sends before, after a failed one
+        self._idle = []  # keep-alive connections, (reader, writer)
+        self._in_flight = set()  # tasks of running requests
+        # created in start(), asyncio objects belong to the running event loop
+        self._semaphore = None
+        self._wakeup = None
+        self._sender = None
+        self._closed = False
+
+    def __len__(self):
+        return len(self._buffer)
+
+    async def start(self):
+        """Starts the sender task."""
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._wakeup = asyncio.Event()
+        self._sender = asyncio.create_task(self._send_periodically())
+
+    def write(self, data: list):
+        """Adds the points to the buffer, never waits.
+
+        Args:
+            data: A list of points as returned by handler.collect_measurements.
+
+        """
+        if not data:
+            return
+        if not self._buffer:
+            self._oldest = time.monotonic()
+        self._buffer.extend(data)
+        self._trim()
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Sends all buffered points and waits until every request is done."""
+        remaining = len(self._buffer)
+        while remaining > 0 and self._buffer:
+            remaining -= min(self.batch_size, len(self._buffer))
+            await self._send_batch()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    async def close(self):
+        """Stops the sender, sends the remaining points and closes the connections."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._sender is not None:
+            self._sender.cancel()
+            await asyncio.gather(self._sender, return_exceptions=True)
+            await self.flush()
+        if self._buffer:
+            log.warning(f"Could not send {len(self._buffer)} buffered points on exit!")
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+    def _trim(self):
+        dropped = len(self._buffer) - self.max_buffer
+        if dropped > 0:
+            del self._buffer[:dropped]
+            log.warning(f"Writer buffer full, dropped {dropped} points!")
+
+    async def _send_periodically(self):
+        """Runs as task and sends full batches and points older than flush_interval."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), min(1.0, self.flush_interval))
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            now = time.monotonic()
+            if now < self._retry_at:
+                continue
+            while (self._buffer and time.monotonic() >= self._retry_at
+                   and (len(self._buffer) >= self.batch_size
+                        or now - self._oldest >= self.flush_interval)):
+                await self._send_batch()
+
+    async def _send_batch(self):
+        """Takes a batch from the buffer and sends it as soon as a request is free."""
+        await self._semaphore.acquire()
+        batch = self._buffer[:self.batch_size]
+        del self._buffer[:self.batch_size]
+        oldest = self._oldest
+        if not self._buffer:
+            self._oldest = None
+        task = asyncio.create_task(self._send(batch, oldest))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch: list, oldest: float = None):
+        """Sends the batch, oldest is the monotonic time its first point was buffered."""
+        start = time.perf_counter()
+        ok = False
+        try:
+            with profiler.span("serialize"):
+                body = self.encoder.encode(batch)
+            await asyncio.wait_for(self._post(body), self.timeout)
+            ok = True
+        except Exception as e:
+            log.warning(f"{type(e).__name__}: {e}")
+            if rejected(e):
+                metrics.observe_rejected(self.name, len(batch))
+                log.warning(f"The database rejected {len(batch)} points, they are dropped!")
+                return
+            log.warning("Could not send data to database! Is it online?")
+            oldest = time.monotonic() if oldest is None else oldest
+            if self._buffer:
+                oldest = min(oldest, self._oldest)
+            self._oldest = oldest  # the batch is back in front of the buffer
+            self._buffer[:0] = batch
+            self._trim()
+            self._retry_at = time.monotonic() + self.flush_interval
+        finally:
+            metrics.observe_write(self.name, time.perf_counter() - start, ok, len(batch))
+            self._semaphore.release()
+
+    async def _post(self, body: bytes):
+        if self._idle:
+            try:
+                return await self._request(self._idle.pop(), body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass  # the server closed the idle connection, open a new one
+        connection = await asyncio.open_connection(self.host, self.port, ssl=self.ssl or None)
+        return await self._request(connection, body)
+
+    async def _request(self, connection, body: bytes):
+        reader, writer = connection
+        head = (f"POST {self.path} HTTP/1.1\r\n"
+                f"Host: {self.host}:{self.port}\r\n"
+                f"Authorization: Token {self.token}\r\n"
+                "Content-Type: text/plain; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n")
+        try:
+            writer.write(head.encode() + body)
+            await writer.drain()
+            status, headers, response = await _read_response(reader)
+        except BaseException:
+            writer.close()
+            raise
+        if headers.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            self._idle.append(connection)
+        if not 200 <= status < 300:
+            raise DatabaseError(status, f"Database answered {status}: "
+                                        f"{response.decode(errors='replace')[:200]}")
+
+
+async def _read_response(reader: asyncio.StreamReader):
+    """Reads a HTTP/1.1 response and returns status, lower case headers and body."""
+    status = int((await reader.readuntil(b"\r\n")).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        if line == b"\r\n":
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        body = b""
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            chunk = await reader.readexactly(size + 2)
+            if not size:
+                break
+            body += chunk[:-2]
+    else:
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return status, headers, body
+
+
+async def read_sensors(sensors, measurement: str, pool) -> list:
+    """Reads the sensors in the worker threads of pool and waits for their deadlines.
+
+    Like the parallel mode of handler.collect_measurements: sensors on the
+    same bus are read one after another, a sensor that is not done within
+    its :timeout is reported as missing and skipped until its read is done.
+
+    Returns:
+        readings: Pairs of sensor name and the data its function returned.
+
+    """
+    async def read(name, sensor):
+        started = handler.start_read(name, sensor, measurement, pool)
+        if started is None:
+            return name, None
+        future = asyncio.wrap_future(started)
+        timeout = sensor.get("timeout", handler.DEFAULT_TIMEOUT)
+        try:
+            return name, await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            handler.cancel_read(name, started)  # never started, e.g. all workers are hung
+            metrics.observe_timeout(name)
+            log.warning(f"Sensor {name} missed its deadline of {timeout:.1f} seconds!")
+        except KeyError:
+            log.warning(f"Sensor {sensor} is found in your config.edn "
+                        f"but the type {sensor.get('type')} is not implemented (yet). "
+                        "No measurement was taken for this sensor!")
+        except Exception as e:
+            log.warning(f"{e}")
+        return name, None
+
+    return await asyncio.gather(*(read(name, sensors[name]) for name in sensors))
+
+
+def _blocks(writer) -> bool:
+    """Returns whether writing may block, true for all but the asyncio writers."""
+    return not asyncio.iscoroutinefunction(writer.close)
+
+
+async def process(data: list, timestamp: float, writer, store=None, aggregator=None,
+                  deadband=None, reporter=None, executor=None):
+    """Like pipeline.process, without blocking the event loop.
+
+    The store commits to sqlite and writers like the SpooledWriter append to
+    disk, so they are written in executor. With a single thread the writes
+    stay in the order of the cycles.
+
+    Returns:
+        points: The number of points written, None if the writer failed.
+
+    """
+    event_loop = asyncio.get_running_loop()
+    stored = None
+    if store is not None:
+        stored = event_loop.run_in_executor(executor, pipeline.write_to_store, store, list(data))
+    data = pipeline.transform(data, timestamp, aggregator, deadband, reporter)
+    if _blocks(writer):
+        written = await event_loop.run_in_executor(executor, pipeline.write, writer, data)
+    else:
+        written = pipeline.write(writer, data)
+    if stored is not None:
+        await stored
+    return written
+
+
+async def cycle(tick, sensors, measurement: str, pool, writer, aggregator=None, reporter=None,
+                deadband=None, store=None, recorder=None, executor=None):
+    """Reads the sensors of the tick and hands their points to the writer."""
+    with profiler.cycle(sample=False):  # the cycles overlap, cProfile would mix them up
+        readings = await read_sensors(sensors, measurement, pool)
+        data = handler.to_points(sensors, readings, tick.timestamp)
+        if recorder is not None:
+            recorder.record(tick.timestamp, data)
+        written = await process(data, tick.timestamp, writer, store, aggregator, deadband,
+                                reporter, executor)
+    if written is not None:
+        log.info(f"{datetime.now().strftime('%H:%M:%S')} Queued {written} points for database.")
+
+
+async def loop(seconds, sensors, measurement, config, writer, workers=0, watcher=None,
+               reporter=None, store=None, recorder=None, stop: asyncio.Event = None):
+    """The main loop of the asyncio runtime, see __main__.loop for the arguments.
+
+    Runs until stop is set, SIGINT or SIGTERM. Then the running cycles are
+    awaited, the unfinished aggregation windows written and the writer closed.
+
+    Args:
+        stop: Event that ends the loop.
+
+    """
+    stop = stop or asyncio.Event()
+    event_loop = asyncio.get_running_loop()
+    signals = []
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            event_loop.add_signal_handler(signum, stop.set)
+            signals.append(signum)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass  # not in the main thread or not supported
+    if hasattr(writer, "start"):
+        await writer.start()
+    pool = handler.WorkerPool(workers or DEFAULT_WORKERS)
+    # the store and blocking writers, one thread keeps their writes in order
+    executor = futures.ThreadPoolExecutor(1, thread_name_prefix="pipeline")
+    cycles = set()
+    aggregator = None
+    try:
+        scheduler = pipeline.create_scheduler(seconds, sensors, config)
+        aggregator = pipeline.create_aggregator(seconds, sensors)
+        deadband = DeadbandFilter(sensors)
+        log.info(f"Program running with asyncio!"
+                 f" Taking measurement every {seconds} seconds."
+                 f" Writing to {pipeline.destination(config)} as measurement {measurement}"
+                 "\nPress Ctrl-C to exit.")
+        next_reload = time.monotonic() + pipeline.RELOAD_INTERVAL
+        while not stop.is_set():
+            tick = scheduler.poll()
+            if tick is None:
+                delay = scheduler.delay()
+                if watcher is not None:
+                    delay = min(delay, max(0.0, next_reload - time.monotonic()))
+                try:
+                    await asyncio.wait_for(stop.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                if watcher is not None and time.monotonic() >= next_reload:
+                    next_reload = time.monotonic() + pipeline.RELOAD_INTERVAL
+                    plan = watcher.poll()
+                    if plan is not None:
+                        sensors = plan.sensors
+                        scheduler.update({name: sensors[name].interval for name in sensors})
+                        aggregator = pipeline.create_aggregator(seconds, sensors, aggregator)
+                        deadband.update(sensors)
+                        if isinstance(writer, FanOut):
+                            writer.update(sensors)
+                continue
+            log.debug(f"Tick for {len(tick.names)} sensors fired {tick.lateness * 1000:.1f} ms late.")
+            due = {name: sensors[name] for name in tick.names if name in sensors}
+            task = asyncio.create_task(cycle(tick, due, measurement, pool, writer,
+                                             aggregator, reporter, deadband, store,
+                                             recorder, executor))
+            cycles.add(task)
+            task.add_done_callback(cycles.discard)
+        log.warning("Program is exiting...")
+    except KeyError as e:
+        log.error(e)
+        log.error("Your config has some error, try to fix it!")
+    finally:
+        for signum in signals:
+            event_loop.remove_signal_handler(signum)
+        if cycles:
+            await asyncio.wait(cycles, timeout=handler.DEFAULT_TIMEOUT)
+        if aggregator is not None:
+            if _blocks(writer):
+                await event_loop.run_in_executor(executor, pipeline.write, writer,
+                                                 aggregator.flush())
+            else:
+                pipeline.write(writer, aggregator.flush())
+        pool.stop()
+        await event_loop.run_in_executor(None, executor.shutdown)
+        if _blocks(writer):  # e.g. the SpooledWriter, it joins its thread
+            await event_loop.run_in_executor(None, writer.close)
+        else:
+            await writer.close()
+
+
+def run(*args, **kwargs):
+    """Runs loop() in a new event loop, takes the arguments of loop()."""
+    asyncio.run(loop(*args, **kwargs))
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+import hashlib
+import inspect
+import logging
+import marshal
+import os
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import NamedTuple
+
+import edn_format
+
+from .profiling import profiler
+from .sensors import handler
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+CACHE_VERSION = 2
+MARSHAL_VERSION = 4
+
+
+class ConfigError(ValueError):
+    """Raised when the config is invalid, with all problems found in it."""
+
+
+def edn_to_map(x) -> dict:
+    """Helper function to turn edn to a python dict.
+
+    Taken from:
+    https://github.com/swaroopch/edn_format/issues/76#issuecomment-749618312
+
+    Args:
+        x: An edn map from edn_format.
+
+    """
+    if isinstance(x, edn_format.ImmutableDict):
+        return {edn_to_map(k): edn_to_map(v) for k, v in x.items()}
+    elif isinstance(x, edn_format.ImmutableList):
+        return [edn_to_map(v) for v in x]
+    elif isinstance(x, edn_format.Keyword):
+        return x.name
+    else:
+        return x
+
+
+def read_config(config_path: str) -> dict:
+    """Reads the given config file and parses it.
+
+    The config should contain data about the influxdb and the sensors.
+    This data is read and put into a dictionary that is used for further usage.
+
+    Args:
+        edn: The path of the config.edn file.
+
+    Returns:
+        config: A dict containing the config data
+
+    """
+    return load_config(config_path)[0]
+
+
+def cache_path(config_path: str) -> str:
+    """Returns the path of the cache next to the config, e.g. .config.edn.cache"""
+    head, tail = os.path.split(config_path)
+    return os.path.join(head, f".{tail}.cache")
+
+
+def load_config(config_path: str):
+    """Reads the config, from the cache if the file did not change.
+
+    Parsing edn is slow on a Pi, so the parsed config is kept next to the
+    config file together with the sha256 of the file. If the hash still
+    matches, the cache is used instead of parsing the file again. The cache
+    is a marshal of plain data, not a pickle, so loading it never runs code.
+    A config with values marshal does not know is not cached.
+
+    Args:
+        config_path: The path of the config.edn file.
+
+    Returns:
+        config: A dict containing the config data.
+        digest: The sha256 of the config file.
+
+    """
+    with open(config_path, "rb") as f:
+        text = f.read()
+    digest = hashlib.sha256(text).hexdigest()
+    cache = cache_path(config_path)
+    try:
+        with open(cache, "rb") as f:
+            version, cached_digest, config = marshal.load(f)
+        if version == CACHE_VERSION and cached_digest == digest and isinstance(config, dict):
+            return config, digest
+    except FileNotFoundError:
+        pass
+    except (OSError, EOFError, ValueError, TypeError) as e:
+        log.debug(f"Ignoring the unreadable config cache {cache}: {e}")
+    config = edn_to_map(edn_format.loads(text.decode()))
+    try:
+        data = marshal.dumps((CACHE_VERSION, digest, config), MARSHAL_VERSION)
+        tmp = f"{cache}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, cache)
+    except (OSError, ValueError) as e:
+        log.debug(f"Could not write config cache {cache}: {e}")
+    return config, digest
+
+
+def freeze(x):
+    """Returns an immutable copy of nested dicts and lists."""
+    if isinstance(x, Mapping):
+        return MappingProxyType({k: freeze(v) for k, v in x.items()})
+    if isinstance(x, (list, tuple)):
+        return tuple(freeze(v) for v in x)
+    return x
+
+
+def _canonical(x):
+    if isinstance(x, Mapping):
+        return tuple(sorted((repr(k), _canonical(v)) for k, v in x.items()))
+    if isinstance(x, (list, tuple)):
+        return tuple(_canonical(v) for v in x)
+    return repr(x)
+
+
+class SensorPlan(Mapping):
+    """The compiled config of a single sensor.
+
+    Behaves like the (immutable) config map of the sensor, so drivers still
+    get it as keyword arguments, but also has everything the handler needs
+    resolved once instead of every cycle.
+
+    Attributes:
+        name: The name of the sensor.
+        config: The immutable config of the sensor.
+        key: The key of the sensor function in the registry.
+        read: The sensor function with name and config bound, read(measurement).
+        bus: The bus the sensor is read over.
+        interval: Seconds between two reads.
+        digest: Hash of the config, equal digests mean an unchanged sensor.
+
+    """
+    __slots__ = ("name", "config", "key", "read", "bus", "interval", "digest")
+
+    def __init__(self, name, config: Mapping, key: str, read, bus: str,
+                 interval: float, digest: str):
+        self.name = name
+        self.config = config
+        self.key = key
+        self.read = read
+        self.bus = bus
+        self.interval = interval
+        self.digest = digest
+
+    def __getitem__(self, key):
+        return self.config[key]
+
+    def __iter__(self):
+        return iter(self.config)
+
+    def __len__(self):
+        return len(self.config)
+
+    def __repr__(self):
+        return f"SensorPlan({self.name!r}, {dict(self.config)!r})"
+
+
+class Plan(NamedTuple):
+    """The compiled config.
+
+    Attributes:
+        config: The immutable config.
+        sensors: Immutable map of sensor name -> SensorPlan.
+        digest: The sha256 of the config file.
+
+    """
+    config: Mapping
+    sensors: Mapping
+    digest: str
+
+
+def _number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+
+
+def _check_rois(name, sensor) -> list:
+    """Returns the problems of the :rois and :metrics of a camera."""
+    from .sensors.analytics import METRICS, check_metric
+    errors = []
+    rois = sensor.get("rois") or {}
+    if not isinstance(rois, Mapping) or not all(
+            isinstance(rect, (list, tuple)) and len(rect) == 4
+            and all(isinstance(v, (int, float)) for v in rect) for rect in rois.values()):
+        errors.append(f"The :rois of sensor {name} have to be a map of names to [x y width height].")
+    metrics = sensor.get("metrics") or []
+    if not isinstance(metrics, (list, tuple)) or not all(
+            isinstance(m, str) and check_metric(m) for m in metrics):
+        errors.append(f"The :metrics of sensor {name} can be {', '.join(METRICS)} "
+                      "and percentiles like p95.")
+    return errors
+
+
+def compile_sensor(name, sensor, default_interval: float, errors: list):
+    """Validates the config of one sensor and resolves its function.
+
+    Problems are appended to errors, None is returned if there were any.
+    The reader of the returned plan is not bound yet, see bind_reader().
+
+    """
+    if not isinstance(sensor, Mapping):
+        errors.append(f"Sensor {name} has to be a map, not {sensor!r}.")
+        return None
+    if not isinstance(sensor.get("type"), str):
+        errors.append(f"Sensor {name} has no :type.")
+        return None
+    key = handler.sensor_key(sensor)
+    try:
+        func = handler.sensor_funcs[key]
+    except KeyError:
+        errors.append(f"Sensor {name} has the type {sensor['type']}"
+                      f"{' with protocol ' + sensor['protocol'] if 'protocol' in sensor else ''},"
+                      " which is not implemented (yet).")
+        return None
+    except Exception as e:
+        errors.append(f"The driver of sensor {name} could not be loaded: {e}")
+        return None
+    for option in ("interval", "timeout", "start-timeout"):
+        if option in sensor and not _number(sensor[option]):
+            errors.append(f"The :{option} of sensor {name} has to be a positive number.")
+    if "cpu" in sensor and not all(isinstance(c, int) and c >= 0 for c in
+                                   (sensor["cpu"] if isinstance(sensor["cpu"], (list, tuple))
+                                    else [sensor["cpu"]])):
+        errors.append(f"The :cpu of sensor {name} has to be a cpu number or a list of them.")
+    if "retry" in sensor and not (isinstance(sensor["retry"], Mapping) and all(
+            isinstance(v, (int, float)) and not isinstance(v, bool) and v >= 0
+            for v in sensor["retry"].values())):
+        errors.append(f"The :retry of sensor {name} needs numbers >= 0 for "
+                      ":budget, :min-period and :max-stale.")
+    if "deadband" in sensor:
+        deadband = sensor["deadband"]
+        bands = [deadband] + list((deadband.get("fields") or {}).values()) \
+            if isinstance(deadband, Mapping) else [None]
+        if not all(isinstance(band, Mapping) and all(
+                isinstance(band.get(k, 0), (int, float)) and band.get(k, 0) >= 0
+                for k in ("abs", "rel", "heartbeat")) for band in bands):
+            errors.append(f"The :deadband of sensor {name} needs numbers >= 0 for "
+                          ":abs, :rel and :heartbeat.")
+    if "rois" in sensor or "metrics" in sensor:
+        errors.extend(_check_rois(name, sensor))
+    if "aggregate" in sensor and not (isinstance(sensor["aggregate"], Mapping)
+                                      and _number(sensor["aggregate"].get("window"))):
+        errors.append(f"The :aggregate of sensor {name} needs a positive :window in seconds.")
+    try:
+        params = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        params = []
+    for param in list(params)[1:]:  # the first one is the measurement
+        if (param.default is param.empty and param.name not in sensor
+                and param.name != "sensor_name"
+                and param.kind in (param.POSITIONAL_OR_KEYWORD, param.KEYWORD_ONLY)):
+            errors.append(f"Sensor {name} needs :{param.name}.")
+    if errors:
+        return None
+    config = freeze(sensor)
+    interval = sensor.get("interval", default_interval)
+    digest = hashlib.sha256(repr((_canonical(sensor), interval)).encode()).hexdigest()
+    return SensorPlan(name, config, key, None, handler.sensor_bus(name, sensor), interval, digest)
+
+
+def bind_reader(plan: SensorPlan) -> SensorPlan:
+    """Binds the function reading the sensor of a compiled plan.
+
+    Isolated sensors replace the worker of their old config here, so this
+    is only done once the whole config is known to be valid.
+
+    """
+    plan.read = handler.sensor_reader(plan.name, plan.config, handler.sensor_funcs[plan.key])
+    return plan
+
+
+def _check_sinks(config: dict, sinks) -> list:
+    """Returns the problems of the :sinks of the config."""
+    from .sinks import POLICIES, SINKS
+    if not isinstance(sinks, Mapping) or not sinks:
+        return ["The :sinks have to be a map of sink names to sinks."]
+    errors = []
+    for name, sink in sinks.items():
+        kind = sink.get("type") if isinstance(sink, Mapping) else None
+        if kind not in ("influx", *SINKS):
+            errors.append(f"Sink {name} needs a :type, one of influx, {', '.join(SINKS)}.")
+            continue
+        if kind == "influx" and "db" not in {**(config.get("influxdb") or {}), **sink}:
+            errors.append(f"Sink {name} needs a :db, or {{:influxdb {{:db ...}}}} in the config.")
+        if kind in ("csv", "parquet") and "path" not in sink:
+            errors.append(f"Sink {name} needs a :path.")
+        if kind == "relay" and "host" not in sink:
+            errors.append(f"Sink {name} needs the :host of the relay.")
+        if sink.get("policy", POLICIES[0]) not in POLICIES:
+            errors.append(f"The :policy of sink {name} has to be one of {', '.join(POLICIES)}.")
+        if not all(_number(sink.get(k, 1)) for k in ("max-points", "batch-size", "flush-interval")):
+            errors.append(f"Sink {name} needs positive numbers for :max-points, :batch-size "
+                          "and :flush-interval.")
+    return errors
+
+
+def compile_config(config: dict, default_interval: float, digest: str = "",
+                   previous: Plan = None) -> Plan:
+    """Validates the config and compiles it into an immutable Plan.
+
+    Args:
+        config: The config as returned by read_config.
+        default_interval: Interval of sensors without :interval.
+        digest: The sha256 of the config file.
+        previous: The plan before a reload. Its unchanged sensors are reused.
+
+    Raises:
+        ConfigError: With all problems found in the config.
+
+    """
+    errors = []
+    sinks = config.get("sinks")
+    if sinks is not None:
+        errors.extend(_check_sinks(config, sinks))
+    elif not isinstance(config.get("influxdb"), Mapping) or "db" not in config["influxdb"]:
+        errors.append("The config needs {:influxdb {:db ...}}.")
+    if not isinstance(config.get("sensors"), Mapping) or not config["sensors"]:
+        errors.append("No sensors defined. Add them in the config.edn file!")
+    sensors = {}
+    for name, sensor in (config.get("sensors") or {}).items():
+        sensor_errors = []
+        plan = compile_sensor(name, sensor, default_interval, sensor_errors)
+        if isinstance(sensor, Mapping) and "sinks" in sensor:
+            names = sensor["sinks"]
+            if not isinstance(names, (list, tuple)) or not isinstance(sinks, Mapping) \
+                    or any(str(n) not in sinks for n in names):
+                sensor_errors.append(f"The :sinks of sensor {name} have to be a list of "
+                                     "sinks defined in {:sinks {...}}.")
+        errors.extend(sensor_errors)
+        if plan is None:
+            continue
+        old = previous.sensors.get(name) if previous is not None else None
+        sensors[name] = old if old is not None and old.digest == plan.digest else plan
+    if errors:
+        raise ConfigError("\n".join(errors))
+    for name, plan in sensors.items():
+        if plan.read is None:  # new or changed
+            bind_reader(plan)
+    return Plan(freeze(config), MappingProxyType(sensors), digest)
+
+
+def load_plan(config_path: str, default_interval: float, previous: Plan = None) -> Plan:
+    """Reads (or takes from the cache) and compiles the config file."""
+    config, digest = load_config(config_path)
+    return compile_config(config, default_interval, digest, previous)
+
+
+class ConfigWatcher:
+    """Watches the config file and compiles it again when it changed.
+
+    Args:
+        config_path: The path of the config.edn file.
+        plan: The plan currently running.
+        default_interval: Interval of sensors without :interval.
+
+    """
+
+    def __init__(self, config_path: str, plan: Plan, default_interval: float):
+        self.config_path = config_path
+        self.plan = plan
+        self.default_interval = default_interval
+        self._stat = self._signature()
+
+    def _signature(self):
+        try:
+            st = os.stat(self.config_path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def poll(self):
+        """Returns the new plan if the config changed, None otherwise.
+
+        An invalid new config is logged and ignored, the old plan keeps running.
+
+        """
+        signature = self._signature()
+        if signature is None or signature == self._stat:
+            return None
+        self._stat = signature
+        try:
+            with profiler.span("config", stage="reload"):
+                plan = load_plan(self.config_path, self.default_interval, self.plan)
+        except Exception as e:
+            log.error(e)
+            log.error("The changed config has some error, keeping the old one!")
+            return None
+        if plan.digest == self.plan.digest:
+            return None
+        old = self.plan
+        self.plan = plan
+        changed = [name for name in plan.sensors if old.sensors.get(name) is not plan.sensors[name]]
+        removed = [name for name in old.sensors if name not in plan.sensors]
+        log.info(f"Config reloaded: {len(changed)} sensors new or changed, {len(removed)} removed.")
+        for part in set(old.config) | set(plan.config):
+            if part != "sensors" and old.config.get(part) != plan.config.get(part):
+                log.warning(f"Changes of :{part} only take effect after a restart.")
+        return plan
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import logging
+import math
+import numbers
+from array import array
+
+from .points import Point
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+
+class _SensorState:
+    """The thresholds and the last sent values of the series of one sensor.
+
+    Every field gets a column. For every series (measurement and tags, a
+    ds18b20 sensor has one per probe) the last sent value and the time it
+    was sent are kept per column in an array("d") and an array("q").
+
+    """
+    __slots__ = ("options", "columns", "absolute", "relative", "heartbeat", "series")
+
+    def __init__(self, options):
+        self.options = options
+        self.columns = {}  # field -> column
+        self.absolute = array("d")  # per column
+        self.relative = array("d")
+        self.heartbeat = round(options.get("heartbeat", 0) * 1e9)
+        self.series = {}  # (measurement, tags) -> (last values, sent at)
+
+    def column(self, field) -> int:
+        column = self.columns.get(field)
+        if column is None:
+            column = self.columns[field] = len(self.columns)
+            band = {**self.options, **(self.options.get("fields") or {}).get(field, {})}
+            self.absolute.append(band.get("abs", 0.0))
+            self.relative.append(band.get("rel", 0.0))
+        return column
+
+
+class DeadbandFilter:
+    """Only lets through the fields of a sensor that changed noticeably.
+
+    Configured per sensor with
+        {:deadband {:abs 0.1 :rel 0.01 :heartbeat 900 :fields {:humidity {:abs 1}}}}
+
+    A numeric field is sent when it moved further than its band from the
+    value sent last, the band being the larger one of :abs and :rel times
+    that value. A field is sent anyway when it was not sent for :heartbeat
+    seconds, so flat series still show up. :fields overrides the band for
+    single fields. Other fields (strings, bools) are sent along whenever a
+    point is sent. Points without any field to send are dropped.
+
+    Points of sensors without :deadband are passed through.
+
+    Args:
+        sensors: The sensors of the config, or the sensors of a compiled Plan.
+
+    Examples:
+        deadband = DeadbandFilter(sensors)
+        writer.write(deadband.filter(data))
+
+    """
+
+    def __init__(self, sensors):
+        self._states = {}  # sensor name -> _SensorState
+        self.passed = 0
+        self.dropped = 0
+        self.update(sensors)
+
+    def update(self, sensors):
+        """Takes the options of changed sensors, the state of unchanged ones is kept."""
+        states = {}
+        for name in sensors:
+            options = sensors[name].get("deadband")
+            if not options:
+                continue
+            state = self._states.get(str(name))
+            states[str(name)] = state if state is not None and state.options == options \
+                else _SensorState(options)
+        self._states = states
+
+    def filter(self, points: list) -> list:
+        """Returns the points, with the fields that did not change enough removed.
+
+        Args:
+            points: Points as returned by handler.collect_measurements.
+
+        """
+        if not self._states:
+            return points
+        out = []
+        for point in points:
+            state = self._states.get(str(dict(point.tags).get("sensor")))
+            if state is None or point.time is None:
+                out.append(point)
+                continue
+            fields = self._changed(state, point)
+            if fields:
+                self.passed += 1
+                out.append(fields if isinstance(fields, Point) else
+                           Point(point.measurement, dict(point.tags), fields, point.time))
+            else:
+                self.dropped += 1
+        return out
+
+    def _changed(self, state: _SensorState, point: Point):
+        """Returns the point if all fields are sent, the fields to send or an empty dict."""
+        key = (point.measurement, point.tags)
+        series = state.series.get(key)
+        if series is None:
+            series = state.series[key] = (array("d"), array("q"))
+        last, sent_at = series
+        changed = {}
+        others = {}
+        for field, value in point.fields.items():
+            if isinstance(value, bool) or not isinstance(value, numbers.Real):
+                others[field] = value
+                continue
+            column = state.column(field)
+            while len(last) <= column:
+                last.append(math.nan)
+                sent_at.append(0)
+            previous = last[column]
+            band = max(state.absolute[column], state.relative[column] * abs(previous))
+            if (math.isnan(previous) or abs(value - previous) > band
+                    or (state.heartbeat and point.time - sent_at[column] >= state.heartbeat)):
+                last[column] = value
+                sent_at[column] = point.time
+                changed[field] = value
+        if not changed:
+            return {}
+        if len(changed) + len(others) == len(point.fields):
+            return point
+        changed.update(others)
+        return changed
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .points import Point
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+# Upper bounds of the histogram buckets in seconds, from fast i2c reads
+# up to the camera and hanging sensors.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Counts observed durations in fixed buckets.
+
+    Observing is a bisect and two additions, cheap enough for every read.
+
+    Args:
+        buckets: Sorted upper bounds of the buckets, one more bucket
+            counts everything above the last bound.
+
+    """
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Returns the upper bound of the bucket the q quantile (0 to 1) falls into."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class _Stats:
+    """Counters of one sensor or sink."""
+    __slots__ = ("histogram", "ok", "failures", "timeouts", "points", "rejected")
+
+    def __init__(self):
+        self.histogram = Histogram()
+        self.ok = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.points = 0
+        self.rejected = 0
+
+
+class Metrics:
+    """Collects the read durations of the sensors and the writes of the sinks.
+
+    Every read and write is observed with its duration and whether it
+    worked. Queue depths are gauges, functions that are called only when
+    the metrics are published.
+
+    Examples:
+        metrics.observe_read("dht11", 0.25, ok=False)
+        metrics.gauge("influx", "queue", lambda: len(writer))
+        points = metrics.points("sensorpi", time.time_ns())
+
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._reads = {}  # sensor name -> _Stats
+        self._writes = {}  # sink name -> _Stats
+        self._gauges = {}  # (sink name, gauge name) -> function
+        self._lock = threading.Lock()
+
+    def observe_read(self, sensor, seconds: float, ok: bool = True, points: int = 0):
+        """Records a read of the sensor."""
+        with self._lock:
+            stats = self._reads.get(sensor)
+            if stats is None:
+                stats = self._reads[sensor] = _Stats()
+            stats.histogram.observe(seconds)
+            if ok:
+                stats.ok += 1
+                stats.points += points
+            else:
+                stats.failures += 1
+
+    def observe_timeout(self, sensor):
+        """Records that the sensor missed its deadline."""
+        with self._lock:
+            stats = self._reads.get(sensor)
+            if stats is None:
+                stats = self._reads[sensor] = _Stats()
+            stats.timeouts += 1
+
+    def observe_write(self, sink: str, seconds: float, ok: bool = True, points: int = 0):
+        """Records a write (one request) of the sink."""
+        with self._lock:
+            stats = self._writes.get(sink)
+            if stats is None:
+                stats = self._writes[sink] = _Stats()
+            stats.histogram.observe(seconds)
+            if ok:
+                stats.ok += 1
+                stats.points += points
+            else:
+                stats.failures += 1
+
+    def observe_rejected(self, sink: str, points: int):
+        """Records points the database rejected for good, they are not sent again."""
+        with self._lock:
+            stats = self._writes.get(sink)
+            if stats is None:
+                stats = self._writes[sink] = _Stats()
+            stats.rejected += points
+
+    def gauge(self, sink: str, name: str, func):
+        """Registers a function returning the current value of a gauge, e.g. a queue depth."""
+        with self._lock:
+            self._gauges[sink, name] = func
+
+    def remove_gauge(self, sink: str, name: str):
+        with self._lock:
+            self._gauges.pop((sink, name), None)
+
+    def _gauge_values(self) -> dict:
+        values = {}
+        for key, func in list(self._gauges.items()):
+            try:
+                values[key] = func()
+            except Exception as e:
+                log.debug(f"Gauge {key} failed: {e}")
+        return values
+
+    def points(self, measurement: str = "sensorpi", time_ns: int = None) -> list:
+        """Returns the current metrics as points of their own measurement.
+
+        The counters are totals since the start, the durations are in seconds.
+
+        """
+        points = []
+        with self._lock:
+            for kind, stats_by_name in (("sensor", self._reads), ("sink", self._writes)):
+                for name, stats in stats_by_name.items():
+                    h = stats.histogram
+                    fields = {"ok": stats.ok, "failures": stats.failures, "points": stats.points,
+                              "seconds_sum": h.sum, "seconds_max": h.max,
+                              "seconds_p50": h.quantile(0.5), "seconds_p95": h.quantile(0.95),
+                              "seconds_p99": h.quantile(0.99)}
+                    if kind == "sensor":
+                        fields["timeouts"] = stats.timeouts
+                    else:
+                        fields["rejected"] = stats.rejected
+                    points.append(Point(measurement, {kind: str(name)}, fields, time_ns))
+        gauges = {}
+        for (sink, name), value in self._gauge_values().items():
+            gauges.setdefault(sink, {})[name] = value
+        for sink, fields in gauges.items():
+            points.append(Point(measurement, {"sink": sink}, fields, time_ns))
+        return points
+
+    def prometheus(self) -> str:
+        """Returns the metrics in the prometheus text format."""
+        lines = []
+        with self._lock:
+            for kind, metric, stats_by_name in (("sensor", "sensorpi_read", self._reads),
+                                                 ("sink", "sensorpi_write", self._writes)):
+                if not stats_by_name:
+                    continue
+                lines.append(f"# TYPE {metric}_seconds histogram")
+                for name, stats in stats_by_name.items():
+                    label = f'{kind}="{_label(name)}"'
+                    h = stats.histogram
+                    cumulative = 0
+                    for bound, count in zip(h.buckets, h.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_seconds_bucket{{{label},le="+Inf"}} {h.count}')
+                    lines.append(f"{metric}_seconds_sum{{{label}}} {h.sum}")
+                    lines.append(f"{metric}_seconds_count{{{label}}} {h.count}")
+                extra = ("timeouts",) if kind == "sensor" else ("rejected",)
+                for counter in ("ok", "failures", "points") + extra:
+                    lines.append(f"# TYPE {metric}_{counter}_total counter")
+                    for name, stats in stats_by_name.items():
+                        lines.append(f'{metric}_{counter}_total{{{kind}="{_label(name)}"}} '
+                                     f"{getattr(stats, counter)}")
+        gauges = self._gauge_values()
+        for gauge in sorted({name for _, name in gauges}):
+            lines.append(f"# TYPE sensorpi_{gauge} gauge")
+            for (sink, name), value in gauges.items():
+                if name == gauge:
+                    lines.append(f'sensorpi_{gauge}{{sink="{_label(sink)}"}} {value}')
+        lines.append("# TYPE sensorpi_start_time_seconds gauge")
+        lines.append(f"sensorpi_start_time_seconds {self.started}")
+        return "\n".join(lines) + "\n"
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+class Reporter:
+    """Publishes the metrics as points every interval seconds.
+
+    Args:
+        metrics: The Metrics to publish.
+        interval: Seconds between two reports.
+        measurement: The measurement of the points.
+
+    Examples:
+        data.extend(reporter.poll(tick.timestamp))
+
+    """
+
+    def __init__(self, metrics: Metrics, interval: float = 60.0, measurement: str = "sensorpi"):
+        self.metrics = metrics
+        self.interval = interval
+        self.measurement = measurement
+        self._next = time.monotonic() + interval
+
+    def poll(self, timestamp: float) -> list:
+        """Returns the metrics points if a report is due, an empty list otherwise.
+
+        Args:
+            timestamp: Unix time in seconds of the points.
+
+        """
+        now = time.monotonic()
+        if now < self._next:
+            return []
+        self._next = now + self.interval
+        return self.metrics.points(self.measurement, round(timestamp * 1e9))
+
+
+class MetricsServer:
+    """Serves metrics.prometheus() at /metrics for scraping.
+
+    Args:
+        metrics: The Metrics to serve.
+        port: The port to listen on.
+        host: The address to listen on, only local by default.
+
+    """
+
+    def __init__(self, metrics: Metrics, port: int = 9108, host: str = "127.0.0.1"):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="metrics-server", daemon=True)
+        self._thread.start()
+        log.info(f"Serving metrics at http://{host}:{self.port}/metrics")
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# The metrics of this process, observed by the handler and the writers.
+metrics = Metrics()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""The steps of a measurement cycle shared by the runtimes.
+
+What happens to the points of a cycle between reading the sensors and
+the writer, and the helpers both loops set up the cycles with.
+"""
+import logging
+
+from .profiling import profiler
+from .scheduler import Scheduler
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+RELOAD_INTERVAL = 2.0  # seconds between checks whether the config changed
+
+
+def destination(config) -> str:
+    """Returns where the points are written to, for the log."""
+    if "sinks" in config:
+        return f"sinks {', '.join(map(str, config['sinks']))}"
+    return f"database {config['influxdb']['db']}"
+
+
+def create_scheduler(seconds, sensors, config) -> Scheduler:
+    """Creates the scheduler from the :interval of every sensor.
+
+    Args:
+        seconds: The interval of sensors without their own :interval.
+        sensors: The sensors from config
+        config: the config file, the policy for missed deadlines
+            is read from {:scheduler {:missed "skip"}}.
+
+    Returns:
+        scheduler: The scheduler for the main loop.
+
+    """
+    scheduler = config.get("scheduler", {})
+    return Scheduler({name: sensors[name].get("interval", seconds) for name in sensors},
+                     policy=scheduler.get("missed", "skip"),
+                     max_lateness=scheduler.get("max-lateness", 0.5))
+
+
+def create_aggregator(seconds, sensors, aggregator=None):
+    """Creates the aggregator for sensors with :aggregate, or updates it after a reload.
+
+    Args:
+        seconds: The interval of sensors without their own :interval.
+        sensors: The sensors from config
+        aggregator: The aggregator before a reload.
+
+    Returns:
+        aggregator: The Aggregator, None if no sensor is aggregated.
+
+    """
+    if aggregator is not None:
+        aggregator.update(sensors, seconds)
+        return aggregator
+    if not any("aggregate" in sensors[name] for name in sensors):
+        return None
+    from .aggregate import Aggregator  # needs numpy, only import it when used
+    return Aggregator(sensors, seconds)
+
+
+def write_to_store(store, data: list):
+    """Writes the readings to the local store, a failing store does not stop the loop."""
+    try:
+        store.write(data)
+    except Exception as e:
+        log.warning(e)
+        log.warning("Could not write to the local store!")
+
+
+def transform(data: list, timestamp: float, aggregator=None, deadband=None,
+              reporter=None) -> list:
+    """Aggregates the points of a cycle, filters them by the deadband and adds the metrics.
+
+    Returns:
+        data: The points to write, the list given may be extended.
+
+    """
+    with profiler.span("transform"):
+        if aggregator is not None:
+            data = aggregator.add(data)
+        if deadband is not None:
+            data = deadband.filter(data)
+        if reporter is not None:
+            data.extend(reporter.poll(timestamp))
+    return data
+
+
+def write(writer, data: list):
+    """Writes the points of a cycle, a failing writer does not stop the loop.
+
+    Returns:
+        points: The number of points written, None if the writer failed.
+
+    """
+    try:
+        with profiler.span("write", points=len(data)):
+            writer.write(data)
+    except Exception as e:
+        log.warning(e)
+        log.warning("Could not send data to database! Is it online?")
+        return None
+    return len(data)
+
+
+def process(data: list, timestamp: float, writer, store=None, aggregator=None,
+            deadband=None, reporter=None):
+    """Sends the points of a cycle through the pipeline to the writer.
+
+    The points are kept in the store, aggregated, filtered by the deadband
+    and written together with the metrics of the reporter.
+
+    Returns:
+        points: The number of points written, None if the writer failed.
+
+    """
+    if store is not None:
+        write_to_store(store, data)
+    return write(writer, transform(data, timestamp, aggregator, deadband, reporter))
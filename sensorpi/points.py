@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+import math
+import numbers
+import sys
+
+# nanoseconds per unit of each line protocol precision
+PRECISIONS = {"ns": 1, "us": 1_000, "ms": 1_000_000, "s": 1_000_000_000}
+
+_MEASUREMENT_ESCAPES = str.maketrans({",": r"\,", " ": r"\ ", "\n": r"\n"})
+_KEY_ESCAPES = str.maketrans({",": r"\,", "=": r"\=", " ": r"\ ", "\n": r"\n"})
+_STRING_ESCAPES = str.maketrans({'"': r'\"', "\\": r"\\", "\n": r"\n"})
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Point:
+    """A single measurement of a sensor.
+
+    Uses __slots__ instead of the nested dicts of the drivers. Measurement
+    names, tag keys and values and field keys repeat every cycle and are
+    interned, so all points share the same string objects.
+
+    Args:
+        measurement: Name of the measurement.
+        tags: Dictionary of tags, tags that are None or empty are left out,
+            influx rejects empty tag values.
+        fields: Dictionary of fields.
+        time: Unix time in nanoseconds.
+
+    Examples:
+        Point("weather", {"sensor": "DHT11"}, {"humidity": 40.0}, time.time_ns())
+
+    """
+    __slots__ = ("measurement", "tags", "fields", "time")
+
+    def __init__(self, measurement: str, tags: dict, fields: dict, time: int = None):
+        self.measurement = _intern(measurement)
+        # sorted tags are what influx expects and let equal tag sets compare equal
+        self.tags = tuple(sorted((_intern(k), _intern(v)) for k, v in tags.items()
+                                 if v is not None and v != ""))
+        self.fields = {_intern(k): v for k, v in fields.items()}
+        self.time = time
+
+    def __repr__(self):
+        return f"Point({self.measurement!r}, {dict(self.tags)!r}, {self.fields!r}, {self.time!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, Point):
+            return NotImplemented
+        return (self.measurement, self.tags, self.fields, self.time) == \
+            (other.measurement, other.tags, other.fields, other.time)
+
+    @classmethod
+    def from_dict(cls, data: dict, time: int = None) -> "Point":
+        """Creates a point from the json format of the drivers.
+
+        Args:
+            data: A dict with measurement, tags, fields and optionally time
+                in nanoseconds or timestamp in seconds.
+            time: Unix time in nanoseconds, overrides the time of data.
+
+        """
+        if time is None:
+            time = data.get("time")
+            if time is None and data.get("timestamp") is not None:
+                time = round(data["timestamp"] * 1e9)
+        return cls(data["measurement"], data.get("tags", {}), data["fields"], time)
+
+    def as_dict(self) -> dict:
+        """Returns the point in the json format of the influxdb client."""
+        return {"measurement": self.measurement,
+                "tags": dict(self.tags),
+                "fields": dict(self.fields),
+                "time": self.time}
+
+
+def as_dicts(points: list) -> list:
+    """Adapter returning points in the old list of dicts format."""
+    return [point.as_dict() for point in points]
+
+
+class LineProtocolEncoder:
+    """Encodes points to influx line protocol.
+
+    The lines are written into one bytearray that is reused for every call.
+    The escaped names are cached, as they are the same every cycle.
+
+    Args:
+        precision: Precision of the timestamps, one of PRECISIONS.
+            Has to be passed as write precision to the database as well.
+
+    Examples:
+        encoder = LineProtocolEncoder("ms")
+        body = encoder.encode(points)
+
+    """
+
+    def __init__(self, precision: str = "ms"):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision}, use one of {list(PRECISIONS)}")
+        self.precision = precision
+        self._divisor = PRECISIONS[precision]
+        self._buffer = bytearray()
+        self._escaped = {}  # (kind, name) -> escaped bytes
+
+    def encode(self, points: list) -> bytes:
+        """Returns the points as lines separated by newlines.
+
+        Fields that are None, NaN or infinite are left out and points without
+        fields are skipped, influx can not store them.
+
+        """
+        buffer = self._buffer
+        buffer.clear()
+        for point in points:
+            if self._encode_point(point, buffer):
+                buffer += b"\n"
+        if buffer:
+            del buffer[-1:]
+        return bytes(buffer)
+
+    def _encode_point(self, point: Point, buffer: bytearray) -> bool:
+        start = len(buffer)
+        buffer += self._escape(point.measurement, _MEASUREMENT_ESCAPES)
+        for key, value in point.tags:
+            buffer += b","
+            buffer += self._escape(key, _KEY_ESCAPES)
+            buffer += b"="
+            buffer += self._escape(str(value), _KEY_ESCAPES)
+        separator = b" "
+        for key, value in point.fields.items():
+            value = _format_field(value)
+            if value is None:
+                continue
+            buffer += separator
+            buffer += self._escape(key, _KEY_ESCAPES)
+            buffer += b"="
+            buffer += value
+            separator = b","
+        if separator == b" ":  # no fields
+            del buffer[start:]
+            return False
+        if point.time is not None:
+            buffer += b" %d" % (point.time // self._divisor)
+        return True
+
+    def _escape(self, name: str, table: dict) -> bytes:
+        escaped = self._escaped.get((name, id(table)))
+        if escaped is None:
+            if len(self._escaped) > 10_000:
+                self._escaped.clear()  # e.g. changing tag values, don't grow forever
+            escaped = name.translate(table).encode()
+            self._escaped[name, id(table)] = escaped
+        return escaped
+
+
+def _format_field(value):
+    """Returns the line protocol representation of a field value, None if not representable."""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return b"true" if value else b"false"
+    if isinstance(value, numbers.Integral):
+        return b"%di" % int(value)
+    if isinstance(value, numbers.Real):
+        value = float(value)
+        if not math.isfinite(value):
+            return None
+        return repr(value).encode()
+    return b'"' + str(value).translate(_STRING_ESCAPES).encode() + b'"'
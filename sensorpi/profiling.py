@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+import cProfile
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+
+class _NoSpan:
+    """The span of a disabled profiler, does nothing."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "args", "start")
+
+    def __init__(self, profiler, name: str, args: dict):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+
+class _Cycle:
+    __slots__ = ("profiler", "number", "start", "cprofile")
+
+    def __init__(self, profiler, number: int, cprofile):
+        self.profiler = profiler
+        self.number = number
+        self.cprofile = cprofile
+
+    def __enter__(self):
+        if self.cprofile is not None:
+            try:
+                self.cprofile.enable()
+            except ValueError:  # another profiler is active
+                self.cprofile = None
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        self.profiler._end_cycle(self, end)
+        return False
+
+
+class Profiler:
+    """Records how long every stage of every cycle takes, as a Chrome trace.
+
+    A span is two reads of time.perf_counter_ns() and a tuple appended to a
+    deque of the last events spans, so profiling can stay enabled. Every
+    write_interval seconds the deque is copied and a background thread
+    rewrites the trace file from the copy, it always holds the most recent
+    spans. The cycles never wait for the file. Open it in
+    https://ui.perfetto.dev or chrome://tracing, every thread is a row of
+    its own.
+
+    With sample_every, every sample_every-th cycle is run under cProfile as
+    well. The keep slowest of the sampled cycles are kept next to the trace
+    as .prof files, like "trace-cycle120-850ms.prof", dumped by the same
+    background thread. Look at them with python -m pstats or snakeviz.
+
+    Spans:
+        config: Reading and compiling the config.
+        cycle: A whole measurement cycle.
+        read: Reading one sensor, with the sensor in its args.
+        capture: Capturing and saving the image of a camera.
+        transform: Store, aggregation, deadband and metrics of a cycle.
+        write: Handing the points of a cycle to the writer.
+        serialize: Encoding a batch to line protocol.
+        http: Sending a batch to influx.
+
+    Examples:
+        profiler.start("/var/log/sensorpi/trace.json", sample_every=50)
+        with profiler.span("read", sensor=name):
+            read()
+
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.cycles = 0
+        self.sample_every = 0
+        self.keep = 0
+        self.write_interval = 60.0
+        self._events = deque()
+        self._threads = {}  # thread id -> thread name
+        self._lock = threading.Lock()  # of _events and _threads
+        self._slowest = []  # heap of (nanoseconds, path) of the kept .prof files
+        self._origin = 0
+        self._epoch_us = 0.0
+        self._written = 0.0
+        self._jobs = deque()  # files to write, by the background thread
+        self._busy = False
+        self._changed = threading.Condition()
+        self._thread = None
+
+    def start(self, path: str, events: int = 20_000, write_interval: float = 60.0,
+              sample_every: int = 0, keep: int = 5):
+        """Enables the profiler.
+
+        Args:
+            path: The path of the trace, it is overwritten.
+            events: Number of the most recent spans in the trace.
+            write_interval: Seconds between writes of the trace.
+            sample_every: cProfile every this many cycles, 0 never.
+            keep: Number of the slowest sampled cycles kept as .prof files.
+
+        """
+        self.path = path
+        self.sample_every = sample_every
+        self.keep = keep
+        self.write_interval = write_interval
+        self.cycles = 0
+        with self._lock:
+            self._events = deque(maxlen=events)
+            self._threads = {}
+        self._slowest = []
+        self._origin = time.perf_counter_ns()
+        self._epoch_us = time.time() * 1e6
+        self._written = time.monotonic()
+        self.enabled = True
+        log.info(f"Profiling to {path}.")
+
+    def stop(self, timeout: float = 10.0):
+        """Disables the profiler, writes the trace and waits for the background thread."""
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._submit(("trace", self._snapshot()))
+        with self._changed:
+            self._jobs.append(None)  # ends the thread
+            self._changed.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until the background thread wrote everything, returns False on a timeout."""
+        with self._changed:
+            return self._changed.wait_for(lambda: not self._jobs and not self._busy, timeout)
+
+    def span(self, name: str, **args):
+        """Returns a context manager recording the time spent in it as a span."""
+        if not self.enabled:
+            return NO_SPAN
+        return _Span(self, name, args)
+
+    def cycle(self, sample: bool = True):
+        """Returns a context manager recording a measurement cycle.
+
+        Args:
+            sample: Whether the cycle may be run under cProfile, which only
+                sees the current thread.
+
+        """
+        if not self.enabled:
+            return NO_SPAN
+        self.cycles += 1
+        sampled = sample and self.sample_every and self.cycles % self.sample_every == 0
+        return _Cycle(self, self.cycles, cProfile.Profile() if sampled else None)
+
+    def add(self, name: str, start: int, end: int, args: dict = None):
+        """Adds a span from start to end, in time.perf_counter_ns()."""
+        tid = threading.get_ident()
+        with self._lock:
+            if tid not in self._threads:
+                self._threads[tid] = threading.current_thread().name
+            self._events.append((name, start, end, tid, args or None))
+
+    def write(self):
+        """Has the background thread replace the trace file with the recorded spans."""
+        self._written = time.monotonic()
+        self._submit(("trace", self._snapshot()))
+
+    def _snapshot(self) -> tuple:
+        with self._lock:
+            return self._events.copy(), dict(self._threads)
+
+    def _submit(self, job: tuple):
+        with self._changed:
+            self._jobs.append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+            self._changed.notify_all()
+
+    def _end_cycle(self, cycle: _Cycle, end: int):
+        """Records the cycle, the files are left to the background thread."""
+        self.add("cycle", cycle.start, end,
+                 {"cycle": cycle.number, "profiled": cycle.cprofile is not None})
+        if cycle.cprofile is not None:
+            self._submit(("profile", cycle.number, end - cycle.start, cycle.cprofile))
+        if time.monotonic() - self._written >= self.write_interval:
+            self.write()
+
+    def _run(self):
+        while True:
+            with self._changed:
+                self._busy = False
+                self._changed.notify_all()
+                self._changed.wait_for(lambda: self._jobs)
+                job = self._jobs.popleft()
+                if job is None:
+                    return
+                self._busy = True
+            try:
+                if job[0] == "trace":
+                    self._write_trace(*job[1])
+                else:
+                    self._keep_if_slow(*job[1:])
+            except Exception as e:
+                log.warning(e)
+
+    def _keep_if_slow(self, number: int, nanoseconds: int, cprofile: cProfile.Profile):
+        """Dumps the cProfile of a cycle if it is one of the keep slowest sampled."""
+        if not self.keep or (len(self._slowest) >= self.keep
+                             and nanoseconds <= self._slowest[0][0]):
+            return
+        stem = os.path.splitext(self.path)[0]
+        path = f"{stem}-cycle{number}-{nanoseconds // 1_000_000}ms.prof"
+        try:
+            cprofile.dump_stats(path)
+        except OSError as e:
+            log.warning(e)
+            return
+        heapq.heappush(self._slowest, (nanoseconds, path))
+        if len(self._slowest) > self.keep:
+            _, faster = heapq.heappop(self._slowest)
+            try:
+                os.remove(faster)
+            except FileNotFoundError:
+                pass
+
+    def trace(self, snapshot: tuple = None) -> dict:
+        """Returns the recorded spans in the Chrome trace event format.
+
+        Args:
+            snapshot: The (events, threads) to use, a copy of the current ones if None.
+
+        """
+        spans, threads = snapshot or self._snapshot()
+        pid = os.getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "sensorpi"}}]
+        events.extend({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                       "args": {"name": name}} for tid, name in threads.items())
+        for name, start, end, tid, args in spans:
+            event = {"name": name, "cat": "sensorpi", "ph": "X", "pid": pid, "tid": tid,
+                     "ts": round(self._epoch_us + (start - self._origin) / 1e3, 1),
+                     "dur": round((end - start) / 1e3, 1)}
+            if args:
+                event["args"] = args
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def _write_trace(self, spans: deque, threads: dict):
+        """Replaces the trace file with the spans of a snapshot."""
+        if self.path is None:
+            return
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self.trace((spans, threads)), f, separators=(",", ":"), default=str)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning(e)
+            log.warning(f"Could not write the trace {self.path}!")
+
+
+profiler = Profiler()
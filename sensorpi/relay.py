@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+import asyncio
+import itertools
+import logging
+import signal
+import struct
+import time
+import zlib
+from collections import Counter, OrderedDict
+
+from .metrics import metrics
+from .writer import rejected
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+PORT = 9109
+# Every frame is its header and a payload. The node starts with HELLO
+# ("<node>\n<session>"), then sends DATA (zlib compressed line protocol)
+# with increasing sequence numbers, every DATA is answered with an ACK.
+HEADER = struct.Struct("!BIQ")  # kind, payload length, sequence number
+HELLO, DATA, ACK = 1, 2, 3
+MAX_SESSIONS = 10_000  # sessions whose last sequence number is remembered
+
+
+def encode_frame(kind: int, seq: int = 0, payload: bytes = b"") -> bytes:
+    """Returns a frame of the relay protocol."""
+    return HEADER.pack(kind, len(payload), seq) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader, max_bytes: int) -> tuple:
+    """Reads a frame and returns (kind, seq, payload).
+
+    Raises:
+        asyncio.IncompleteReadError: If the connection was closed.
+        ValueError: If the payload is larger than max_bytes.
+
+    """
+    kind, length, seq = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > max_bytes:
+        raise ValueError(f"Frame of {length} bytes is larger than {max_bytes} bytes.")
+    return kind, seq, await reader.readexactly(length)
+
+
+def series_key(line: bytes) -> tuple:
+    """Returns the series (measurement and tags) and the timestamp of a line of line protocol.
+
+    Two lines with the same key are the same point, influx keeps the last one.
+
+    """
+    end = line.find(b" ")
+    while end > 0 and line[end - 1:end] == b"\\":  # an escaped space of a tag
+        end = line.find(b" ", end + 1)
+    return line[:end], line[line.rfind(b" ") + 1:]
+
+
+async def _wait(event: asyncio.Event, seconds: float):
+    """Waits until the event is set, at most seconds."""
+    waiter = asyncio.ensure_future(event.wait())
+    try:
+        await asyncio.wait([waiter], timeout=seconds)
+    finally:
+        waiter.cancel()
+
+
+class Relay:
+    """Collects the points of many nodes and writes them to influx in large batches.
+
+    Nodes connect with a RelaySink and send batches of line protocol. The
+    lines of all nodes are merged into one buffer, keyed by series and
+    timestamp: a point that arrives twice (e.g. sent again after a lost
+    ACK) is only kept once. Sequence numbers per node session are
+    remembered as well, a frame that was already accepted is only ACKed
+    again. The buffer is written with writer.send() when batch_size points
+    are waiting or the oldest waited flush_interval seconds. Failed writes
+    are retried after retry_interval seconds. A batch the database rejects
+    (see writer.rejected()) is dropped, so it does not fill the buffer and
+    stop all nodes.
+
+    Memory is bounded: the relay stops reading from a node while it has
+    max_node_points points in the buffer, and from all nodes while the
+    buffer holds max_points points. The nodes then wait for their ACK and
+    keep their points in their own queues. A frame is at most max_frame
+    bytes, decompressed at most 8 times as much.
+
+    Args:
+        writer: The InfluxWriter, only its send() is used.
+        host: The address to listen on.
+        port: The port to listen on, 0 for any free port.
+        batch_size: Number of points per write.
+        flush_interval: Maximum seconds a point waits in the buffer.
+        max_points: Maximum number of points in the buffer.
+        max_node_points: Maximum number of points of one node in the buffer.
+        max_frame: Maximum bytes of a frame.
+        retry_interval: Seconds to wait after a failed write.
+
+    Attributes:
+        frames: Number of DATA frames accepted.
+        duplicates: Number of DATA frames that were already accepted.
+        merged: Number of points that replaced an equal point in the buffer.
+        written: Number of points written.
+        rejected: Number of points the database rejected.
+
+    Examples:
+        relay = Relay(create_writer(config["influxdb"]))
+        asyncio.run(relay.run())
+
+    """
+
+    def __init__(self, writer, host: str = "0.0.0.0", port: int = PORT, batch_size: int = 5000,
+                 flush_interval: float = 5.0, max_points: int = 100_000,
+                 max_node_points: int = 10_000, max_frame: int = 4 * 1024**2,
+                 retry_interval: float = 5.0):
+        self.writer = writer
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_points = max_points
+        self.max_node_points = max_node_points
+        self.max_frame = max_frame
+        self.retry_interval = retry_interval
+        self.frames = 0
+        self.duplicates = 0
+        self.merged = 0
+        self.written = 0
+        self.rejected = 0
+        self.nodes = Counter()  # node -> open connections
+        self._buffer = {}  # (series, timestamp) -> (line, node)
+        self._pending = Counter()  # node -> points in the buffer
+        self._sessions = OrderedDict()  # (node, session) -> last sequence number
+        self._oldest = None  # monotonic time of the oldest buffered point
+        self._server = None
+        self._flusher = None
+        self._connections = set()  # tasks serving a node
+        self._room = None
+        self._due = None
+        self._closing = None
+
+    def __len__(self):
+        return len(self._buffer)
+
+    async def start(self):
+        """Starts listening and the flusher."""
+        self._room = asyncio.Condition()
+        self._due = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._flusher = asyncio.create_task(self._flush_periodically())
+        metrics.gauge("relay", "queue_points", self.__len__)
+        metrics.gauge("relay", "nodes", lambda: len(self.nodes))
+        log.info(f"Relay listening on {self.host}:{self.port}.")
+
+    async def close(self):
+        """Stops listening and writes the buffered points."""
+        self._server.close()
+        for task in self._connections:
+            task.cancel()
+        self._closing.set()
+        self._due.set()
+        await asyncio.gather(*self._connections, self._flusher)
+        await self._server.wait_closed()
+        try:
+            while self._buffer:
+                await self._flush()
+        except Exception as e:
+            log.warning(e)
+            log.warning(f"Could not write {len(self._buffer)} buffered points on exit!")
+        metrics.remove_gauge("relay", "queue_points")
+        metrics.remove_gauge("relay", "nodes")
+
+    async def run(self, stop: asyncio.Event = None):
+        """Runs the relay until stop is set, SIGINT or SIGTERM."""
+        stop = stop or asyncio.Event()
+        event_loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                event_loop.add_signal_handler(signum, stop.set)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass  # not in the main thread
+        await self.start()
+        try:
+            await stop.wait()
+        finally:
+            await self.close()
+
+    def _has_room(self, node: str) -> bool:
+        return self._pending[node] < self.max_node_points and len(self._buffer) < self.max_points
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        node = None
+        self._connections.add(asyncio.current_task())
+        try:
+            kind, _, payload = await read_frame(reader, 1024)
+            if kind != HELLO:
+                raise ValueError("The node did not say hello.")
+            node, session = payload.decode().split("\n")
+            self.nodes[node] += 1
+            while True:
+                if not self._has_room(node):
+                    self._due.set()
+                    async with self._room:
+                        await self._room.wait_for(lambda: self._has_room(node))
+                kind, seq, payload = await read_frame(reader, self.max_frame)
+                if kind != DATA:
+                    raise ValueError(f"Unexpected frame of kind {kind}.")
+                self._accept(node, session, seq, payload)
+                writer.write(encode_frame(ACK, seq))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # the node went away, it sends again what was not ACKed
+        except asyncio.CancelledError:
+            pass  # the relay is closing
+        except Exception as e:
+            log.warning(f"Closing the connection of node {node}: {e!r}")
+        finally:
+            self._connections.discard(asyncio.current_task())
+            if node is not None:
+                self.nodes[node] -= 1
+                if not self.nodes[node]:
+                    del self.nodes[node]
+            writer.close()
+
+    def _accept(self, node: str, session: str, seq: int, payload: bytes):
+        """Adds the lines of a DATA frame to the buffer, unless it was accepted before."""
+        key = (node, session)
+        if seq <= self._sessions.get(key, 0):
+            self.duplicates += 1
+            return
+        decompressor = zlib.decompressobj()
+        lines = decompressor.decompress(payload, 8 * self.max_frame)
+        if decompressor.unconsumed_tail:
+            raise ValueError("Frame is too large when decompressed.")
+        if not self._buffer:
+            self._oldest = time.monotonic()
+        for line in lines.split(b"\n"):
+            if not line:
+                continue
+            point = series_key(line)
+            old = self._buffer.pop(point, None)
+            if old is not None:
+                self._pending[old[1]] -= 1
+                self.merged += 1
+            self._buffer[point] = (line, node)
+            self._pending[node] += 1
+        self.frames += 1
+        self._sessions[key] = seq
+        self._sessions.move_to_end(key)
+        if len(self._sessions) > MAX_SESSIONS:
+            self._sessions.popitem(last=False)
+        if len(self._buffer) >= self.batch_size:
+            self._due.set()
+
+    async def _flush(self):
+        """Writes the oldest batch of the buffer."""
+        batch = list(itertools.islice(self._buffer.items(), self.batch_size))
+        for point, _ in batch:
+            del self._buffer[point]
+        self._oldest = time.monotonic() if self._buffer else None
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.writer.send, b"\n".join(line for _, (line, _) in batch))
+        except Exception as e:
+            if not rejected(e):
+                self._requeue(batch)
+                raise
+            metrics.observe_rejected("relay", len(batch))
+            log.warning(e)
+            log.warning(f"The database rejected {len(batch)} points, they are dropped!")
+            self.rejected += len(batch)
+        except BaseException:
+            self._requeue(batch)
+            raise
+        else:
+            self.written += len(batch)
+        for _, (_, node) in batch:
+            self._pending[node] -= 1
+        self._pending += Counter()  # drops the nodes without points
+        async with self._room:
+            self._room.notify_all()
+
+    def _requeue(self, batch: list):
+        """Puts a batch that could not be written back to the front of the buffer."""
+        # the points sent again meanwhile are newer
+        for point, (_, node) in batch:
+            if point in self._buffer:
+                self._pending[node] -= 1
+        self._buffer = {**dict(batch), **self._buffer}
+        self._oldest = time.monotonic()
+
+    async def _flush_periodically(self):
+        """Writes the buffer when a batch is full or its oldest point is due."""
+        while not self._closing.is_set():
+            wait = self.flush_interval
+            if self._oldest is not None:
+                wait = max(0.0, self._oldest + self.flush_interval - time.monotonic())
+            await _wait(self._due, wait)
+            self._due.clear()
+            if self._closing.is_set() or not self._buffer:
+                continue
+            try:
+                await self._flush()
+            except Exception as e:
+                log.warning(e)
+                log.warning(f"Could not write to the database! {len(self._buffer)} points "
+                            f"buffered, retrying in {self.retry_interval} seconds.")
+                await _wait(self._closing, self.retry_interval)
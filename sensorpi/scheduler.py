@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+import collections
+import logging
+import math
+import time
+from typing import NamedTuple
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+POLICIES = ("skip", "coalesce")
+
+
+class Tick(NamedTuple):
+    """Sensors that are due at the same time.
+
+    Attributes:
+        timestamp: The scheduled wall clock time, a multiple of the interval.
+        names: The names of the due sensors.
+        lateness: Seconds the tick fired after timestamp.
+        missed: Number of earlier deadlines that were skipped or coalesced.
+
+    """
+    timestamp: float
+    names: tuple
+    lateness: float
+    missed: int
+
+
+class Scheduler:
+    """Drift-free scheduler for sensors with different intervals.
+
+    Every sensor is due at the multiples of its interval in unix time, so a
+    sensor with an interval of 60 is read at every full minute on every Pi.
+    The deadlines are computed from an integer tick counter and waited for
+    on the monotonic clock, so they neither drift nor jump with the clock.
+
+    When a deadline is missed (the cycle before took too long), the policy
+    decides what happens:
+        skip: Missed deadlines are dropped. The sensor is read at its latest
+            deadline if that is less than max_lateness ago, otherwise at its
+            next deadline.
+        coalesce: All missed deadlines are merged into one read right now,
+            stamped with the latest deadline.
+
+    Args:
+        intervals: Dictionary of sensor name to interval in seconds.
+        policy: What to do with missed deadlines, "skip" or "coalesce".
+        max_lateness: Fraction of the interval a tick may be late with "skip".
+        clock: Monotonic clock, only replaced in tests.
+        wall: Wall clock, only replaced in tests.
+        sleep: Sleep function, only replaced in tests.
+
+    Examples:
+        scheduler = Scheduler({"pressure": 1, "cam": 300})
+        while True:
+            tick = scheduler.next_tick()
+            read(tick.names, tick.timestamp)
+
+    """
+
+    def __init__(self, intervals: dict, policy: str = "skip", max_lateness: float = 0.5,
+                 clock=time.monotonic, wall=time.time, sleep=time.sleep):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown scheduler policy {policy}, use one of {POLICIES}")
+        self.policy = policy
+        self.max_lateness = max_lateness
+        self._clock = clock
+        self._wall = wall
+        self._sleep = sleep
+        self._offset = wall() - clock()  # wall time = monotonic time + offset
+        self._intervals = {}
+        self._next = {}  # sensor name -> index of its next deadline
+        self._ready = collections.deque()
+        self.update(intervals)
+
+    def now(self) -> float:
+        """Returns the wall clock time, derived from the monotonic clock."""
+        return self._clock() + self._offset
+
+    def update(self, intervals: dict):
+        """Replaces the intervals, keeping the deadlines of unchanged sensors.
+
+        Args:
+            intervals: Dictionary of sensor name to interval in seconds.
+
+        """
+        now = self.now()
+        for name, interval in intervals.items():
+            if interval <= 0:
+                raise ValueError(f"Interval of sensor {name} has to be positive, not {interval}")
+            if self._intervals.get(name) != interval:
+                self._next[name] = math.ceil(now / interval)
+        self._intervals = dict(intervals)
+        self._next = {name: self._next[name] for name in intervals}
+        self._ready = collections.deque(
+            Tick(tick.timestamp, tuple(n for n in tick.names if n in intervals),
+                 tick.lateness, tick.missed)
+            for tick in self._ready if any(n in intervals for n in tick.names))
+
+    def next_tick(self, timeout: float = None) -> Tick:
+        """Waits until the next sensors are due and returns them.
+
+        Args:
+            timeout: Maximum seconds to wait. None is returned if no sensor
+                got due in time, e.g. to check the config in between.
+
+        """
+        give_up = None if timeout is None else self._clock() + timeout
+        while not self._ready:
+            if not self._next:
+                raise ValueError("Scheduler has no sensors to schedule")
+            due = min(self._next[name] * self._intervals[name] for name in self._next)
+            delay = due - self.now()
+            if give_up is not None and give_up - self._clock() < delay:
+                self._sleep(max(0.0, give_up - self._clock()))
+                return None
+            if delay > 0:
+                self._sleep(delay)
+            self._resync()
+            self._collect_due(self.now())
+        return self._ready.popleft()
+
+    def delay(self) -> float:
+        """Returns the seconds until the next sensors are due, 0 if some already are."""
+        if self._ready:
+            return 0.0
+        if not self._next:
+            raise ValueError("Scheduler has no sensors to schedule")
+        due = min(self._next[name] * self._intervals[name] for name in self._next)
+        return max(0.0, due - self.now())
+
+    def poll(self) -> Tick:
+        """Returns the next due sensors without waiting, None if none are due yet.
+
+        For event loops that wait with their own sleep, e.g.
+            await asyncio.sleep(scheduler.delay())
+            tick = scheduler.poll()
+
+        """
+        if not self._ready:
+            self._resync()
+            self._collect_due(self.now())
+        return self._ready.popleft() if self._ready else None
+
+    def _collect_due(self, now: float):
+        """Moves the sensors due at now into ready ticks, grouped by deadline."""
+        groups = collections.defaultdict(list)
+        for name, index in self._next.items():
+            interval = self._intervals[name]
+            if index * interval > now:
+                continue
+            # index of the latest passed deadline, at least the one that just
+            # passed, the division can round below it
+            latest = max(index, math.floor(now / interval))
+            missed = latest - index
+            self._next[name] = latest + 1
+            if self.policy == "skip" and now - latest * interval > self.max_lateness * interval:
+                log.warning(f"Skipped {missed + 1} deadlines of sensor {name}!")
+                continue
+            groups[latest * interval, missed].append(name)
+        for (timestamp, missed), names in sorted(groups.items()):
+            if missed:
+                log.warning(f"Sensors {', '.join(map(str, names))} missed {missed} deadlines!")
+            self._ready.append(Tick(timestamp, tuple(names), now - timestamp, missed))
+
+    def _resync(self):
+        """Follows the wall clock if it was set, e.g. by NTP after boot."""
+        offset = self._wall() - self._clock()
+        if abs(offset - self._offset) > 1.0:
+            log.warning(f"Wall clock jumped by {offset - self._offset:.1f} seconds, realigning.")
+            self._offset = offset
+            now = self.now()
+            for name, interval in self._intervals.items():
+                self._next[name] = math.ceil(now / interval)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+import numpy as np
+
+
+DEFAULT_METRICS = ("mean", "p5", "p50", "p95", "saturated")
+METRICS = ("mean", "std", "min", "max", "saturated", "hist")  # and percentiles like "p95"
+LEVELS = np.arange(256, dtype=np.float64)
+
+_analyzers = {}  # options -> RoiAnalyzer, see analyzer()
+
+
+def parse_rect(rect, width: int, height: int) -> tuple:
+    """Returns the pixel bounds (x0, y0, x1, y1) of a region, clipped to the image.
+
+    Args:
+        rect: [x y width height] in pixels, or as fractions of the image if
+            all of them are floats <= 1.
+        width: Width of the image.
+        height: Height of the image.
+
+    """
+    x, y, w, h = rect
+    if all(isinstance(v, float) and 0 <= v <= 1 for v in rect):
+        x, w = x * width, w * width
+        y, h = y * height, h * height
+    x0, y0 = max(0, int(round(x))), max(0, int(round(y)))
+    return x0, y0, min(width, int(round(x + w))), min(height, int(round(y + h)))
+
+
+def check_metric(metric: str) -> bool:
+    """Returns whether the metric is known, percentiles are "p0" to "p100"."""
+    if metric in METRICS:
+        return True
+    try:
+        return metric[0] == "p" and 0 <= float(metric[1:]) <= 100
+    except ValueError:
+        return False
+
+
+class RoiAnalyzer:
+    """Computes light metrics of several regions of an image in one pass.
+
+    Every pixel gets a label, the set of regions it belongs to (regions may
+    overlap). The labels are computed once per image size. For an image
+    one np.bincount over label * 256 + value gives the histogram of every
+    label, the histograms of the regions are sums of them. All metrics are
+    computed from these histograms, exact for 8 bit images, so no region is
+    ever copied out of the image. The image is counted in blocks of rows of
+    about chunk pixels, like camera.luma_histogram.
+
+    Metrics:
+        mean, std, min, max: Of the brightness.
+        p5, p50, p95, ...: Percentiles of the brightness.
+        saturated: Share of the pixels at or above saturation.
+        hist: Share of the pixels in each of bins bins, per color channel
+            for color images.
+
+    Args:
+        rois: Dictionary of region name to [x y width height].
+        metrics: The metrics to compute, for every region.
+        width: Width of the images.
+        height: Height of the images.
+        flip: The regions are given for the image rotated by 180°.
+        bins: Number of bins of "hist", a power of 2 up to 256.
+        saturation: Brightness counted as saturated.
+        chunk: Number of pixels counted at once.
+
+    Examples:
+        analyzer = RoiAnalyzer({"sky": [0, 0, 640, 200]}, ["mean", "p95"], 640, 480)
+        fields = analyzer.fields(frame.luma)  # {"sky_mean": ..., "sky_p95": ...}
+
+    """
+
+    def __init__(self, rois: dict, metrics, width: int, height: int, flip: bool = False,
+                 bins: int = 16, saturation: int = 250, chunk: int = 1 << 16):
+        unknown = [m for m in metrics if not check_metric(m)]
+        if unknown:
+            raise ValueError(f"Unknown metrics {', '.join(unknown)}, use {', '.join(METRICS)} "
+                             "or percentiles like p95.")
+        if 256 % bins:
+            raise ValueError(f"bins has to be a power of 2 up to 256, not {bins}.")
+        self.names = [str(name) for name in rois]
+        self.metrics = tuple(metrics)
+        self.width = width
+        self.height = height
+        self.bins = bins
+        self.saturation = saturation
+        self.rows = max(1, chunk // max(1, width))
+        self.percentiles = [(m, float(m[1:])) for m in self.metrics if m not in METRICS]
+        if len(rois) > 64:
+            raise ValueError("At most 64 regions are supported.")
+        dtype = next(t for t in (np.uint8, np.uint16, np.uint32, np.uint64)
+                     if np.iinfo(t).bits >= len(rois))
+        masks = np.zeros((height, width), dtype=dtype)
+        for i, name in enumerate(rois):
+            x0, y0, x1, y1 = parse_rect(rois[name], width, height)
+            if flip:
+                x0, y0, x1, y1 = width - x1, height - y1, width - x0, height - y0
+            masks[y0:y1, x0:x1] |= dtype(1 << i)
+        combinations, labels = np.unique(masks, return_inverse=True)
+        self.labels = len(combinations)
+        # (region, label) is 1 if the pixels of the label are in the region
+        bits = np.arange(len(rois), dtype=np.uint64)[:, None]
+        self.membership = ((combinations.astype(np.uint64)[None, :] >> bits)
+                           & np.uint64(1)).astype(np.int64)
+        dtype = np.uint16 if self.labels <= 256 else np.int32
+        self._offsets = (labels.reshape(height, width) * 256).astype(dtype)
+
+    def histograms(self, plane: np.ndarray) -> np.ndarray:
+        """Returns the 256 bin histograms of the regions of an 8 bit plane, shape (regions, 256)."""
+        counts = np.zeros(self.labels * 256, dtype=np.int64)
+        for start in range(0, self.height, self.rows):
+            keys = self._offsets[start:start + self.rows] + plane[start:start + self.rows]
+            counts += np.bincount(keys.ravel(), minlength=self.labels * 256)
+        return self.membership @ counts.reshape(self.labels, 256)
+
+    def fields(self, luma: np.ndarray, bgr: np.ndarray = None) -> dict:
+        """Returns the metrics of all regions as fields, named like "sky_mean".
+
+        Args:
+            luma: The brightness plane, (height, width) uint8, e.g. Frame.luma.
+            bgr: The color image, (height, width, 3) uint8, for the histograms per channel.
+
+        """
+        hist = self.histograms(luma)
+        n = hist.sum(axis=1)
+        seen = n > 0
+        total = np.maximum(n, 1).astype(np.float64)
+        values = {}
+        if "mean" in self.metrics or "std" in self.metrics:
+            mean = hist @ LEVELS / total
+            values["mean"] = mean
+            values["std"] = np.sqrt(np.maximum(0.0, hist @ LEVELS**2 / total - mean**2))
+        if "min" in self.metrics:
+            values["min"] = np.argmax(hist > 0, axis=1)
+        if "max" in self.metrics:
+            values["max"] = 255 - np.argmax(hist[:, ::-1] > 0, axis=1)
+        if "saturated" in self.metrics:
+            values["saturated"] = hist[:, self.saturation:].sum(axis=1) / total
+        if self.percentiles:
+            cdf = np.cumsum(hist, axis=1)
+            for metric, q in self.percentiles:
+                rank = np.maximum(1, np.ceil(q / 100 * n))
+                values[metric] = np.argmax(cdf >= rank[:, None], axis=1)
+        fields = {}
+        for i, name in enumerate(self.names):
+            if not seen[i]:
+                continue  # the region is outside of the image
+            for metric in self.metrics:
+                if metric != "hist":
+                    fields[f"{name}_{metric}"] = float(values[metric][i])
+        if "hist" in self.metrics:
+            channels = {"y": hist} if bgr is None else \
+                {c: self.histograms(bgr[..., k]) for k, c in enumerate("bgr")}
+            for channel, h in channels.items():
+                shares = h.reshape(len(h), self.bins, 256 // self.bins).sum(axis=2) / total[:, None]
+                for i, name in enumerate(self.names):
+                    if seen[i]:
+                        fields.update({f"{name}_hist_{channel}{b}": float(shares[i, b])
+                                       for b in range(self.bins)})
+        return fields
+
+
+def _freeze(x):
+    if hasattr(x, "items"):
+        return tuple((str(k), _freeze(v)) for k, v in x.items())
+    if isinstance(x, (list, tuple)):
+        return tuple(_freeze(v) for v in x)
+    return x
+
+
+def analyzer(rois: dict, metrics, width: int, height: int, flip: bool = False,
+             bins: int = 16, saturation: int = 250) -> RoiAnalyzer:
+    """Returns the RoiAnalyzer of the options, its labels are only computed once."""
+    key = (_freeze(rois), tuple(metrics), width, height, flip, bins, saturation)
+    found = _analyzers.get(key)
+    if found is None:
+        found = _analyzers[key] = RoiAnalyzer(dict(_freeze(rois)), metrics, width, height,
+                                              flip, bins, saturation)
+    return found
@@ -1,29 +1,32 @@
 #!/usr/bin/env python3
-import board
-import digitalio # For use with SPI
 import adafruit_bme280.basic as adafruit_bme280
+from .devices import pool
 
-SENSORS = {}  # dictionary of initiated sensors
 
+def i2c_key(address=0x76) -> tuple:
+    return ("bme280", "i2c", address)
 
-def read_bme280_i2c(address=0x76):
-    i2c = board.I2C()
-    bme280 = adafruit_bme280.Adafruit_BME280_I2C(i2c, address=address)
-    return bme280
+
+def spi_key(pin: int) -> tuple:
+    return ("bme280", "spi", pin)
+
+
+def open_bme280_i2c(address=0x76):
+    return adafruit_bme280.Adafruit_BME280_I2C(pool.i2c(), address=address)
 
 
-def bmp280_initspi(pin: int):
-    """Initializes the sensor at given pin and adds to dict
+def open_bme280_spi(pin: int):
+    """Initializes the sensor at given pin.
 
+    The sensor is kept open in the device pool.
     Otherwise the filesystem will have too many open files and the program will crash.
     Probably a bug in the adafruit library not properly closing the SPIDevice.
     """
-    # get digital pin from board with integer
-    board_pin = board.__getattribute__(f"D{pin}")
-    spi = board.SPI()
-    cs = digitalio.DigitalInOut(board_pin)
-    sensor = adafruit_bme280.Adafruit_BME280_SPI(spi, cs)
-    SENSORS[pin] = sensor
+    return adafruit_bme280.Adafruit_BME280_SPI(pool.spi(), pool.pin(pin))
+
+
+def read_bme280_i2c(address=0x76):
+    return pool.get(i2c_key(address), lambda: open_bme280_i2c(address))
 
 
 def read_bme280_spi(pin: int):
@@ -36,24 +39,20 @@ def read_bme280_spi(pin: int):
         bme280: The sensor object containing the data as attributes.
 
     """
-    # get digital pin from board with integer
-    if pin not in SENSORS:  # if not already initialized
-        bmp280_initspi(pin)
-    sensor = SENSORS[pin]
-    return sensor
+    return pool.get(spi_key(pin), lambda: open_bme280_spi(pin))
 
 
 def i2c_as_json(measurement: str, address=0x76, sensor_name: str = "BME280",
                 comment: str = None, **kwargs):
     try:
-        sensor = read_bme280_i2c(address)
-        json = [{"measurement": measurement,
-                 "tags": {"sensor": sensor_name,
-                          "comment": comment},
-                 "fields": {"temperature": sensor.temperature,
-                            "pressure": sensor.pressure,
-                            "relative humidity": sensor.relative_humidity}
-                 }]
+        with pool.use(i2c_key(address), lambda: open_bme280_i2c(address)) as sensor:
+            json = [{"measurement": measurement,
+                     "tags": {"sensor": sensor_name,
+                              "comment": comment},
+                     "fields": {"temperature": sensor.temperature,
+                                "pressure": sensor.pressure,
+                                "relative humidity": sensor.relative_humidity}
+                     }]
         return json
     except Exception:
         print(f"Error reading sensor {sensor_name}. Is it connected?")
@@ -62,14 +61,14 @@ def i2c_as_json(measurement: str, address=0x76, sensor_name: str = "BME280",
 def spi_as_json(measurement: str, pin, sensor_name: str = "BME280",
                 comment: str = None, **kwargs):
     try:
-        sensor = read_bme280_spi(pin)
-        json = [{"measurement": measurement,
-                 "tags": {"sensor": sensor_name,
-                          "comment": comment},
-                 "fields": {"temperature": sensor.temperature,
-                            "pressure": sensor.pressure,
-                            "relative humidity": sensor.relative_humidity}
-                 }]
+        with pool.use(spi_key(pin), lambda: open_bme280_spi(pin)) as sensor:
+            json = [{"measurement": measurement,
+                     "tags": {"sensor": sensor_name,
+                              "comment": comment},
+                     "fields": {"temperature": sensor.temperature,
+                                "pressure": sensor.pressure,
+                                "relative humidity": sensor.relative_humidity}
+                     }]
         return json
     except Exception:
         print(f"Error reading sensor {sensor_name}. Is it connected?")
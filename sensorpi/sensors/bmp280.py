@@ -1,9 +1,28 @@
 #!/usr/bin/env python3
-import board
-import digitalio
 import adafruit_bmp280
+from .devices import pool
 
-SENSORS = {}  # dictionary of initiated sensors
+
+def i2c_key(address=0x76) -> tuple:
+    return ("bmp280", "i2c", address)
+
+
+def spi_key(pin: int) -> tuple:
+    return ("bmp280", "spi", pin)
+
+
+def open_bmp280_i2c(address=0x76):
+    return adafruit_bmp280.Adafruit_BMP280_I2C(pool.i2c(), address=address)
+
+
+def open_bmp280_spi(pin: int):
+    """Initializes the sensor at given pin.
+
+    The sensor is kept open in the device pool.
+    Otherwise the filesystem will have too many open files and the program will crash.
+    Probably a bug in the adafruit library not properly closing the SPIDevice.
+    """
+    return adafruit_bmp280.Adafruit_BMP280_SPI(pool.spi(), pool.pin(pin))
 
 
 def read_bmp280_i2c(address=0x76):
@@ -17,23 +36,7 @@ def read_bmp280_i2c(address=0x76):
         bmp280: The sensor object containgin the data as attributes.
 
     """
-    i2c = board.I2C()
-    sensor = adafruit_bmp280.Adafruit_BMP280_I2C(i2c, address=address)
-    return sensor
-
-
-def bmp280_initspi(pin: int):
-    """Initializes the sensor at given pin and adds to dict
-
-    Otherwise the filesystem will have too many open files and the program will crash.
-    Probably a bug in the adafruit library not properly closing the SPIDevice.
-    """
-    # get digital pin from board with integer
-    board_pin = board.__getattribute__(f"D{pin}")
-    spi = board.SPI()
-    cs = digitalio.DigitalInOut(board_pin)
-    sensor = adafruit_bmp280.Adafruit_BMP280_SPI(spi, cs)
-    SENSORS[pin] = sensor
+    return pool.get(i2c_key(address), lambda: open_bmp280_i2c(address))
 
 
 def read_bmp280_spi(pin: int):
@@ -46,22 +49,19 @@ def read_bmp280_spi(pin: int):
         bmp280: The sensor object containing the data as attributes.
 
     """
-    if pin not in SENSORS:  # if not already initialized
-        bmp280_initspi(pin)
-    sensor = SENSORS[pin]
-    return sensor
+    return pool.get(spi_key(pin), lambda: open_bmp280_spi(pin))
 
 
 def i2c_as_json(measurement: str, address=0x76, sensor_name: str = "BMP280",
                 comment: str = None, **kwargs):
     try:
-        sensor = read_bmp280_i2c(address)
-        json = [{"measurement": measurement,
-                 "tags": {"sensor": sensor_name,
-                          "comment": comment},
-                 "fields": {"temperature": sensor.temperature,
-                            "pressure": sensor.pressure}
-                 }]
+        with pool.use(i2c_key(address), lambda: open_bmp280_i2c(address)) as sensor:
+            json = [{"measurement": measurement,
+                     "tags": {"sensor": sensor_name,
+                              "comment": comment},
+                     "fields": {"temperature": sensor.temperature,
+                                "pressure": sensor.pressure}
+                     }]
         return json
     except Exception:
         print(f"Error reading sensor {sensor_name}. Is it connected?")
@@ -70,15 +70,14 @@ def i2c_as_json(measurement: str, address=0x76, sensor_name: str = "BMP280",
 def spi_as_json(measurement: str, pin, sensor_name: str = "BMP280",
                 comment: str = None, **kwargs):
     try:
-        sensor = read_bmp280_spi(pin)
-        json = [{"measurement": measurement,
-                 "tags": {"sensor": sensor_name,
-                          "comment": comment},
-                 "fields": {"temperature": sensor.temperature,
-                            "pressure": sensor.pressure}
-                 }]
+        with pool.use(spi_key(pin), lambda: open_bmp280_spi(pin)) as sensor:
+            json = [{"measurement": measurement,
+                     "tags": {"sensor": sensor_name,
+                              "comment": comment},
+                     "fields": {"temperature": sensor.temperature,
+                                "pressure": sensor.pressure}
+                     }]
         return json
     except Exception as e:
         print(e)
         print(f"Error reading sensor {sensor_name}. Is it connected?")
-
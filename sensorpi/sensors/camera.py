@@ -1,61 +1,230 @@
 #!/usr/bin/env python3
+import atexit
 import io
+import threading
 import time
-import picamera
 import cv2
 import numpy as np
-import time
+import os
 from typing import Union
 
+from .analytics import DEFAULT_METRICS, analyzer
+from .images import FORMATS, ImageSaver, encode_params
+
+
+def open_picamera():
+    """Opens the legacy Raspberry Pi camera."""
+    import picamera
+    return picamera.PiCamera()
+
+
+class CameraSession:
+    """Keeps the camera open between captures.
+
+    Opening the camera and letting it warm up takes seconds, so the camera
+    is only opened for the first capture and kept open afterwards. If a
+    capture fails the camera is closed and opened again on the next one.
+
+    Args:
+        backend: Function without arguments that opens the camera. The camera
+            needs capture(stream, format=...) and close() like picamera.PiCamera.
+        warmup: Seconds to wait after opening the camera.
+        sleep: Sleep function, only replaced in tests.
+
+    Attributes:
+        opens: How often the camera was opened.
+        captures: How many frames were captured.
+        last_latency: Seconds the last capture took.
+
+    """
+
+    def __init__(self, backend=open_picamera, warmup: float = 2.0, sleep=time.sleep):
+        self.backend = backend
+        self.warmup = warmup
+        self._sleep = sleep
+        self._camera = None
+        self._yuv = None  # reused buffer for capture_frame
+        self._lock = threading.RLock()
+        self.opens = 0
+        self.captures = 0
+        self.last_latency = None
+
+    def capture_jpeg(self) -> bytes:
+        """Captures a frame and returns it as jpeg."""
+        stream = io.BytesIO()
+        self._capture(stream, 'jpeg')
+        return stream.getvalue()
+
+    def capture_frame(self) -> "Frame":
+        """Captures an unencoded YUV420 frame into the session's buffer.
+
+        The buffer is reused for every capture, so the returned frame is only
+        valid until the next capture. Copy what has to be kept longer.
+
+        """
+        with self._lock:
+            self._open()
+            width, height = self._camera.resolution
+            # the camera pads the planes to multiples of 32x16
+            fwidth, fheight = (width + 31) // 32 * 32, (height + 15) // 16 * 16
+            shape = (fheight * 3 // 2, fwidth)
+            if self._yuv is None or self._yuv.shape != shape:
+                self._yuv = np.empty(shape, dtype=np.uint8)
+            self._capture(self._yuv, 'yuv')
+            return Frame(self._yuv, width, height)
+
+    def capture(self, rotate: bool = True) -> np.ndarray:
+        """Captures a frame and returns it as opencv/numpy array.
+
+        Args:
+            rotate: Rotate the image by 180° when True.
+
+        """
+        # Construct a numpy array from the jpeg
+        data = np.frombuffer(self.capture_jpeg(), dtype=np.uint8)
+        # "Decode" the image from the array, preserving colour
+        image = cv2.imdecode(data, 1)
+        if rotate:
+            image = cv2.rotate(image, cv2.ROTATE_180)
+        return image
+
+    def close(self):
+        """Closes the camera."""
+        with self._lock:
+            self._close()
+
+    def _open(self):
+        if self._camera is None:
+            self._camera = self.backend()
+            self.opens += 1
+            self._sleep(self.warmup)
+
+    def _capture(self, output, format: str):
+        with self._lock:
+            start = time.perf_counter()
+            self._open()
+            try:
+                self._camera.capture(output, format=format)
+            except Exception:
+                self._close()
+                raise
+            self.captures += 1
+            self.last_latency = time.perf_counter() - start
+
+    def _close(self):
+        if self._camera is not None:
+            self._camera.close()
+            self._camera = None
+
+
+class Frame:
+    """A raw YUV420 (I420) frame as captured by the camera.
+
+    The planes are padded to multiples of 32x16 pixels, luma and bgr() crop
+    the padding away.
+
+    Args:
+        yuv: The padded I420 buffer with shape (padded height * 3/2, padded width).
+        width: Width of the image.
+        height: Height of the image.
+
+    """
+    __slots__ = ("yuv", "width", "height")
+
+    def __init__(self, yuv: np.ndarray, width: int, height: int):
+        self.yuv = yuv
+        self.width = width
+        self.height = height
+
+    @property
+    def luma(self) -> np.ndarray:
+        """The Y (brightness) plane as a view into the buffer, without copying."""
+        return self.yuv[:self.height, :self.width]
+
+    def bgr(self, rotate: bool = True) -> np.ndarray:
+        """Converts the frame to an opencv BGR image, e.g. for saving.
+
+        Args:
+            rotate: Rotate the image by 180° when True.
+
+        """
+        image = cv2.cvtColor(self.yuv, cv2.COLOR_YUV2BGR_I420)[:self.height, :self.width]
+        if rotate:
+            image = cv2.rotate(image, cv2.ROTATE_180)
+        return image
+
+
+# The session used by all camera sensors
+session = CameraSession()
+atexit.register(session.close)
+# Saves the images of all camera sensors in the background
+saver = ImageSaver()
+atexit.register(saver.close)
 
-def capture(rotate: bool = True, **kwargs) -> np.ndarray:
+
+def capture(rotate: bool = True, analytics: str = "bgr", **kwargs) -> Union[np.ndarray, Frame]:
     """Captures image from the camera and returns in as opencv/numpy array.
 
     Capures an image from the camera as opencv/numpy array.
     Needs the legacy camera functionality of the Rapsberry Pi activated.
     Whenever Picamera2 is released, this will be used.
+    The camera stays open in the session, only the first capture waits for
+    the warm-up.
 
     Args:
         rotate: Rotate the image by 180° when True. Defaults to True for now.
+        analytics: "bgr" decodes a jpeg to an opencv image,
+            "luma" returns the raw Frame without any encoding.
 
     Returns:
-        image: The numpy array containing the image.
+        image: The numpy array containing the image, or the Frame for "luma".
 
     """
-    # Create the in-memory stream
-    stream = io.BytesIO()
-    with picamera.PiCamera() as camera:
-        time.sleep(2)
-        camera.capture(stream, format='jpeg')
-    # Construct a numpy array from the stream
-    data = np.frombuffer(stream.getvalue(), dtype=np.uint8)
-    # "Decode" the image from the array, preserving colour
-    image = cv2.imdecode(data, 1)
-    if rotate:
-        image = cv2.rotate(image, cv2.ROTATE_180)
-    return image
-
-
-def save_img(image: np.ndarray, path: str, timestamp=False, **kwargs):
-    """Saves the image to the path on the filesystem.
+    if analytics == "luma":
+        return session.capture_frame()
+    return session.capture(rotate)
+
+
+def save_img(image: Union[np.ndarray, Frame], path: str, timestamp=False,
+             rotate: bool = True, format: str = None, quality: int = None,
+             compression: int = None, keep: dict = None, queue: int = None, **kwargs):
+    """Queues the image to be saved to the path on the filesystem.
+
+    The image is encoded and written by the background saver, so saving does
+    not delay the measurement. The file is replaced in one step, grafana
+    never shows half an image. With timestamp, every image is saved as a new
+    file of a time-lapse, and keep limits how many of them stay on the disk.
 
     Args:
         path: Path where the image gets saved.
-        image: The array containing the image.
+        image: The array containing the image, or a raw Frame.
+        timestamp: Save the image as path_<time>, for a time-lapse.
+        rotate: Rotates a raw Frame by 180° if True.
+        format: "png", "jpg" or "webp", replaces the ending of path.
+        quality: Quality 0-100 of jpg and webp images.
+        compression: Compression level 0-9 of png images.
+        keep: Limits of the time-lapse, {:count 1000 :seconds 604800 :bytes 1073741824}.
+            The oldest images are deleted first.
+        queue: Maximum number of images of path waiting to be saved, the oldest is dropped.
 
     Examples:
-        save_img("./image.png", image)
+        save_img(image, "./image.png")
 
     """
+    if isinstance(image, Frame):
+        # the buffer is reused by the next capture, only the copy is encoded later
+        frame = Frame(image.yuv.copy(), image.width, image.height)
+        image = lambda: frame.bgr(rotate)  # noqa: E731
+    stem, ending = os.path.splitext(path)
+    if format is not None:
+        ending = FORMATS[format]
+    params = encode_params(ending, quality, compression)
     if timestamp:
-        filename = path.split("/")[-1]  # only the filename
-        pth = path.split(filename)[0]  # rest of the path, without filename
-        ending = filename.split(".")[-1]  # fileformat (like .png or .jpg)
-        f = filename.split(".")[0] # filename without format ending
         t = time.strftime("%d_%m_%Y_%H_%M_%S")
-        cv2.imwrite(f"{pth}{f}_{t}.{ending}", image)
+        saver.save(f"{stem}_{t}{ending}", image, params, keep,
+                   prefix=f"{os.path.basename(stem)}_", depth=queue, key=f"{stem}{ending}")
     else:
-        cv2.imwrite(path, image)
+        saver.save(f"{stem}{ending}", image, params, depth=queue)
 
 
 def calc_histogram(img: np.ndarray) -> np.ndarray:
@@ -73,9 +242,58 @@ def calc_histogram(img: np.ndarray) -> np.ndarray:
     return hist
 
 
+def luma_histogram(luma: np.ndarray, chunk: int = 1 << 16) -> np.ndarray:
+    """Calculates the histogram of a luma plane with numpy.
+
+    np.bincount converts its input to 64 bit integers, so the plane is
+    counted in blocks of rows of about chunk pixels. This keeps the
+    temporary memory small and also works on cropped views of the camera
+    buffer without copying the whole plane.
+
+    Args:
+        luma: 2d uint8 array, e.g. Frame.luma.
+        chunk: Number of pixels counted at once.
+
+    Returns:
+        hist: Array containing the histogram with 256 bins.
+
+    """
+    hist = np.zeros(256, dtype=np.int64)
+    rows = max(1, chunk // max(1, luma.shape[1]))
+    for start in range(0, luma.shape[0], rows):
+        hist += np.bincount(luma[start:start + rows].ravel(), minlength=256)
+    return hist
+
+
+def roi_fields(image: Union[np.ndarray, Frame], rois: dict = None, metrics=None,
+               rotate: bool = True, bins: int = 16, saturation: int = 250) -> dict:
+    """Returns the light metrics of the regions of the image, see analytics.RoiAnalyzer.
+
+    Args:
+        image: The opencv image, or a raw Frame.
+        rois: Dictionary of region name to [x y width height], of the rotated image.
+            The whole image as region "frame" if None.
+        metrics: The metrics of every region, DEFAULT_METRICS if None.
+        rotate: Whether a raw Frame is shown rotated by 180°.
+        bins: Number of bins of the "hist" metric.
+        saturation: Brightness counted as saturated.
+
+    """
+    if isinstance(image, Frame):
+        luma, bgr, flip = image.luma, None, rotate
+    else:
+        luma, bgr, flip = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), image, False
+    height, width = luma.shape
+    rois = rois or {"frame": [0, 0, width, height]}
+    return analyzer(rois, metrics or DEFAULT_METRICS, width, height, flip, bins,
+                    saturation).fields(luma, bgr)
+
+
 def hist_as_json(measurement: str, sensor_name: str = "Camera",
                  rotate: bool = True, comment: str = None,
-                 **kwargs):
+                 image: Union[np.ndarray, Frame] = None, analytics: str = "bgr",
+                 rois: dict = None, metrics: list = None, bins: int = 16,
+                 saturation: int = 250, **kwargs):
     """Returns the integrated histogram value in json format for influxdb
 
     Args:
@@ -84,21 +302,40 @@ def hist_as_json(measurement: str, sensor_name: str = "Camera",
             Useful if more than one sensor are used. Defaults to "Camera".
         rotate: Rotates the image by 180° if True.
         comment: Comment for the measurement.
+        image: A frame that was already captured this cycle, e.g. for saving.
+            A new frame is captured if None.
+        analytics: "bgr" calculates the histogram of a decoded jpeg.
+            "luma" uses the raw brightness plane, without jpeg encoding,
+            decoding and rotation (which does not change a histogram).
+        rois: Regions of the image, {:sky [0 0 640 200]}. With rois or
+            metrics, the metrics of every region are the fields (see
+            roi_fields) instead of the integrated histogram.
+        metrics: The metrics of every region, like ["mean" "p95" "saturated" "hist"].
+        bins: Number of bins of the "hist" metric.
+        saturation: Brightness counted as saturated.
 
     Returns:
-        json: The json with the integrated histogram for influxdb.
+        json: The json with the integrated histogram (or the region metrics) for influxdb.
 
     Examples:
         hist_as_json("measurement1", sensor_name="RPiCamNoIRv2" rotate=False,
                      comment="not rotated")
 
     """
-    hist = calc_histogram(capture(rotate))
-    int_hist = integrate_histogram(hist)
+    if image is None:
+        image = capture(rotate, analytics)
+    if rois is not None or metrics is not None:
+        fields = roi_fields(image, rois, metrics, rotate, bins, saturation)
+    else:
+        if isinstance(image, Frame):
+            hist = luma_histogram(image.luma)
+        else:
+            hist = calc_histogram(image)
+        fields = {"Integrated Histogram": float(integrate_histogram(hist))}
     json = [{"measurement": measurement,
              "tags": {"sensor": sensor_name,
                       "comment": comment},
-             "fields": {"Integrated Histogram": int_hist}}]
+             "fields": fields}]
     return json
 
 
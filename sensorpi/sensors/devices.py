@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+import atexit
+import contextlib
+import logging
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+
+class DeviceUnavailable(RuntimeError):
+    """Raised while a device that failed to open is waiting for its next try."""
+
+
+class DevicePool:
+    """Opens every bus and device once and hands out the same handle again.
+
+    Creating a new board.I2C() or adafruit_dht.DHT11 every cycle leaks file
+    descriptors (and for the DHT11 a pulse reader), until the program crashes
+    with too many open files. The pool keeps one handle per key instead.
+
+    A handle that raised one of the dead exceptions while in use() is closed
+    and opened again the next time it is needed. If opening fails, the next
+    try is delayed with an exponential backoff, so a disconnected sensor
+    does not cost a bus timeout every cycle.
+
+    Args:
+        backoff: Seconds to wait after the first failed open.
+        max_backoff: Maximum seconds to wait between two opens.
+        clock: Monotonic clock, only replaced in tests.
+
+    Examples:
+        with pool.use(("tsl2591", 0x29), lambda: adafruit_tsl2591.TSL2591(pool.i2c())) as sensor:
+            lux = sensor.lux
+
+    """
+
+    def __init__(self, backoff: float = 1.0, max_backoff: float = 60.0,
+                 clock=time.monotonic):
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._handles = {}  # key -> handle, in the order they were opened
+        self._failures = {}  # key -> (failed opens, time of next try)
+        self._seen = set()  # keys that were opened before
+        self.opens = 0
+        self.reopens = 0
+        self.failed_opens = 0
+
+    def __len__(self):
+        return len(self._handles)
+
+    def get(self, key, factory):
+        """Returns the handle for key, opening it with factory() if needed.
+
+        Args:
+            key: A hashable identifying the device, e.g. ("dht11", 26).
+            factory: Function without arguments that opens the device.
+
+        Raises:
+            DeviceUnavailable: If the last open failed and the backoff is not over.
+
+        """
+        with self._lock:
+            if key in self._handles:
+                return self._handles[key]
+            failures, retry_at = self._failures.get(key, (0, 0.0))
+            if self._clock() < retry_at:
+                raise DeviceUnavailable(f"Device {key} is unavailable, next try in "
+                                        f"{retry_at - self._clock():.1f} seconds.")
+            try:
+                handle = factory()
+            except Exception:
+                self.failed_opens += 1
+                delay = min(self.backoff * 2**failures, self.max_backoff)
+                self._failures[key] = (failures + 1, self._clock() + delay)
+                raise
+            self._failures.pop(key, None)
+            self.opens += 1
+            if key in self._seen:
+                self.reopens += 1
+                log.info(f"Reopened device {key}.")
+            self._seen.add(key)
+            self._handles[key] = handle
+            return handle
+
+    @contextlib.contextmanager
+    def use(self, key, factory, dead=(OSError,)):
+        """Context manager returning the handle and closing it if it died.
+
+        Args:
+            key: A hashable identifying the device.
+            factory: Function without arguments that opens the device.
+            dead: Exceptions that mean the handle is broken. Other exceptions,
+                like the DHT11's checksum errors, keep the handle open.
+
+        """
+        handle = self.get(key, factory)
+        try:
+            yield handle
+        except dead:
+            log.warning(f"Device {key} failed, closing it.")
+            self.invalidate(key)
+            raise
+
+    def invalidate(self, key):
+        """Closes the handle for key, it is opened again on the next get()."""
+        with self._lock:
+            handle = self._handles.pop(key, None)
+        if handle is not None:
+            _release(handle)
+
+    def i2c(self):
+        """Returns the shared board.I2C() bus."""
+        import board
+        return self.get("i2c", board.I2C)
+
+    def spi(self):
+        """Returns the shared board.SPI() bus."""
+        import board
+        return self.get("spi", board.SPI)
+
+    def pin(self, pin: int):
+        """Returns the shared digitalio.DigitalInOut for a board pin, e.g. for SPI chip select."""
+        import board
+        import digitalio
+        return self.get(("pin", pin), lambda: digitalio.DigitalInOut(getattr(board, f"D{pin}")))
+
+    def stats(self) -> dict:
+        """Returns the counters of the pool."""
+        return {"open": len(self._handles),
+                "opens": self.opens,
+                "reopens": self.reopens,
+                "failed opens": self.failed_opens}
+
+    def close(self):
+        """Releases all handles, devices before the buses they were opened on."""
+        with self._lock:
+            handles = list(self._handles.values())
+            self._handles.clear()
+        for handle in reversed(handles):
+            _release(handle)
+
+
+def _release(handle):
+    """Calls whatever the adafruit object has to release its resources."""
+    for name in ("deinit", "exit", "close"):
+        release = getattr(handle, name, None)
+        if callable(release):
+            try:
+                release()
+            except Exception as e:
+                log.debug(f"Releasing {handle} failed: {e}")
+            return
+
+
+# The pool shared by all drivers
+pool = DevicePool()
+atexit.register(pool.close)
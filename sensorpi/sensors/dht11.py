@@ -1,13 +1,24 @@
 #!/usr/bin/env python3
 import board
 import adafruit_dht
+from .devices import pool
+
+
+def key(pin: int) -> tuple:
+    return ("dht11", int(pin))
+
+
+def open_dht11(pin: int):
+    board_pin = getattr(board, f"D{pin}")
+    return adafruit_dht.DHT11(board_pin, use_pulseio=False)
 
 
 def read_dht11(pin: int):
     """Reads the DHT11 sensor connected on the given pin.
 
     Reads the DHT11 sensor by using the adafruit circuitpython library.
-    It reads the given board pin.
+    It reads the given board pin. The sensor is kept open in the device pool,
+    creating it again for every read leaks resources.
 
     Args:
         pin: The pin of the board the sensor is connected to.
@@ -23,9 +34,7 @@ def read_dht11(pin: int):
         print(t,h)
 
     """
-    board_pin = getattr(board, f"D{pin}")
-    sensor = adafruit_dht.DHT11(board_pin, use_pulseio=False)
-    return sensor
+    return pool.get(key(pin), lambda: open_dht11(pin))
 
 
 def as_json(measurement: str, pin: int, sensor_name: str = "DHT11", comment: str = None, **kwargs):
@@ -42,13 +51,13 @@ def as_json(measurement: str, pin: int, sensor_name: str = "DHT11", comment: str
         json: the json body for sending the data to the influx database
 
     """
-    sensor = read_dht11(pin)
-    json = [{"measurement": measurement,
-             "tags": {"sensor": sensor_name,
-                      "comment": comment},
-             "fields": {"temperature": float(sensor.temperature),
-                        "humidity": sensor.humidity}
-             }]
+    with pool.use(key(pin), lambda: open_dht11(pin)) as sensor:
+        json = [{"measurement": measurement,
+                 "tags": {"sensor": sensor_name,
+                          "comment": comment},
+                 "fields": {"temperature": float(sensor.temperature),
+                            "humidity": sensor.humidity}
+                 }]
     return json
 
 
@@ -1,33 +1,118 @@
 #!/usr/bin/env python3
-import glob
+import atexit
+import os
+import threading
+import time
+from concurrent import futures
 
+W1_DEVICES = "/sys/bus/w1/devices"
+RESCAN_INTERVAL = 60.0  # seconds after which the bus is scanned again anyway
 
-def find_temperature_file() -> str:
+
+class ProbeIndex:
+    """Index of all DS18B20 probes on the 1-Wire bus.
+
+    The bus is scanned once and only again when the devices directory
+    changed, a probe vanished (its w1_slave file could not be opened, see
+    invalidate()), an unknown probe is asked for or RESCAN_INTERVAL passed.
+
+    Args:
+        base: The devices directory of the 1-Wire bus.
+
+    """
+
+    def __init__(self, base: str = W1_DEVICES):
+        self.base = base
+        self.scans = 0
+        self._probes = {}  # rom id -> path of the w1_slave file
+        self._signature = None
+        self._scanned = 0.0
+        self._lock = threading.Lock()
+
+    def probes(self, refresh: bool = False) -> dict:
+        """Returns a dictionary of rom id -> w1_slave path, sorted by rom id.
+
+        Args:
+            refresh: Scan the bus even if nothing seems to have changed.
+
+        """
+        with self._lock:
+            st = os.stat(self.base)
+            signature = (st.st_mtime_ns, st.st_nlink)
+            if (refresh or signature != self._signature
+                    or time.monotonic() - self._scanned > RESCAN_INTERVAL):
+                # DS18B20 probes are always in a folder beginning with 28
+                self._probes = {entry.name: os.path.join(entry.path, "w1_slave")
+                                for entry in sorted(os.scandir(self.base), key=lambda e: e.name)
+                                if entry.name.startswith("28")}
+                self._signature = signature
+                self._scanned = time.monotonic()
+                self.scans += 1
+            return self._probes
+
+    def invalidate(self):
+        """Has the next call of probes() scan the bus, e.g. because a probe vanished."""
+        with self._lock:
+            self._signature = None
+
+    def find(self, roms: list = None) -> dict:
+        """Returns the w1_slave paths of the given roms, or of all probes if None.
+
+        Args:
+            roms: List of rom ids like "28-000005e2fdc3".
+
+        Raises:
+            KeyError: If a rom is not on the bus, even after a rescan.
+
+        """
+        probes = self.probes()
+        if roms is None:
+            return probes
+        if any(rom not in probes for rom in roms):
+            probes = self.probes(refresh=True)
+        return {rom: probes[rom] for rom in roms}
+
+
+index = ProbeIndex()
+_executor = None  # one thread per probe, see read_probes()
+_executor_size = 0
+_executor_lock = threading.Lock()
+
+
+def find_temperature_file(rom: str = None) -> str:
     """Finds the sensor device in the file system.
 
     In Linux the sensor device is represented by a device file
-    somewhere in /sys/bus/w1/devices. This file can be found by using glob.
-    It should always be in a folder beginning with 28.
-    The correct file is w1_slave in this folder.
+    somewhere in /sys/bus/w1/devices. It is always in a folder beginning
+    with 28, followed by the rom id. The correct file is w1_slave in this
+    folder. The folders are looked up in the cached index.
+
+    Args:
+        rom: The rom id of the probe. Defaults to the first probe.
 
     Returns:
         loc: The location of the sensor device file as string.
 
     """
-    loc = f"{glob.glob('/sys/bus/w1/devices/28*')[0]}/w1_slave"
-    return loc
+    if rom is None:
+        return next(iter(index.probes().values()))
+    return index.find([rom])[rom]
 
 
-def read_sensor() -> str:
+def read_sensor(path: str = None) -> str:
     """Reads the sensor's raw data.
 
-    Uses find_temperature_file() to find the sensor device file and reads it.
+    Uses find_temperature_file() to find the sensor device file if no path
+    is given and reads it.
+
+    Args:
+        path: The w1_slave file of the probe.
 
     Returns:
         lines: The raw data from the sensor as string.
 
     """
-    with open(find_temperature_file(), "r") as f:
+    with open(path or find_temperature_file(), "r") as f:
         lines = f.readlines()
     return lines
 
@@ -37,6 +122,7 @@ def convert_to_celsius(raw_data: str) -> float:
 
     The Temperature in Celsius can easily be taken from the raw data string.
     Just divide the last value of the string by 1000.
+    The first line ends with YES if the CRC of the data was correct.
 
     Args:
         raw_data: The sensor device file's data retrieved from read_sensor().
@@ -44,38 +130,109 @@ def convert_to_celsius(raw_data: str) -> float:
     Returns:
         c: Temperature in celsius
 
+    Raises:
+        ValueError: If the CRC check of the data failed.
+
     """
+    if not raw_data[0].strip().endswith("YES"):
+        raise ValueError(f"CRC check failed: {raw_data[0].strip()}")
     c = float(raw_data[1].split("t=")[-1]) / 1000.0
     return c
 
 
+def _read_temperature(path: str):
+    """Returns the temperature of the probe, or the exception if it could not be read."""
+    try:
+        return convert_to_celsius(read_sensor(path))
+    except Exception as e:
+        return e
+
+
+def read_probes(paths: dict) -> dict:
+    """Reads all probes at the same time.
+
+    Every read waits about 750 ms for the conversion in the kernel, so
+    several probes are read in threads instead of one after another. The
+    pool has one thread per probe and is replaced when more probes are read.
+
+    Args:
+        paths: Dictionary of rom id -> w1_slave path.
+
+    Returns:
+        temperatures: Dictionary of rom id -> temperature in celsius,
+            or the exception if the probe could not be read.
+
+    """
+    global _executor, _executor_size
+    if len(paths) < 2:  # no thread needed
+        return {rom: _read_temperature(path) for rom, path in paths.items()}
+    with _executor_lock:
+        if _executor_size < len(paths):
+            if _executor is not None:
+                _executor.shutdown(wait=False)  # reads running in it still finish
+            _executor = futures.ThreadPoolExecutor(max_workers=len(paths),
+                                                   thread_name_prefix="ds18b20")
+            _executor_size = len(paths)
+        temperatures = _executor.map(_read_temperature, paths.values())
+    return dict(zip(paths, temperatures))
+
+
+@atexit.register
+def shutdown():
+    """Stops the threads reading the probes."""
+    global _executor, _executor_size
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor, _executor_size = None, 0
+
+
 def as_json(measurement: str, sensor_name: str = "DS18B20",
-            comment: str = None,
+            comment: str = None, rom: str = None, roms: list = None,
             **kwargs):
     """Reads the temperature and returns it in the correct format for influxdb.
 
+    Without rom and roms all probes on the bus are read. If more than one
+    probe is read, every point gets its rom id as tag. A single probe is
+    not tagged, so its series stays the same as before there were several.
+
     Args:
         measurement: Name of the measurement.
         sensor_name: Name of the sensor.
             Useful if more than on sensor of the same type are used.
             Defaults to "DS18B20".
         comment: Comment about the measurement.
+        rom: The rom id of the probe to read, e.g. "28-000005e2fdc3".
+        roms: A list of rom ids to read.
 
     Returns:
         json: The json body for influxdb containing the temperature in celsius.
 
     """
     try:
-        c = convert_to_celsius(read_sensor())
-        json = [{"measurement": measurement,
-                 "tags": {"sensor": sensor_name,
-                          "comment": comment},
-                 "fields": {"temperature": c},
-                 }]
+        if rom is not None:
+            roms = [rom]
+        temperatures = read_probes(index.find(roms))
+        json = []
+        for probe, c in temperatures.items():
+            if isinstance(c, Exception):
+                print(f"Error: DS18B20 {probe} could not be read: {c}")
+                if isinstance(c, FileNotFoundError):  # the probe vanished from the bus
+                    index.invalidate()
+                continue
+            tags = {"sensor": sensor_name,
+                    "comment": comment}
+            if len(temperatures) > 1:
+                tags["rom"] = probe
+            json.append({"measurement": measurement,
+                         "tags": tags,
+                         "fields": {"temperature": c},
+                         })
         return json
-    except:
+    except Exception:
         print(f"Error: DS18B20 could not be read.")
 
 
 if __name__ == "__main__":
-    print(f"Current temperature:{convert_to_celsius(read_sensor())} °C")
+    for rom, c in read_probes(index.probes()).items():
+        print(f"Current temperature of {rom}: {c} °C")
@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
-from . import ds18b20, tsl2591, dht11, camera, bmp280, bme280
+from . import isolate, retry
+from .registry import SensorRegistry
+from ..metrics import metrics
+from ..points import Point
+from ..profiling import profiler
+from concurrent import futures
+import functools
 import logging
+import queue
+import threading
+import time
 
 
 log = logging.getLogger(__name__)
@@ -8,50 +17,304 @@ log.setLevel(logging.INFO)
 hdlr = logging.StreamHandler()
 log.addHandler(hdlr)
 
-# This is a dictionary containing the function for each sensor
-sensor_funcs = {
-    "ds18b20": ds18b20.as_json,
-    "tsl2591": tsl2591.as_json,
-    "dht11": dht11.as_json,
-    "camera": camera.hist_as_json,
-    "camera_save": camera.save_img,
-    "camera_capture": camera.capture,
-    "bmp280spi": bmp280.spi_as_json,
-    "bmp280i2c": bmp280.i2c_as_json,
-    "bme280spi": bme280.spi_as_json,
-    "bme280i2c": bme280.i2c_as_json,
+# This is a dictionary containing the function for each sensor.
+# A driver is only imported when a sensor of its type is read.
+sensor_funcs = SensorRegistry()
+
+# The bus each sensor function reads over. Sensors on the same bus are never
+# read at the same time. Sensors missing here get a bus of their own.
+sensor_buses = {
+    "tsl2591": "i2c",
+    "bmp280i2c": "i2c",
+    "bme280i2c": "i2c",
+    "bmp280spi": "spi",
+    "bme280spi": "spi",
+    "ds18b20": "w1",
+    "camera": "camera",
 }
 
+DEFAULT_TIMEOUT = 10.0  # seconds a sensor may take in parallel mode
+
+_bus_locks = {}  # bus name -> lock
+_busy = set()  # names of sensors whose last read did not finish yet
+_pool = None
+
+
+class WorkerPool:
+    """A minimal thread pool with daemon workers.
+
+    concurrent.futures.ThreadPoolExecutor joins its threads on exit, so a
+    sensor read that hangs forever would keep the program from exiting.
+
+    Args:
+        workers: Number of worker threads.
 
-def collect_measurements(sensors, measurement, timestamp):
     """
-    takes a list of sensors with pins and runs measurements,
-    then constructs a json wich is returned
-    -----------------------------------------
-    TODO: Check if connected
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._tasks = queue.SimpleQueue()
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"sensor-worker-{i}",
+                             daemon=True).start()
+
+    def submit(self, fn, *args) -> futures.Future:
+        """Runs fn(*args) in a worker and returns its future."""
+        future = futures.Future()
+        self._tasks.put((future, fn, args))
+        return future
+
+    def stop(self):
+        """Ends the workers once they are done with the tasks already submitted."""
+        for _ in range(self.workers):
+            self._tasks.put(None)
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            future, fn, args = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+def sensor_key(sensor: dict) -> str:
+    """Returns the key of the sensor function in sensor_funcs."""
+    return sensor["type"] + sensor.get("protocol", "")
+
+
+def sensor_bus(name, sensor: dict) -> str:
+    """Returns the bus the sensor is read over.
+
+    The bus can be set with :bus in the config, e.g. for a second i2c bus.
+
+    Args:
+        name: The name of the sensor.
+        sensor: The config of the sensor.
+
+    """
+    if hasattr(sensor, "bus"):  # already resolved in a compiled SensorPlan
+        return sensor.bus
+    if "bus" in sensor:
+        return sensor["bus"]
+    return sensor_buses.get(sensor_key(sensor), f"own:{name}")
+
+
+def sensor_reader(name, sensor: dict, func=None):
+    """Returns the function reading the sensor, read(measurement, **kwargs).
+
+    The sensor function gets the name and the config of the sensor. With
+    {:isolate true} it runs in a worker process of its own, with :retry (or
+    for sensors with a minimum poll period) failed reads are retried.
+
+    Args:
+        name: The name of the sensor.
+        sensor: The config of the sensor.
+        func: The sensor function, looked up in sensor_funcs if not given.
+
+    """
+    if func is None:
+        func = sensor_funcs[sensor_key(sensor)]
+    if sensor.get("isolate"):
+        read = isolate.isolated(name, sensor, func).read
+    else:
+        read = functools.partial(func, sensor_name=name, **sensor)
+    if "retry" in sensor or sensor.get("type") in retry.MIN_PERIODS:
+        read = retry.cached(name, sensor, read).read
+    return read
+
+
+def read_sensor(name, sensor: dict, measurement: str):
+    """Reads a single sensor and returns its points.
+
+    Args:
+        name: The name of the sensor.
+        sensor: The config of the sensor, or its compiled SensorPlan.
+        measurement: The name of the measurement.
+
+    Returns:
+        data: The list of points from the sensor function.
+
+    Raises:
+        KeyError: If the type of the sensor is not implemented.
+
+    """
+    typ = sensor["type"]
+    read = getattr(sensor, "read", None)  # already bound in a compiled SensorPlan
+    if read is None:
+        read = sensor_reader(name, sensor)
+    start = time.perf_counter()
+    data = None
+    try:
+        with profiler.span("read", sensor=name):
+            if "save" in sensor:
+                # one frame per cycle, for saving and for the measurement
+                with profiler.span("capture", sensor=name):
+                    capture = sensor_funcs[typ+"_capture"](**sensor)
+                    sensor_funcs[typ+"_save"](capture, **sensor["save"], **sensor)
+                data = read(measurement, image=capture)
+            else:
+                data = read(measurement)
+        return data
+    finally:
+        # drivers that fail without raising return nothing
+        metrics.observe_read(name, time.perf_counter() - start, bool(data),
+                             len(data) if data else 0)
+
+
+def _read_on_bus(name, sensor: dict, measurement: str, bus: str):
+    """Reads the sensor while holding the lock of its bus."""
+    try:
+        with _bus_locks.setdefault(bus, threading.Lock()):
+            return read_sensor(name, sensor, measurement)
+    finally:
+        _busy.discard(name)
+
+
+def start_read(name, sensor: dict, measurement: str, pool: WorkerPool):
+    """Starts reading the sensor in the pool, while holding the lock of its bus.
+
+    A sensor is only read once at a time: while its last read is not done
+    (e.g. after it missed its deadline) it is skipped.
+
+    Args:
+        name: The name of the sensor.
+        sensor: The config of the sensor, or its compiled SensorPlan.
+        measurement: The name of the measurement.
+        pool: The WorkerPool reading the sensor.
+
+    Returns:
+        future: The future of the data read_sensor returns, None if the
+            sensor is still busy.
+
     """
-    all_data = []
+    if name in _busy:
+        log.warning(f"Sensor {name} is still busy with its last read, skipping it.")
+        return None
+    _busy.add(name)
+    return pool.submit(_read_on_bus, name, sensor, measurement, sensor_bus(name, sensor))
+
+
+def cancel_read(name, future: futures.Future) -> bool:
+    """Cancels a read that start_read started, if no worker took it yet.
+
+    Returns:
+        cancelled: Whether the read was cancelled, then the sensor is free again.
+
+    """
+    if future.cancel():
+        _busy.discard(name)
+        return True
+    return False
+
+
+def _collect_sequential(sensors, measurement):
     for name in sensors:
+        sensor = sensors[name]
         try:
-            typ = sensors[name]["type"]
-            sensor = sensors[name]
-            if "save" in sensor:
-                capture = sensor_funcs[typ+"_capture"](**sensor)
-                sensor_funcs[typ+"_save"](capture, **sensor["save"], **sensor)
-            if "protocol" not in sensor:
-                sensor["protocol"] = ""  # calling the right function for sensors without protocols
-            try:
-                data = sensor_funcs[typ+sensor["protocol"]](measurement,
-                                                            sensor_name=name,
-                                                            **sensor)
-                all_data.append(data[0])
-            except Exception as e:
-                log.warning(f"{e}")
-                log.warning(f"Sensor {sensor} did not return a measurement!")
+            yield name, read_sensor(name, sensor, measurement)
         except KeyError:
             log.warning(f"Sensor {sensor} is found in your config.edn "
-                        f"but the type {typ} is not implemented (yet). "
+                        f"but the type {sensor.get('type')} is not implemented (yet). "
                         "No measurement was taken for this sensor!")
-    # the pipe symbol is the merge operator (python 3.9+):
-    all_data_timestamp = [data | {"timestamp": timestamp} for data in all_data]
-    return all_data_timestamp
+        except Exception as e:
+            log.warning(f"{e}")
+            yield name, None
+
+
+def _collect_parallel(sensors, measurement, workers):
+    """Reads all sensors in the worker pool and waits for their deadlines.
+
+    A sensor that is not done at its deadline is reported as missing for this
+    cycle. Its read keeps running in the background and the sensor is skipped
+    until that read is finished.
+
+    """
+    global _pool
+    if _pool is None or _pool.workers != workers:
+        if _pool is not None:
+            _pool.stop()
+        _pool = WorkerPool(workers)
+    start = time.monotonic()
+    pending = {}  # future -> (name, deadline)
+    for name in sensors:
+        sensor = sensors[name]
+        future = start_read(name, sensor, measurement, _pool)
+        if future is None:
+            yield name, None
+            continue
+        pending[future] = (name, start + sensor.get("timeout", DEFAULT_TIMEOUT))
+    results = {}
+    while pending:
+        next_deadline = min(deadline for _, deadline in pending.values())
+        done, _ = futures.wait(pending, timeout=max(0, next_deadline - time.monotonic()),
+                               return_when=futures.FIRST_COMPLETED)
+        now = time.monotonic()
+        for future in list(pending):
+            name, deadline = pending[future]
+            if future in done:
+                del pending[future]
+                try:
+                    results[name] = future.result()
+                except KeyError:
+                    log.warning(f"Sensor {sensors[name]} is found in your config.edn "
+                                f"but the type {sensors[name].get('type')} is not implemented (yet). "
+                                "No measurement was taken for this sensor!")
+                except Exception as e:
+                    log.warning(f"{e}")
+                    results[name] = None
+            elif now >= deadline:
+                del pending[future]
+                cancel_read(name, future)  # never started, e.g. all workers are hung
+                metrics.observe_timeout(name)
+                log.warning(f"Sensor {name} missed its deadline of "
+                            f"{deadline - start:.1f} seconds!")
+                results[name] = None
+    for name in sensors:
+        if name in results:
+            yield name, results[name]
+
+
+def collect_measurements(sensors, measurement, timestamp, workers=0):
+    """
+    takes a list of sensors with pins and runs measurements,
+    then constructs a list of points wich is returned
+
+    With workers > 0 the sensors are read in parallel by that many worker
+    threads. Sensors on the same bus are still read one after another and
+    every sensor has to finish within its :timeout (default DEFAULT_TIMEOUT).
+
+    The points get the timestamp (unix time in seconds) in nanoseconds.
+    Use points.as_dicts() for the old list of dicts.
+    -----------------------------------------
+    TODO: Check if connected
+    """
+    if workers:
+        readings = _collect_parallel(sensors, measurement, workers)
+    else:
+        readings = _collect_sequential(sensors, measurement)
+    return to_points(sensors, readings, timestamp)
+
+
+def to_points(sensors, readings, timestamp):
+    """Turns the readings of the sensors into points with the timestamp.
+
+    Args:
+        sensors: The sensors that were read.
+        readings: Pairs of sensor name and the data its function returned.
+        timestamp: Unix time in seconds.
+
+    """
+    time_ns = round(timestamp * 1e9)
+    all_points = []
+    for name, data in readings:
+        if not data:
+            log.warning(f"Sensor {sensors[name]} did not return a measurement!")
+            continue
+        all_points.extend(Point.from_dict(d, time_ns) for d in data)
+    return all_points
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from ..metrics import metrics
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+FORMATS = {"png": ".png", "jpg": ".jpg", "jpeg": ".jpg", "webp": ".webp"}
+
+
+def encode_params(ending: str, quality: int = None, compression: int = None) -> list:
+    """Returns the cv2.imwrite parameters of a file ending.
+
+    Args:
+        ending: The file ending with the dot, like ".jpg".
+        quality: Quality 0-100 of jpg and webp images.
+        compression: Compression level 0-9 of png images.
+
+    """
+    if ending in (".jpg", ".jpeg") and quality is not None:
+        return [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if ending == ".webp" and quality is not None:
+        return [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    if ending == ".png" and compression is not None:
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(compression)]
+    return []
+
+
+def write_atomic(path: str, image, params: list = ()):
+    """Encodes the image and replaces the file at path with it in one step.
+
+    The image is written to a temporary file next to path first, so readers
+    like grafana never see half an image.
+
+    """
+    ending = os.path.splitext(path)[1]
+    ok, data = cv2.imencode(ending, image, list(params))
+    if not ok:
+        raise ValueError(f"Could not encode the image as {ending}.")
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, f".{os.path.basename(path)}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data.tobytes())
+    os.replace(tmp, path)
+
+
+class Retention:
+    """Deletes the oldest images of a time-lapse when there are too many.
+
+    The images are the files in directory starting with prefix and ending
+    with ending. They are listed once, then the new images are added as they
+    are saved, so the directory is not scanned for every image.
+
+    Args:
+        directory: The directory of the time-lapse.
+        prefix: The start of the file names.
+        ending: The end of the file names, like ".jpg".
+        count: Maximum number of images kept.
+        seconds: Maximum age of the images kept.
+        bytes: Maximum size of all images kept.
+
+    """
+
+    def __init__(self, directory: str, prefix: str, ending: str, count: int = None,
+                 seconds: float = None, bytes: int = None):
+        self.count = count
+        self.seconds = seconds
+        self.bytes = bytes
+        self.deleted = 0
+        self._images = deque()  # (mtime, size, path), oldest first
+        self._total = 0
+        try:
+            entries = [e for e in os.scandir(directory)
+                       if e.name.startswith(prefix) and e.name.endswith(ending) and e.is_file()]
+        except FileNotFoundError:
+            entries = []
+        for mtime, size, path in sorted((stat.st_mtime, stat.st_size, e.path)
+                                        for e, stat in ((e, e.stat()) for e in entries)):
+            self._images.append((mtime, size, path))
+            self._total += size
+
+    def __len__(self):
+        return len(self._images)
+
+    def add(self, path: str, now: float = None):
+        """Adds a saved image and deletes the images that are too many, too old or too large."""
+        stat = os.stat(path)
+        if self._images and self._images[-1][2] == path:  # saved again within the same second
+            self._total -= self._images.pop()[1]
+        self._images.append((stat.st_mtime, stat.st_size, path))
+        self._total += stat.st_size
+        now = time.time() if now is None else now
+        while len(self._images) > 1 and (
+                (self.count is not None and len(self._images) > self.count)
+                or (self.seconds is not None and now - self._images[0][0] > self.seconds)
+                or (self.bytes is not None and self._total > self.bytes)):
+            _, size, oldest = self._images.popleft()
+            self._total -= size
+            try:
+                os.remove(oldest)
+                self.deleted += 1
+            except FileNotFoundError:
+                pass
+
+
+class ImageSaver:
+    """Encodes and saves images in a background thread.
+
+    save() only puts the image into a queue. At most depth images of the
+    same key (e.g. of one sensor) wait in it, when there are more the oldest
+    of them is dropped. A time-lapse keeps its images within the limits of
+    its Retention.
+
+    Args:
+        depth: Maximum number of images of a key waiting to be saved, if
+            save() is not given a depth of its own.
+
+    Attributes:
+        saved: Number of images saved.
+        dropped: Number of images dropped because the queue was full.
+
+    """
+
+    def __init__(self, depth: int = 2):
+        self.depth = depth
+        self.saved = 0
+        self.dropped = 0
+        self._queue = deque()
+        self._busy = False
+        self._retentions = {}  # (directory, prefix, ending, limits) -> Retention
+        self._changed = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def __len__(self):
+        return len(self._queue)
+
+    def save(self, path: str, image, params: list = (), keep: dict = None, prefix: str = None,
+             depth: int = None, key: str = None):
+        """Queues the image to be saved at path.
+
+        Args:
+            path: The path of the image, its ending chooses the format.
+            image: An opencv image, or a function returning one when it is saved.
+            params: The cv2.imwrite parameters.
+            keep: The limits of a time-lapse, {:count :seconds :bytes}.
+            prefix: The start of the file names of the time-lapse, in the directory of path.
+            depth: Maximum number of images of the key waiting, the depth of the saver if None.
+            key: Images with the same key share their depth, defaults to path.
+
+        """
+        key = path if key is None else key
+        depth = self.depth if depth is None else depth
+        with self._changed:
+            if self._closed:
+                return
+            full = sum(job[0] == key for job in self._queue) - depth + 1
+            if full > 0:
+                kept = deque()
+                for job in self._queue:
+                    if job[0] == key and full > 0:
+                        full -= 1
+                        self.dropped += 1
+                        log.debug(f"Image queue of {key} is full, dropped the oldest image.")
+                    else:
+                        kept.append(job)
+                self._queue = kept
+            self._queue.append((key, path, image, params, keep, prefix))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="image-saver",
+                                                daemon=True)
+                self._thread.start()
+            self._changed.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until the queued images are saved, returns False on a timeout."""
+        with self._changed:
+            return self._changed.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def close(self, timeout: float = 10.0):
+        """Saves the queued images, waiting at most timeout seconds, and stops the thread."""
+        self.flush(timeout)
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._changed:
+                self._busy = False
+                self._changed.notify_all()
+                self._changed.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+                _, path, image, params, keep, prefix = self._queue.popleft()
+                self._busy = True
+            start = time.perf_counter()
+            ok = False
+            try:
+                write_atomic(path, image() if callable(image) else image, params)
+                if keep:
+                    self._retention(path, keep, prefix).add(path)
+                self.saved += 1
+                ok = True
+            except Exception as e:
+                log.warning(e)
+                log.warning(f"Could not save the image {path}!")
+            finally:
+                metrics.observe_write("images", time.perf_counter() - start, ok, 1)
+
+    def _retention(self, path: str, keep: dict, prefix: str) -> Retention:
+        directory = os.path.dirname(os.path.abspath(path))
+        ending = os.path.splitext(path)[1]
+        limits = (keep.get("count"), keep.get("seconds"), keep.get("bytes"))
+        key = (directory, prefix, ending, limits)
+        retention = self._retentions.get(key)
+        if retention is None:
+            retention = self._retentions[key] = Retention(directory, prefix or "", ending, *limits)
+        return retention
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+import atexit
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import weakref
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+# A new interpreter for every worker. Forking the threaded main process can
+# copy locks held by other threads (e.g. of logging) into the child.
+START_METHOD = "spawn"
+DEFAULT_TIMEOUT = 10.0  # seconds until a read counts as hung
+# seconds a new worker may take until it imported the driver, a new
+# interpreter importing e.g. numpy on a Raspberry Pi Zero takes a while
+DEFAULT_START_TIMEOUT = 60.0
+READY = "ready"  # sent by a worker once it can take reads
+
+_drivers = {}  # sensor name -> IsolatedDriver, see isolated()
+_all = weakref.WeakSet()
+
+
+def _thaw(x):
+    """Returns plain dicts and lists for the immutable config of a SensorPlan, they can be pickled."""
+    if hasattr(x, "items"):
+        return {k: _thaw(v) for k, v in x.items()}
+    if isinstance(x, (list, tuple)):
+        return [_thaw(v) for v in x]
+    return x
+
+
+def _cpus(cpu) -> set:
+    """Returns the cpus of the :cpu option, a number or a list of numbers."""
+    return {int(c) for c in cpu} if isinstance(cpu, (list, tuple)) else {int(cpu)}
+
+
+def _serve(conn, func, name, sensor: dict, cpu):
+    """Main function of a worker process, reads the sensor whenever asked to."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is handled by the main process
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, _cpus(cpu))
+    conn.send(READY)  # func was unpickled, so its module is imported
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if request is None:
+            return
+        measurement, kwargs = request
+        try:
+            conn.send((True, func(measurement, sensor_name=name, **sensor, **kwargs)))
+        except Exception as e:
+            try:
+                conn.send((False, e))
+            except Exception:  # the exception can not be pickled
+                conn.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+def _stop(process, conn):
+    """Stops a worker process, kills it if it does not stop by itself."""
+    try:
+        conn.send(None)
+    except (OSError, ValueError):
+        pass
+    process.join(1.0)
+    if process.is_alive():
+        process.kill()
+        process.join(1.0)
+    conn.close()
+
+
+class IsolatedDriver:
+    """Reads a sensor in a worker process of its own.
+
+    The sensor function runs in a dedicated process that gets the read
+    requests over a pipe, so bit-banged drivers like the DHT11 are not
+    disturbed by the GIL and the threads of the main process. A read that
+    does not finish within timeout seconds counts as hung: the worker is
+    killed, the read raises TimeoutError and the next read starts a new
+    worker. A worker that crashed is started again as well.
+
+    The worker is started on the first read. The timeout of that read
+    starts only once the worker imported the driver, which may take up to
+    start_timeout seconds. With cpu the worker is pinned to these cpus,
+    e.g. to keep it away from the cpu of the main process.
+
+    Args:
+        name: The name of the sensor.
+        sensor: The config of the sensor, passed to the function as keywords.
+        func: The sensor function, it has to be importable by the worker.
+        timeout: Seconds a read may take.
+        start_timeout: Seconds a new worker may take until it can read.
+        cpu: A cpu number or list of cpu numbers for the worker.
+
+    Attributes:
+        starts: Number of times a worker was started.
+        hangs: Number of reads that timed out.
+
+    """
+
+    def __init__(self, name, sensor: dict, func, timeout: float = DEFAULT_TIMEOUT, cpu=None,
+                 start_timeout: float = DEFAULT_START_TIMEOUT):
+        self.name = name
+        self.config = _thaw(sensor)
+        self.sensor = {k: v for k, v in self.config.items() if k not in ("isolate", "cpu")}
+        self.func = func
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.cpu = cpu
+        self.starts = 0
+        self.hangs = 0
+        self._process = None
+        self._conn = None
+        self._finalizer = None
+        self._lock = threading.Lock()  # one read at a time
+        _all.add(self)
+
+    @property
+    def pid(self) -> int:
+        return self._process.pid if self._process is not None else None
+
+    def read(self, measurement: str, **kwargs):
+        """Reads the sensor in the worker and returns what the sensor function returned.
+
+        Raises:
+            TimeoutError: If the read took longer than timeout or a new worker
+                did not start within start_timeout, the worker is killed.
+            Exception: What the sensor function raised, or RuntimeError if the worker died.
+
+        """
+        with self._lock:
+            if self._process is None or not self._process.is_alive():
+                self._start()
+            try:
+                self._conn.send((measurement, kwargs))
+                done = self._conn.poll(self.timeout)
+                if done:
+                    ok, value = self._conn.recv()
+            except (EOFError, OSError) as e:
+                self._kill()
+                raise RuntimeError(f"The worker of sensor {self.name} died: {e!r}") from e
+            if not done:
+                self.hangs += 1
+                self._kill()
+                raise TimeoutError(f"Sensor {self.name} hung for {self.timeout} seconds, "
+                                   "its worker was killed.")
+        if not ok:
+            raise value
+        return value
+
+    def close(self):
+        """Stops the worker."""
+        with self._lock:
+            if self._finalizer is not None:
+                self._finalizer()
+            self._process = self._conn = self._finalizer = None
+
+    def _start(self):
+        if self._process is not None:
+            log.warning(f"Restarting the worker of sensor {self.name}.")
+            self._kill()
+        context = multiprocessing.get_context(START_METHOD)
+        conn, child = context.Pipe()
+        process = context.Process(target=_serve, name=f"sensor-{self.name}", daemon=True,
+                                  args=(child, self.func, self.name, self.sensor, self.cpu))
+        start = time.perf_counter()
+        process.start()
+        child.close()
+        self._process, self._conn = process, conn
+        self._finalizer = weakref.finalize(self, _stop, process, conn)
+        self.starts += 1
+        try:
+            ready = conn.poll(self.start_timeout) and conn.recv() == READY
+        except (EOFError, OSError) as e:
+            self._kill()
+            raise RuntimeError(f"The worker of sensor {self.name} died while starting: {e!r}") from e
+        if not ready:
+            self._kill()
+            raise TimeoutError(f"The worker of sensor {self.name} did not start within "
+                               f"{self.start_timeout} seconds, it was killed.")
+        log.debug(f"Started worker {process.pid} of sensor {self.name} "
+                  f"in {(time.perf_counter() - start) * 1000:.0f} ms.")
+
+    def _kill(self):
+        if self._finalizer is not None:
+            self._finalizer.detach()
+        if self._process is not None:
+            self._process.kill()
+            self._process.join(1.0)
+            self._conn.close()
+        self._process = self._conn = self._finalizer = None
+
+
+def isolated(name, sensor: dict, func) -> IsolatedDriver:
+    """Returns the IsolatedDriver of the sensor, a new one if its config changed.
+
+    The worker of the old driver is stopped, it starts again on its next
+    read if the old config is still used.
+
+    Args:
+        name: The name of the sensor.
+        sensor: The config of the sensor with {:isolate true}, optionally :timeout,
+            :start-timeout and :cpu.
+        func: The sensor function.
+
+    """
+    driver = _drivers.get(name)
+    if driver is not None and driver.func is func and driver.config == _thaw(sensor):
+        return driver
+    if driver is not None:
+        driver.close()
+    driver = IsolatedDriver(name, sensor, func, sensor.get("timeout", DEFAULT_TIMEOUT),
+                            sensor.get("cpu"), sensor.get("start-timeout", DEFAULT_START_TIMEOUT))
+    _drivers[name] = driver
+    return driver
+
+
+@atexit.register
+def close_all():
+    """Stops all workers."""
+    for driver in list(_all):
+        driver.close()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import importlib
+import logging
+import time
+from collections.abc import MutableMapping
+from importlib import metadata
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+# The function for each sensor, as "module:function". Only imported when used.
+BUILTIN_DRIVERS = {
+    "ds18b20": "sensorpi.sensors.ds18b20:as_json",
+    "tsl2591": "sensorpi.sensors.tsl2591:as_json",
+    "dht11": "sensorpi.sensors.dht11:as_json",
+    "camera": "sensorpi.sensors.camera:hist_as_json",
+    "camera_save": "sensorpi.sensors.camera:save_img",
+    "camera_capture": "sensorpi.sensors.camera:capture",
+    "bmp280spi": "sensorpi.sensors.bmp280:spi_as_json",
+    "bmp280i2c": "sensorpi.sensors.bmp280:i2c_as_json",
+    "bme280spi": "sensorpi.sensors.bme280:spi_as_json",
+    "bme280i2c": "sensorpi.sensors.bme280:i2c_as_json",
+}
+
+# Other packages can add sensors with an entry point in this group, e.g. in pyproject.toml:
+# [tool.poetry.plugins."sensorpi.sensors"]
+# "scd30" = "sensorpi_scd30:as_json"
+ENTRY_POINT_GROUP = "sensorpi.sensors"
+
+
+def _entry_points(group: str) -> dict:
+    """Returns the entry points of the group by name."""
+    eps = metadata.entry_points()
+    if hasattr(eps, "select"):  # python 3.10+
+        return {ep.name: ep for ep in eps.select(group=group)}
+    return {ep.name: ep for ep in eps.get(group, [])}
+
+
+class SensorRegistry(MutableMapping):
+    """Dictionary of sensor functions that imports a driver only when it is used.
+
+    Importing all drivers pulls in cv2, numpy, picamera and the adafruit
+    libraries, which is slow on a Pi Zero and fails if one of them is not
+    installed, even if no such sensor is configured. The registry only knows
+    where the functions are and imports a driver on first use. Drivers of
+    other packages are found through entry points in ENTRY_POINT_GROUP.
+
+    The time each import took is kept in import_times.
+
+    Args:
+        drivers: Dictionary of sensor key -> "module:function" or function.
+        group: The entry point group of third-party drivers.
+
+    Examples:
+        sensor_funcs = SensorRegistry()
+        sensor_funcs["ds18b20"]("measurement")  # imports only the ds18b20 driver
+
+    """
+
+    def __init__(self, drivers: dict = BUILTIN_DRIVERS, group: str = ENTRY_POINT_GROUP):
+        self.group = group
+        self.import_times = {}  # module or entry point -> seconds
+        self._refs = dict(drivers)
+        self._funcs = {key: ref for key, ref in self._refs.items() if callable(ref)}
+        self._entry_points = None
+
+    def __getitem__(self, key):
+        try:
+            return self._funcs[key]
+        except KeyError:
+            pass
+        if key in self._refs:
+            func = self._load(self._refs[key])
+        else:
+            ep = self.entry_points().get(key)
+            if ep is None:
+                raise KeyError(key)
+            start = time.perf_counter()
+            func = ep.load()
+            self._timed(f"{ep.value} (entry point {key})", start)
+        self._funcs[key] = func
+        return func
+
+    def __setitem__(self, key, func):
+        self._refs[key] = func
+        self._funcs[key] = func
+
+    def __delitem__(self, key):
+        del self._refs[key]
+        self._funcs.pop(key, None)
+
+    def __iter__(self):
+        return iter({**dict.fromkeys(self._refs), **dict.fromkeys(self.entry_points())})
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def entry_points(self) -> dict:
+        """Returns the entry points of third-party drivers, looked up once."""
+        if self._entry_points is None:
+            self._entry_points = _entry_points(self.group)
+        return self._entry_points
+
+    def _load(self, ref: str):
+        module_name, func_name = ref.split(":")
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        self._timed(module_name, start)
+        return getattr(module, func_name)
+
+    def _timed(self, name: str, start: float):
+        seconds = time.perf_counter() - start
+        if name not in self.import_times:
+            self.import_times[name] = seconds
+            log.info(f"Loaded driver {name} in {seconds * 1000:.0f} ms.")
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import logging
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+# Minimum seconds between two reads the hardware allows, by sensor type.
+MIN_PERIODS = {
+    "dht11": 1.0,  # samples once per second, polled faster it returns garbage
+}
+
+_caches = {}  # sensor name -> ReadCache, see cached()
+
+
+def mark_stale(data: list, age: float) -> list:
+    """Returns a copy of the points of a driver, tagged as stale with their age in seconds."""
+    return [{**d,
+             "tags": {**d.get("tags", {}), "stale": "true"},
+             "fields": {**d["fields"], "age": round(age, 3)}}
+            for d in data]
+
+
+class ReadCache:
+    """Retries failed reads of a sensor and falls back to its last good value.
+
+    A failed read (an exception or no data) is retried until it worked or
+    the next try would end after budget seconds. Between two reads at least
+    min_period seconds pass, also between the reads of two cycles: a read
+    that comes too early gets the last good value instead of polling the
+    sensor. The waiting is done with sleep, not in a busy loop.
+
+    If no read worked, the last good value is returned if it is not older
+    than max_stale seconds. Its points are tagged with stale="true" and get
+    the field age, the seconds since it was read.
+
+    Args:
+        read: The function reading the sensor, read(measurement, **kwargs).
+        budget: Seconds the retries of one read may take.
+        min_period: Minimum seconds between two reads of the sensor.
+        max_stale: Maximum age in seconds of the last good value, 0 never uses it.
+        delay: Minimum seconds between two tries, also if min_period is 0.
+        clock: Monotonic clock, only replaced in tests.
+        sleep: Sleep function, only replaced in tests.
+
+    Attributes:
+        attempts: Number of reads of the sensor.
+        failures: Number of failed reads of the sensor.
+        stale: Number of times the last good value was returned.
+
+    """
+
+    def __init__(self, read, budget: float = 0.0, min_period: float = 0.0,
+                 max_stale: float = 0.0, delay: float = 0.1, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.read_func = read
+        self.budget = budget
+        self.min_period = min_period
+        self.max_stale = max_stale
+        self.delay = delay
+        self.attempts = 0
+        self.failures = 0
+        self.stale = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._last_poll = None
+        self._last_good = None  # (data, time)
+        self._lock = threading.Lock()
+
+    def read(self, measurement: str, **kwargs) -> list:
+        """Reads the sensor, retrying within the budget.
+
+        Raises:
+            Exception: The error of the last try, if there is no last good value
+                younger than max_stale.
+
+        """
+        with self._lock:
+            start = self._clock()
+            if self._last_poll is not None and start - self._last_poll < self.min_period:
+                return self._fallback(start, None, f"polled again after {start - self._last_poll:.2f} s")
+            error = None
+            while True:
+                if error is not None:
+                    wait = max(self.delay, self._last_poll + self.min_period - self._clock())
+                    if self._clock() + wait - start > self.budget:
+                        break
+                    self._sleep(wait)
+                self._last_poll = self._clock()
+                self.attempts += 1
+                try:
+                    data = self.read_func(measurement, **kwargs)
+                except Exception as e:
+                    error = e
+                else:
+                    if data:
+                        self._last_good = (data, self._last_poll)
+                        return data
+                    error = RuntimeError("The sensor returned no data")
+                self.failures += 1
+                log.debug(f"Read failed, {self._clock() - start:.2f} s of the budget used: {error}")
+            return self._fallback(self._clock(), error, error)
+
+    def _fallback(self, now: float, error, reason) -> list:
+        if self._last_good is not None:
+            data, read_at = self._last_good
+            age = now - read_at
+            if age <= self.max_stale or (error is None and age <= self.min_period):
+                self.stale += 1
+                log.debug(f"Using the last good value from {age:.1f} s ago ({reason}).")
+                return mark_stale(data, age)
+        if error is None:
+            return []  # too early and nothing to fall back to, skip this cycle
+        raise error
+
+
+def cached(name, sensor: dict, read) -> ReadCache:
+    """Returns the ReadCache of the sensor, a new one if its config or read function changed.
+
+    Args:
+        name: The name of the sensor.
+        sensor: The config of the sensor with {:retry {:budget :min-period :max-stale}}.
+        read: The function reading the sensor, read(measurement, **kwargs).
+
+    """
+    config, cache = _caches.get(name, (None, None))
+    if cache is not None and cache.read_func is read and config == sensor:
+        return cache
+    options = sensor.get("retry") or {}
+    cache = ReadCache(read,
+                      budget=options.get("budget", 0.0),
+                      min_period=options.get("min-period", MIN_PERIODS.get(sensor.get("type"), 0.0)),
+                      max_stale=options.get("max-stale", 0.0))
+    _caches[name] = (dict(sensor), cache)
+    return cache
@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
-import board
 import adafruit_tsl2591
+from .devices import pool
+
+KEY = ("tsl2591", "i2c", 0x29)
+
+
+def open_tsl2591() -> adafruit_tsl2591.TSL2591:
+    return adafruit_tsl2591.TSL2591(pool.i2c())  # uses board.SCL and board.SDA
 
 
 def read_tsl2591() -> adafruit_tsl2591.TSL2591:
     """Reads the sensor over I2C and returns the sensor class
 
     Reads the sensor over I2C and returns a sensor class from adafruit_tsl2591.
-    It contains the data in attributes.
+    It contains the data in attributes. The sensor is kept open in the device pool.
 
     Returns:
         sensor: The sensor class from adafruit_tsl2591.
@@ -18,9 +24,7 @@ def read_tsl2591() -> adafruit_tsl2591.TSL2591:
         print(f"Lux:{data.lux}\nIR:{data.infrared}\nVis:{data.visible}\nFull:{data.full_spectrum}")
 
     """
-    i2c = board.I2C()  # uses board.SCL and board.SDA
-    sensor = adafruit_tsl2591.TSL2591(i2c)
-    return sensor
+    return pool.get(KEY, open_tsl2591)
 
 
 def as_json(measurement: str, sensor_name: str = "TSL2591",
@@ -39,15 +43,15 @@ def as_json(measurement: str, sensor_name: str = "TSL2591",
 
     """
     try:
-        sensor = read_tsl2591()
-        json = [{"measurement": measurement,
-                 "tags": {"sensor": sensor_name,
-                          "comment": comment},
-                 "fields": {"Lux": sensor.lux,
-                            "IR": sensor.infrared,
-                            "Vis": sensor.visible,
-                            "Full": sensor.full_spectrum}
-                 }]
+        with pool.use(KEY, open_tsl2591) as sensor:
+            json = [{"measurement": measurement,
+                     "tags": {"sensor": sensor_name,
+                              "comment": comment},
+                     "fields": {"Lux": sensor.lux,
+                                "IR": sensor.infrared,
+                                "Vis": sensor.visible,
+                                "Full": sensor.full_spectrum}
+                     }]
         return json
     except:
         print(f"Error reading sensor {sensor_name}. Is it connected?")
@@ -0,0 +1,622 @@
+#!/usr/bin/env python3
+import csv
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+
+from .metrics import metrics
+from .points import LineProtocolEncoder
+from .relay import ACK, DATA, HEADER, HELLO, PORT, encode_frame
+from .writer import rejected
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+POLICIES = ("drop-oldest", "drop-newest", "block")
+# options of a sink in the config that belong to its QueuedSink, not to the sink itself
+QUEUE_OPTIONS = ("max-points", "batch-size", "flush-interval", "policy", "block-timeout",
+                 "retry-interval", "max-retry-interval")
+
+
+def _tags(point) -> str:
+    return ",".join(f"{k}={v}" for k, v in point.tags)
+
+
+class Sink:
+    """Base class of the sinks, a destination the points are sent to.
+
+    send() is only called by the thread of the QueuedSink of the sink, one
+    batch at a time. It raises if the batch could not be sent, the batch is
+    then sent again later, unless permanent() says it would never be sent.
+
+    Args:
+        name: The name of the sink in the config and in the metrics.
+
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def send(self, points: list):
+        """Sends a batch of points and records it in the metrics."""
+        start = time.perf_counter()
+        ok = False
+        try:
+            self._send(points)
+            ok = True
+        finally:
+            metrics.observe_write(self.name, time.perf_counter() - start, ok, len(points))
+
+    def close(self):
+        """Releases files and connections of the sink."""
+
+    def permanent(self, error: Exception) -> bool:
+        """Returns whether sending the batch failed for good, it is dropped then.
+
+        True if the database rejected the points (see writer.rejected()) or
+        the points themselves could not be handled, e.g. a topic names a tag
+        the point does not have. Sending them again would fail again.
+
+        """
+        return rejected(error) or isinstance(error, (KeyError, TypeError, ValueError))
+
+    def _send(self, points: list):
+        raise NotImplementedError
+
+
+class InfluxSink(Sink):
+    """Sends the points to influx with an InfluxWriter, or appends them to its SpooledWriter.
+
+    Args:
+        name: The name of the sink.
+        writer: The InfluxWriter or SpooledWriter.
+
+    """
+
+    def __init__(self, name: str, writer):
+        super().__init__(name)
+        self.writer = writer
+        getattr(writer, "writer", writer).name = name  # the InfluxWriter records its requests
+
+    def send(self, points: list):
+        if hasattr(self.writer, "spool"):
+            self.writer.write(points)  # sent by the drainer of the spool
+        else:
+            self.writer.send(points)
+
+    def close(self):
+        self.writer.close()
+
+
+class CsvSink(Sink):
+    """Appends the points to a csv file, one row per field.
+
+    The columns are time (unix time in nanoseconds), measurement, tags
+    (k=v separated by commas), field and value. The header is written when
+    the file is new.
+
+    Args:
+        name: The name of the sink.
+        path: The path of the csv file.
+
+    """
+
+    HEADER = ("time", "measurement", "tags", "field", "value")
+
+    def __init__(self, name: str, path: str):
+        super().__init__(name)
+        self.path = path
+        self._file = None
+
+    def _send(self, points: list):
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, "a", newline="")
+            self._csv = csv.writer(self._file)
+            if self._file.tell() == 0:
+                self._csv.writerow(self.HEADER)
+        self._csv.writerows((point.time, point.measurement, _tags(point), field, value)
+                            for point in points for field, value in point.fields.items())
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetSink(Sink):
+    """Writes every batch as a parquet file into a directory, needs pyarrow.
+
+    The files are named by the time of their first point and written to a
+    temporary name first, so readers never see half a file. The columns are
+    those of the CsvSink, with the values as doubles; fields that are not
+    numbers are left out.
+
+    Args:
+        name: The name of the sink.
+        path: The directory of the files.
+        compression: The parquet compression, e.g. "snappy" or "zstd".
+
+    """
+
+    def __init__(self, name: str, path: str, compression: str = "snappy"):
+        super().__init__(name)
+        import pyarrow  # noqa: F401 only needed with a parquet sink, fail early without it
+        self.path = path
+        self.compression = compression
+        self._files = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _send(self, points: list):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        columns = {column: [] for column in CsvSink.HEADER}
+        for point in points:
+            tags = _tags(point)
+            for field, value in point.fields.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    for column, x in zip(CsvSink.HEADER,
+                                         (point.time, point.measurement, tags, field, float(value))):
+                        columns[column].append(x)
+        if not columns["time"]:
+            return
+        table = pa.table({**columns, "time": pa.array(columns["time"], pa.timestamp("ns"))})
+        self._files += 1
+        path = os.path.join(self.path, f"{min(columns['time'])}-{self._files}.parquet")
+        pq.write_table(table, path + ".tmp", compression=self.compression)
+        os.replace(path + ".tmp", path)
+
+
+class StdoutSink(Sink):
+    """Prints the points as line protocol or as json, one point per line.
+
+    Args:
+        name: The name of the sink.
+        format: "line" or "json".
+        stream: The stream to print to, stdout by default.
+
+    """
+
+    def __init__(self, name: str, format: str = "line", stream=None):
+        super().__init__(name)
+        self.format = format
+        self.stream = stream
+        self._encoder = LineProtocolEncoder("ns")
+
+    def _send(self, points: list):
+        stream = self.stream or sys.stdout
+        if self.format == "json":
+            stream.write("".join(json.dumps(point.as_dict()) + "\n" for point in points))
+        else:
+            lines = self._encoder.encode(points)
+            if lines:
+                stream.write(lines.decode() + "\n")
+        stream.flush()
+
+
+def _mqtt_string(text: str) -> bytes:
+    data = text.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+def _mqtt_packet(kind: int, body: bytes) -> bytes:
+    """Returns an MQTT packet with its fixed header and variable length encoding."""
+    header = bytearray([kind])
+    length = len(body)
+    while True:
+        byte, length = length % 128, length // 128
+        header.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(header) + body
+
+
+class MqttSink(Sink):
+    """Publishes every point as an MQTT message with QoS 0.
+
+    Speaks just enough MQTT 3.1.1 to connect and publish, so no MQTT
+    library is needed. The topic is formatted with the measurement and the
+    tags of the point, e.g. "sensorpi/{measurement}/{sensor}". The payload
+    is the point in line protocol (as read by telegraf) or as json. The
+    connection is opened on the first send and again after an error.
+
+    Args:
+        name: The name of the sink.
+        host: The host of the broker.
+        port: The port of the broker.
+        topic: The topic, formatted per point.
+        format: "line" or "json".
+        client_id: The client id, "sensorpi-<hostname>" by default.
+        user: Username for the broker.
+        password: Password for the broker.
+        keepalive: Seconds without messages after which the connection is renewed.
+        retain: Whether the broker keeps the last message of a topic.
+        timeout: Seconds for connecting and sending.
+
+    """
+
+    def __init__(self, name: str, host: str = "localhost", port: int = 1883,
+                 topic: str = "sensorpi/{measurement}/{sensor}", format: str = "line",
+                 client_id: str = None, user: str = None, password: str = None,
+                 keepalive: int = 60, retain: bool = False, timeout: float = 10.0):
+        super().__init__(name)
+        self.host = host
+        self.port = port
+        self.topic = topic
+        self.format = format
+        self.client_id = client_id or f"sensorpi-{socket.gethostname()}"
+        self.user = user
+        self.password = password
+        self.keepalive = keepalive
+        self.retain = retain
+        self.timeout = timeout
+        self._encoder = LineProtocolEncoder("ns")
+        self._socket = None
+        self._last_sent = 0.0
+
+    def _send(self, points: list):
+        if self._socket is not None and time.monotonic() - self._last_sent >= self.keepalive:
+            self.close()  # the broker has given up on us by now
+        if self._socket is None:
+            self._connect()
+        packets = []
+        for point in points:
+            tags = dict(point.tags)
+            topic = self.topic.format_map({**tags, "measurement": point.measurement,
+                                           "sensor": tags.get("sensor", "")})
+            if self.format == "json":
+                payload = json.dumps(point.as_dict()).encode()
+            else:
+                payload = self._encoder.encode([point])
+            packets.append(_mqtt_packet(0x31 if self.retain else 0x30,
+                                        _mqtt_string(topic) + payload))
+        try:
+            self._socket.sendall(b"".join(packets))
+        except OSError:
+            self.close()
+            raise
+        self._last_sent = time.monotonic()
+
+    def _connect(self):
+        flags = 0x02  # clean session
+        payload = _mqtt_string(self.client_id)
+        if self.user is not None:
+            flags |= 0x80
+            payload += _mqtt_string(self.user)
+            if self.password is not None:
+                flags |= 0x40
+                payload += _mqtt_string(self.password)
+        body = _mqtt_string("MQTT") + bytes([4, flags]) + struct.pack("!H", self.keepalive) + payload
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        try:
+            sock.sendall(_mqtt_packet(0x10, body))
+            ack = b""
+            while len(ack) < 4:
+                chunk = sock.recv(4 - len(ack))
+                if not chunk:
+                    raise ConnectionError("The MQTT broker closed the connection.")
+                ack += chunk
+            if ack[0] != 0x20 or ack[3] != 0:
+                raise ConnectionError(f"The MQTT broker refused the connection, code {ack[3]}.")
+        except Exception:
+            sock.close()
+            raise
+        self._socket = sock
+        self._last_sent = time.monotonic()
+
+    def close(self):
+        if self._socket is not None:
+            try:
+                self._socket.sendall(b"\xe0\x00")  # disconnect
+            except OSError:
+                pass
+            self._socket.close()
+            self._socket = None
+
+
+class RelaySink(Sink):
+    """Sends the points to a sensorpi relay, which writes the points of many nodes together.
+
+    Every batch is one zlib compressed frame of line protocol with the next
+    sequence number, sent when the relay ACKed the previous one. A batch
+    without ACK raises, so a QueuedSink sends it again, the relay drops the
+    frames and points it already has. While the relay is busy it stops
+    reading and the points wait in the queue of the node.
+
+    Args:
+        name: The name of the sink.
+        host: The host of the relay.
+        port: The port of the relay.
+        node: The name of this node, the hostname by default.
+        level: The zlib compression level.
+        timeout: Seconds for connecting and for the ACK of a batch.
+
+    """
+
+    def __init__(self, name: str, host: str = "localhost", port: int = PORT, node: str = None,
+                 level: int = 6, timeout: float = 30.0):
+        super().__init__(name)
+        self.host = host
+        self.port = port
+        self.node = node or socket.gethostname()
+        self.level = level
+        self.timeout = timeout
+        self.session = os.urandom(8).hex()  # a restarted node starts again at seq 1
+        self.seq = 0
+        self._encoder = LineProtocolEncoder("ns")
+        self._socket = None
+
+    def _send(self, points: list):
+        lines = self._encoder.encode(points)
+        if not lines:
+            return
+        if self._socket is None:
+            self._connect()
+        self.seq += 1
+        try:
+            self._socket.sendall(encode_frame(DATA, self.seq, zlib.compress(lines, self.level)))
+            while True:
+                kind, _, seq = HEADER.unpack(self._receive(HEADER.size))
+                if kind == ACK and seq == self.seq:
+                    return
+        except OSError:
+            self.close()
+            raise
+
+    def _receive(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self._socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("The relay closed the connection.")
+            data += chunk
+        return data
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        try:
+            sock.sendall(encode_frame(HELLO, 0, f"{self.node}\n{self.session}".encode()))
+        except Exception:
+            sock.close()
+            raise
+        self._socket = sock
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+SINKS = {
+    "csv": CsvSink,
+    "parquet": ParquetSink,
+    "stdout": StdoutSink,
+    "mqtt": MqttSink,
+    "relay": RelaySink,
+}  # "influx" is created in __main__.create_sinks, it needs the writers
+
+
+class QueuedSink:
+    """Sends the points to a sink from a thread of its own, through a bounded queue.
+
+    write() only puts the points into the queue. The thread sends them in
+    batches of up to batch_size points, when a batch is full or the oldest
+    point waited flush_interval seconds. If sending fails the batch is put
+    back and sent again after retry_interval seconds, doubling up to
+    max_retry_interval while the sink keeps failing. New points do not cut
+    that wait short. A batch the sink can never send (see Sink.permanent())
+    is dropped instead and counted as rejected.
+
+    The queue holds at most max_points points. When it is full the policy
+    decides: "drop-oldest" makes room by dropping the oldest points,
+    "drop-newest" drops the new ones, and "block" lets write() wait up to
+    block_timeout seconds for room before dropping the new ones.
+
+    Args:
+        sink: The Sink.
+        max_points: The size of the queue.
+        batch_size: Maximum number of points per send.
+        flush_interval: Maximum seconds a point waits for its batch to fill.
+        policy: What happens when the queue is full, see above.
+        block_timeout: Seconds write() waits with the policy "block".
+        retry_interval: Seconds to wait after a failed send.
+        max_retry_interval: Maximum seconds to wait between two retries.
+
+    Attributes:
+        dropped: Number of points dropped because the queue was full.
+
+    """
+
+    def __init__(self, sink: Sink, max_points: int = 10_000, batch_size: int = 500,
+                 flush_interval: float = 5.0, policy: str = "drop-oldest",
+                 block_timeout: float = 1.0, retry_interval: float = 5.0,
+                 max_retry_interval: float = 300.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy!r}, use one of {', '.join(POLICIES)}.")
+        self.sink = sink
+        self.name = sink.name
+        self.max_points = max_points
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.dropped = 0
+        self._queue = deque()
+        self._oldest = None  # monotonic time of the oldest queued point
+        self._retry_at = 0.0  # monotonic time before which nothing is sent, after a failure
+        self._changed = threading.Condition()
+        self._closed = False
+        metrics.gauge(self.name, "queue_points", self.__len__)
+        metrics.gauge(self.name, "dropped_points", lambda: self.dropped)
+        self._thread = threading.Thread(target=self._run, name=f"sink-{self.name}", daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def write(self, points: list):
+        """Puts the points into the queue, what does not fit is handled by the policy."""
+        if not points:
+            return
+        with self._changed:
+            if self.policy == "block":
+                deadline = time.monotonic() + self.block_timeout
+                while (len(self._queue) + len(points) > self.max_points and not self._closed
+                       and self._changed.wait(max(0.0, deadline - time.monotonic()))):
+                    pass
+            room = self.max_points - len(self._queue)
+            if self.policy == "drop-oldest":
+                overflow = len(self._queue) + len(points) - self.max_points
+                for _ in range(min(overflow, len(self._queue))):
+                    self._queue.popleft()
+                if overflow > 0:
+                    self.dropped += overflow
+                    points = points[-self.max_points:]
+            elif room < len(points):
+                self.dropped += len(points) - max(room, 0)
+                points = points[:max(room, 0)]
+            waiting = len(self._queue)
+            if not waiting:
+                self._oldest = time.monotonic()
+            self._queue.extend(points)
+            if not waiting or len(self._queue) >= self.batch_size:
+                self._changed.notify_all()  # the thread starts the clock, or sends the batch
+
+    def close(self, timeout: float = 10.0):
+        """Sends what is queued, trying for up to timeout seconds, and closes the sink."""
+        with self._changed:
+            self._closed = True
+            self._close_by = time.monotonic() + timeout
+            self._changed.notify_all()
+        self._thread.join()
+        metrics.remove_gauge(self.name, "queue_points")
+        metrics.remove_gauge(self.name, "dropped_points")
+        if self._queue:
+            log.warning(f"Sink {self.name} could not send {len(self._queue)} points on exit!")
+        self.sink.close()
+
+    def _next_batch(self) -> list:
+        """Waits until a batch is due and takes it from the queue, [] once closed and empty."""
+        with self._changed:
+            while True:
+                now = time.monotonic()
+                retry_at = min(self._retry_at, self._close_by) if self._closed else self._retry_at
+                due = self._queue and (self._closed or len(self._queue) >= self.batch_size
+                                       or now - self._oldest >= self.flush_interval)
+                if due and now >= retry_at:
+                    batch = [self._queue.popleft()
+                             for _ in range(min(self.batch_size, len(self._queue)))]
+                    if self._queue:
+                        self._oldest = now
+                    self._changed.notify_all()  # room for blocked writers
+                    return batch
+                if self._closed and not self._queue:
+                    return []
+                wait = None
+                if due:
+                    wait = retry_at - now
+                elif self._queue:
+                    wait = max(retry_at, self._oldest + self.flush_interval) - now
+                self._changed.wait(wait)
+
+    def _run(self):
+        """Runs in the thread of the sink until close() is called."""
+        retry = self.retry_interval
+        dropped = 0
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                self.sink.send(batch)
+                retry = self.retry_interval
+            except Exception as e:
+                log.warning(e)
+                if self.sink.permanent(e):
+                    metrics.observe_rejected(self.name, len(batch))
+                    log.warning(f"Sink {self.name} can not take {len(batch)} points, "
+                                "they are dropped!")
+                else:
+                    log.warning(f"Could not send {len(batch)} points to sink {self.name}, "
+                                f"retrying in {retry} seconds.")
+                    with self._changed:
+                        self._queue.extendleft(reversed(batch))
+                        self._oldest = time.monotonic()
+                        overflow = len(self._queue) - self.max_points
+                        for _ in range(max(overflow, 0)):
+                            self._queue.popleft()
+                            self.dropped += 1
+                        if self._closed and time.monotonic() >= self._close_by:
+                            return
+                        self._retry_at = time.monotonic() + retry
+                    retry = min(retry * 2, self.max_retry_interval)
+            if self.dropped != dropped:
+                log.warning(f"Queue of sink {self.name} is full, dropped "
+                            f"{self.dropped - dropped} points.")
+                dropped = self.dropped
+
+
+class FanOut:
+    """Writes the points of every sensor to the sinks it is configured for.
+
+    A sensor sends to the sinks in its :sinks, e.g. {:sinks ["influx" "csv"]}.
+    Sensors without :sinks and points of no sensor (like the metrics) go to
+    every sink. Every sink has its own queue and thread, a slow or failing
+    sink never holds up the loop or the other sinks.
+
+    Args:
+        sinks: Dictionary of sink name to QueuedSink.
+        sensors: The sensors of the config, or the sensors of a compiled Plan.
+
+    Examples:
+        writer = FanOut({"csv": QueuedSink(CsvSink("csv", "data.csv"))}, sensors)
+        writer.write(data)
+
+    """
+
+    def __init__(self, sinks: dict, sensors):
+        self.sinks = sinks
+        self.update(sensors)
+
+    def __len__(self):
+        return sum(len(sink) for sink in self.sinks.values())
+
+    def update(self, sensors):
+        """Takes the :sinks of the sensors after a reload."""
+        every = tuple(self.sinks.values())
+        self._routes = {}
+        for name in sensors:
+            names = sensors[name].get("sinks")
+            self._routes[str(name)] = every if names is None else \
+                tuple(self.sinks[str(n)] for n in names if str(n) in self.sinks)
+
+    def write(self, data: list):
+        """Puts the points into the queues of their sinks."""
+        every = tuple(self.sinks.values())
+        batches = {}
+        for point in data:
+            sensor = dict(point.tags).get("sensor")
+            for sink in self._routes.get(sensor, every):
+                batches.setdefault(sink, []).append(point)
+        for sink, points in batches.items():
+            sink.write(points)
+
+    def close(self):
+        """Closes all sinks, each sends its remaining points first."""
+        for sink in self.sinks.values():
+            try:
+                sink.close()
+            except Exception as e:
+                log.warning(e)
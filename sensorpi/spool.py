@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+import logging
+import os
+import threading
+import time
+from .metrics import metrics
+from .points import LineProtocolEncoder
+from .writer import rejected
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+
+class Spool:
+    """Append-only write-ahead spool on disk.
+
+    Records (bytes without newlines) are appended to segment files in the
+    spool directory. A segment is closed when it reaches segment_bytes and a
+    new one is started. Appends are flushed to the OS right away, but only
+    fsynced every fsync_interval seconds, when a segment is closed and on
+    close(), so a power cut loses at most fsync_interval seconds of data.
+
+    A cursor file remembers up to where the records were sent. Segments
+    before the cursor are deleted. If the spool grows larger than max_bytes
+    the oldest segments are deleted, even if they were not sent yet.
+
+    Args:
+        path: Directory of the spool. Created if it does not exist.
+        segment_bytes: Size after which a new segment is started.
+        max_bytes: Maximum size of all segments together.
+        fsync_interval: Maximum seconds between two fsyncs.
+
+    Examples:
+        spool = Spool("/var/lib/sensorpi/spool")
+        spool.append([b"record"])
+        records, position = spool.read(100)
+        spool.commit(position)
+
+    """
+
+    def __init__(self, path: str, segment_bytes: int = 4 * 1024**2,
+                 max_bytes: int = 256 * 1024**2, fsync_interval: float = 5.0):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._sizes = {}  # segment number -> size in bytes
+        for name in os.listdir(path):
+            if name.endswith(".seg"):
+                seq = int(name[:-4])
+                self._sizes[seq] = os.path.getsize(self._segment_path(seq))
+        self._cursor = self._read_cursor()
+        self._delete_before(self._cursor[0])
+        if self._sizes and self._cursor[0] not in self._sizes:
+            self._cursor = (min(self._sizes), 0)
+        # always start a new segment, old ones might end with a torn record
+        self._active_seq = max(self._sizes, default=0) + 1
+        self._active = None
+        self._last_fsync = time.monotonic()
+        self._open_segment()
+
+    def __len__(self):
+        """Returns the number of unsent bytes in the spool."""
+        with self._lock:
+            return sum(self._sizes.values()) - self._cursor[1]
+
+    def append(self, records: list):
+        """Appends the records to the active segment.
+
+        Args:
+            records: A list of bytes, each without a newline.
+
+        """
+        if not records:
+            return
+        with self._lock:
+            chunk = b"".join(record + b"\n" for record in records)
+            self._active.write(chunk)
+            self._active.flush()
+            self._sizes[self._active_seq] += len(chunk)
+            if self._sizes[self._active_seq] >= self.segment_bytes:
+                self._fsync()
+                self._active.close()
+                self._active_seq += 1
+                self._open_segment()
+            elif time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self._fsync()
+            self._evict()
+
+    def read(self, max_records: int):
+        """Reads up to max_records unsent records, oldest first.
+
+        The records are not removed, call commit() with the returned position
+        once they were sent.
+
+        Args:
+            max_records: Maximum number of records to read.
+
+        Returns:
+            records: A list of bytes.
+            position: The position after the last returned record.
+
+        """
+        with self._lock:
+            records = []
+            seq, offset = self._cursor
+            for seq in sorted(s for s in self._sizes if s >= seq):
+                if seq != self._cursor[0]:
+                    offset = 0
+                with open(self._segment_path(seq), "rb") as f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            break  # torn record at the end of a crashed segment
+                        records.append(line[:-1])
+                        offset += len(line)
+                        if len(records) >= max_records:
+                            return records, (seq, offset)
+                if seq == self._active_seq:
+                    break
+            return records, (seq, offset)
+
+    def commit(self, position):
+        """Marks everything before position as sent and deletes sent segments.
+
+        Args:
+            position: A position returned by read().
+
+        """
+        with self._lock:
+            if position <= self._cursor:
+                return  # already evicted or committed
+            self._cursor = position
+            self._delete_before(position[0])
+            tmp = os.path.join(self.path, "cursor.tmp")
+            with open(tmp, "w") as f:
+                f.write(f"{position[0]} {position[1]}")
+            os.replace(tmp, os.path.join(self.path, "cursor"))
+
+    def close(self):
+        """Fsyncs and closes the active segment."""
+        with self._lock:
+            if self._active is not None:
+                self._fsync()
+                self._active.close()
+                self._active = None
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.path, f"{seq:010d}.seg")
+
+    def _read_cursor(self):
+        try:
+            with open(os.path.join(self.path, "cursor")) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (OSError, ValueError):
+            return min(self._sizes, default=1), 0
+
+    def _open_segment(self):
+        self._active = open(self._segment_path(self._active_seq), "ab")
+        self._sizes[self._active_seq] = 0
+        # make the new directory entry durable as well
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _fsync(self):
+        os.fsync(self._active.fileno())
+        self._last_fsync = time.monotonic()
+
+    def _delete_before(self, seq: int):
+        for old in [s for s in self._sizes if s < seq]:
+            os.remove(self._segment_path(old))
+            del self._sizes[old]
+
+    def _evict(self):
+        """Deletes the oldest segments until the spool fits into max_bytes."""
+        while sum(self._sizes.values()) > self.max_bytes and len(self._sizes) > 1:
+            oldest = min(self._sizes)
+            log.warning(f"Spool is full, dropping segment {oldest} "
+                        f"({self._sizes[oldest]} bytes)!")
+            self._delete_before(oldest + 1)
+            if self._cursor[0] <= oldest:
+                self._cursor = (min(self._sizes), 0)
+
+
+class SpooledWriter:
+    """Sends every point through a Spool to a writer.
+
+    write() only appends to the spool and never waits for the network.
+    The points are spooled as line protocol, one point per record.
+    A drainer thread reads the spool in chunks of chunk_size points and sends
+    them with writer.send(). At most rate points per second are sent, so
+    replaying a long backlog after an outage does not flood the database.
+    When sending fails the drainer waits retry_interval seconds, doubling up
+    to max_retry_interval while the database stays offline. A chunk the
+    database rejects (see writer.rejected()) is skipped with a warning, it
+    would fail again and hold up every later point.
+
+    Args:
+        writer: The InfluxWriter the points are sent with.
+        spool: The Spool the points are kept in.
+        chunk_size: Maximum number of points per request.
+        rate: Maximum number of points sent per second.
+        retry_interval: Seconds to wait after a failed send.
+        max_retry_interval: Maximum seconds to wait between two retries.
+
+    """
+
+    def __init__(self, writer, spool: Spool, chunk_size: int = 500,
+                 rate: float = 2000.0, retry_interval: float = 5.0,
+                 max_retry_interval: float = 300.0):
+        self.writer = writer
+        self.spool = spool
+        self.chunk_size = chunk_size
+        self.rate = rate
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self._encoder = LineProtocolEncoder(writer.encoder.precision)
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._drainer = threading.Thread(target=self._drain, name="spool-drainer",
+                                         daemon=True)
+        self._drainer.start()
+
+    def __len__(self):
+        return len(self.spool)
+
+    def write(self, data: list):
+        """Appends the points to the spool and wakes up the drainer.
+
+        Args:
+            data: A list of points as returned by handler.collect_measurements.
+
+        """
+        lines = self._encoder.encode(data)
+        if lines:
+            self.spool.append(lines.split(b"\n"))
+        self._wakeup.set()
+
+    def close(self):
+        """Stops the drainer, tries to send one last chunk and closes everything."""
+        self._closed.set()
+        self._wakeup.set()
+        self._drainer.join()
+        try:
+            self._send_chunk()
+        except Exception as e:
+            log.warning(e)
+            log.warning(f"{len(self.spool)} bytes stay in the spool until the next start.")
+        self.spool.close()
+        self.writer.close()
+
+    def _send_chunk(self) -> int:
+        """Sends the oldest chunk of the spool and returns its size."""
+        records, position = self.spool.read(self.chunk_size)
+        if records:
+            try:
+                self.writer.send(b"\n".join(records))
+            except Exception as e:
+                if not rejected(e):
+                    raise
+                metrics.observe_rejected(self.writer.name, len(records))
+                log.warning(e)
+                log.warning(f"The database rejected {len(records)} spooled points, "
+                            "they are skipped!")
+            self.spool.commit(position)
+        return len(records)
+
+    def _drain(self):
+        """Runs in the drainer thread until close() is called."""
+        retry = self.retry_interval
+        while not self._closed.is_set():
+            try:
+                sent = self._send_chunk()
+            except Exception as e:
+                log.warning(e)
+                log.warning(f"Could not send data to database! Is it online? "
+                            f"{len(self.spool)} bytes spooled, retrying in {retry} seconds.")
+                self._closed.wait(retry)
+                retry = min(retry * 2, self.max_retry_interval)
+                continue
+            retry = self.retry_interval
+            if sent:
+                self._closed.wait(sent / self.rate)
+            else:
+                self._wakeup.wait()
+                self._wakeup.clear()
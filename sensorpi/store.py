@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+import json
+import logging
+import numbers
+import os
+import sqlite3
+import time
+from typing import NamedTuple
+
+from .metrics import metrics
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY,
+    measurement TEXT NOT NULL,
+    sensor TEXT,
+    tags TEXT NOT NULL,
+    field TEXT NOT NULL,
+    UNIQUE (measurement, tags, field)
+);
+CREATE INDEX IF NOT EXISTS series_by_sensor ON series (sensor, field);
+CREATE TABLE IF NOT EXISTS samples (
+    series INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (series, time)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS samples_by_time ON samples (time);
+"""
+
+MS = 1_000_000  # nanoseconds per millisecond, the precision of the store
+
+
+class Row(NamedTuple):
+    """A sample, or the summary of the samples of a bucket of a downsampled query.
+
+    Attributes:
+        time: Unix time in seconds, the start of the bucket when downsampled.
+        measurement: The measurement.
+        tags: Dictionary of the tags.
+        field: The name of the field.
+        mean: The value, or the mean of the bucket.
+        min: The value, or the minimum of the bucket.
+        max: The value, or the maximum of the bucket.
+        count: 1, or the number of samples in the bucket.
+
+    """
+    time: float
+    measurement: str
+    tags: dict
+    field: str
+    mean: float
+    min: float
+    max: float
+    count: int
+
+
+class LocalStore:
+    """Keeps the recent readings in a SQLite database on the Pi.
+
+    Every numeric field of a point is a sample of a series (measurement, tags
+    and field). The series are stored once, a sample is only the id of its
+    series, the time in milliseconds and the value, in a table without rowid
+    sorted by series and time. The points of a cycle are inserted in one
+    transaction. The database runs in WAL mode, so queries do not block
+    the inserts.
+
+    When the database gets larger than max_bytes, the oldest tenth of the
+    time span is deleted and the free pages are given back to the file
+    system, until it fits again.
+
+    Args:
+        path: The path of the database file, created if it does not exist.
+        max_bytes: Maximum size of the database.
+        check_every: Number of inserted samples between two size checks.
+
+    Examples:
+        store = LocalStore("/var/lib/sensorpi/store.db")
+        store.write(points)
+        rows = store.query(sensor="bme280", field="pressure", start=time.time() - 3600, every=60)
+
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024**2, check_every: int = 10_000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.check_every = check_every
+        self.rollovers = 0
+        self._series = {}  # (measurement, tags, field) -> id
+        self._unchecked = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # has to be set before the first table is created
+        self._db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.executescript(SCHEMA)
+        for id_, measurement, tags, field in self._db.execute(
+                "SELECT id, measurement, tags, field FROM series"):
+            self._series[measurement, tags, field] = id_
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, points: list):
+        """Inserts the numeric fields of the points in one transaction.
+
+        Args:
+            points: Points as returned by handler.collect_measurements.
+
+        """
+        samples = []
+        for point in points:
+            if point.time is None:
+                continue
+            tags = json.dumps(dict(point.tags), sort_keys=True)
+            for field, value in point.fields.items():
+                if isinstance(value, bool) or not isinstance(value, numbers.Real):
+                    continue
+                series = self._series.get((point.measurement, tags, field))
+                if series is None:
+                    series = self._add_series(point.measurement, dict(point.tags), tags, field)
+                samples.append((series, point.time // MS, float(value)))
+        if not samples:
+            return
+        start = time.perf_counter()
+        ok = False
+        try:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?, ?)", samples)
+            ok = True
+        finally:
+            metrics.observe_write("store", time.perf_counter() - start, ok, len(samples))
+        self._unchecked += len(samples)
+        if self._unchecked >= self.check_every:
+            self._unchecked = 0
+            self._enforce_size()
+
+    def size(self) -> int:
+        """Returns the bytes used by the database and its write-ahead log."""
+        page_size, = self._db.execute("PRAGMA page_size").fetchone()
+        pages, = self._db.execute("PRAGMA page_count").fetchone()
+        try:
+            wal = os.path.getsize(self.path + "-wal")
+        except OSError:
+            wal = 0
+        return page_size * pages + wal
+
+    def series(self) -> list:
+        """Returns all series as (measurement, tags, field, number of samples, first, last)."""
+        rows = self._db.execute(
+            "SELECT s.measurement, s.tags, s.field, count(*), min(t.time), max(t.time) "
+            "FROM series s JOIN samples t ON t.series = s.id GROUP BY s.id "
+            "ORDER BY s.measurement, s.sensor, s.field")
+        return [(measurement, json.loads(tags), field, count, first / 1e3, last / 1e3)
+                for measurement, tags, field, count, first, last in rows]
+
+    def query(self, sensor: str = None, field: str = None, measurement: str = None,
+              start: float = None, end: float = None, every: float = None) -> list:
+        """Returns the samples in a time range, optionally downsampled.
+
+        Args:
+            sensor: Only series of this sensor (the tag "sensor").
+            field: Only this field.
+            measurement: Only this measurement.
+            start: Unix time in seconds of the first sample.
+            end: Unix time in seconds after the last sample.
+            every: Summarize the samples in buckets of this many seconds.
+
+        Returns:
+            rows: A list of Row, sorted by series and time.
+
+        """
+        where, args = [], []
+        for column, value in (("s.sensor", sensor), ("s.field", field),
+                              ("s.measurement", measurement)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if start is not None:
+            where.append("t.time >= ?")
+            args.append(int(start * 1e3))
+        if end is not None:
+            where.append("t.time < ?")
+            args.append(int(end * 1e3))
+        condition = f"WHERE {' AND '.join(where)}" if where else ""
+        if every:
+            bucket = max(1, int(every * 1e3))
+            sql = (f"SELECT (t.time / {bucket}) * {bucket} AS b, s.measurement, s.tags, s.field, "
+                   "avg(t.value), min(t.value), max(t.value), count(*) "
+                   f"FROM samples t JOIN series s ON t.series = s.id {condition} "
+                   "GROUP BY s.id, b ORDER BY s.id, b")
+        else:
+            sql = ("SELECT t.time, s.measurement, s.tags, s.field, t.value, t.value, t.value, 1 "
+                   f"FROM samples t JOIN series s ON t.series = s.id {condition} "
+                   "ORDER BY s.id, t.time")
+        return [Row(time / 1e3, measurement, json.loads(tags), field, mean, low, high, count)
+                for time, measurement, tags, field, mean, low, high, count
+                in self._db.execute(sql, args)]
+
+    def close(self):
+        """Checkpoints the write-ahead log and closes the database."""
+        if self._db is None:
+            return
+        try:
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            self._db.close()
+            self._db = None
+
+    def _add_series(self, measurement: str, tags: dict, tags_json: str, field: str) -> int:
+        with self._db:
+            self._db.execute("INSERT OR IGNORE INTO series (measurement, sensor, tags, field) "
+                             "VALUES (?, ?, ?, ?)",
+                             (measurement, tags.get("sensor"), tags_json, field))
+        series, = self._db.execute("SELECT id FROM series WHERE measurement = ? AND tags = ? "
+                                   "AND field = ?", (measurement, tags_json, field)).fetchone()
+        self._series[measurement, tags_json, field] = series
+        return series
+
+    def _enforce_size(self):
+        """Deletes the oldest samples until the database fits into max_bytes."""
+        self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        while self.size() > self.max_bytes:
+            first, last = self._db.execute("SELECT min(time), max(time) FROM samples").fetchone()
+            if first is None:
+                break
+            cut = first + max(1, (last - first) // 10)
+            with self._db:
+                deleted = self._db.execute("DELETE FROM samples WHERE time < ?", (cut,)).rowcount
+            self._db.execute("PRAGMA incremental_vacuum")
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.rollovers += 1
+            log.info(f"Local store is full, deleted {deleted} samples older than "
+                     f"{cut / 1e3:.0f} (unix time).")
+            if first == last:
+                break
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+import logging
+import marshal
+import struct
+import time
+import zlib
+
+from .points import Point
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+MAGIC = b"SPTRACE1"
+BLOCK = struct.Struct("<II")  # compressed size, number of cycles
+MARSHAL_VERSION = 4
+PLAIN = (float, int, str, bool, type(None))
+
+
+class Cycle:
+    """The points of one measurement cycle in a trace.
+
+    Attributes:
+        monotonic: time.monotonic_ns() when the cycle was recorded.
+        timestamp: The timestamp of the cycle, unix time in seconds.
+        points: The points collected in the cycle.
+
+    """
+    __slots__ = ("monotonic", "timestamp", "points")
+
+    def __init__(self, monotonic: int, timestamp: float, points: list):
+        self.monotonic = monotonic
+        self.timestamp = timestamp
+        self.points = points
+
+
+def _plain(fields: dict) -> dict:
+    """Returns the fields with numbers marshal does not know (like numpy's) as python numbers.
+
+    marshal would store numpy numbers as their bytes.
+
+    """
+    if all(type(v) in PLAIN for v in fields.values()):
+        return fields
+    return {k: v.item() if hasattr(v, "item") else v for k, v in fields.items()}
+
+
+class Recorder:
+    """Records the points of every cycle into a compact binary trace.
+
+    The file starts with MAGIC, followed by blocks. A block is its header
+    (compressed size and number of cycles) and a zlib compressed marshal
+    of its cycles, each (monotonic ns, timestamp, points as tuples).
+    A block is written every block_cycles cycles or block_seconds seconds,
+    so a crash loses at most the last block.
+
+    Args:
+        path: The path of the trace, it is overwritten.
+        block_cycles: Maximum number of cycles per block.
+        block_seconds: Maximum seconds a cycle waits to be written.
+        level: The zlib compression level.
+
+    Examples:
+        with Recorder("field.trace") as recorder:
+            recorder.record(tick.timestamp, data)
+
+    """
+
+    def __init__(self, path: str, block_cycles: int = 64, block_seconds: float = 60.0,
+                 level: int = 6):
+        self.path = path
+        self.block_cycles = block_cycles
+        self.block_seconds = block_seconds
+        self.level = level
+        self.cycles = 0
+        self._block = []
+        self._block_started = None
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record(self, timestamp: float, points: list, monotonic: int = None):
+        """Adds the points of a cycle to the trace.
+
+        Args:
+            timestamp: The timestamp of the cycle, unix time in seconds.
+            points: The points returned by handler.collect_measurements.
+            monotonic: time.monotonic_ns() of the cycle, now if None.
+
+        """
+        monotonic = time.monotonic_ns() if monotonic is None else monotonic
+        if not self._block:
+            self._block_started = time.monotonic()
+        self._block.append((monotonic, timestamp,
+                            [(p.measurement, p.tags, _plain(p.fields), p.time) for p in points]))
+        self.cycles += 1
+        if (len(self._block) >= self.block_cycles
+                or time.monotonic() - self._block_started >= self.block_seconds):
+            self.flush()
+
+    def flush(self):
+        """Writes the cycles of the current block."""
+        if not self._block:
+            return
+        data = zlib.compress(marshal.dumps(self._block, MARSHAL_VERSION), self.level)
+        self._file.write(BLOCK.pack(len(data), len(self._block)) + data)
+        self._file.flush()
+        self._block = []
+
+    def close(self):
+        """Writes the last block and closes the file."""
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+
+def read_trace(path: str):
+    """Yields the Cycles of a trace.
+
+    A trace that ends in a torn block, e.g. after a power cut, ends with
+    the last complete block.
+
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a sensorpi trace.")
+        while True:
+            header = f.read(BLOCK.size)
+            if not header:
+                return
+            data = f.read(BLOCK.unpack(header)[0]) if len(header) == BLOCK.size else b""
+            try:
+                block = marshal.loads(zlib.decompress(data))
+            except (zlib.error, EOFError, ValueError):
+                log.warning(f"The trace {path} ends with a torn block, it was ignored.")
+                return
+            for monotonic, timestamp, points in block:
+                yield Cycle(monotonic, timestamp,
+                            [Point(measurement, dict(tags), fields, t)
+                             for measurement, tags, fields, t in points])
+
+
+def replay(path: str, speed: float = 1.0, retime: bool = False, clock=time.monotonic,
+           sleep=time.sleep):
+    """Yields the Cycles of a trace at the pace they were recorded.
+
+    Args:
+        path: The path of the trace.
+        speed: Factor of the pace, 100 replays 100 times faster than recorded.
+            0 replays as fast as possible.
+        retime: Shifts the times of the points, as if the first cycle was now.
+        clock: Monotonic clock, only replaced in tests.
+        sleep: Sleep function, only replaced in tests.
+
+    """
+    start = first = shift = None
+    for cycle in read_trace(path):
+        if first is None:
+            start, first = clock(), cycle.monotonic
+            shift = round((time.time() - cycle.timestamp) * 1e9) if retime else 0
+        if speed:
+            wait = start + (cycle.monotonic - first) / 1e9 / speed - clock()
+            if wait > 0:
+                sleep(wait)
+        if shift:
+            cycle.timestamp += shift / 1e9
+            for point in cycle.points:
+                if point.time is not None:
+                    point.time += shift
+        yield cycle
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+import logging
+import threading
+import time
+
+from influxdb_client import InfluxDBClient
+from influxdb_client.client.write_api import SYNCHRONOUS
+from .metrics import metrics
+from .points import LineProtocolEncoder, Point
+from .profiling import profiler
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+hdlr = logging.StreamHandler()
+log.addHandler(hdlr)
+
+RETRIED_STATUSES = (408, 429)  # client errors that may pass when sent again
+
+
+def rejected(error: Exception) -> bool:
+    """Returns whether the database rejected the points for good.
+
+    A 4xx answer, e.g. for a field type conflict or a line influx cannot
+    parse, comes again for the same points, so they must not be retried.
+    Connection errors, 5xx answers, 408 and 429 are worth another try.
+
+    Args:
+        error: The exception raised by sending, its status is the HTTP status.
+
+    """
+    status = getattr(error, "status", None)
+    return (isinstance(status, int) and 400 <= status < 500
+            and status not in RETRIED_STATUSES)
+
+
+class InfluxWriter:
+    """Long-lived writer that buffers points and sends them in batches.
+
+    One client (and with it one keep-alive HTTP connection pool) is created
+    when the writer is created and reused for every write. Points given to
+    write() are buffered and sent when either batch_size points are waiting
+    or the oldest buffered point is older than flush_interval seconds.
+
+    Points are encoded to line protocol with the given timestamp precision
+    by a LineProtocolEncoder that is reused for every request.
+
+    If sending fails the points stay in the buffer and are sent with the next
+    flush. The buffer is capped at max_buffer points, the oldest points are
+    dropped first. A batch the database rejects (see rejected()) is dropped
+    instead, sending it again would block all later points.
+
+    Args:
+        db: Name of the database.
+        user: Username for the database.
+        password: Password for the database.
+        influx_url: Url of the influxdb.
+        org: Organization, "-" for a v1.8 influxdb.
+        retention_policy: The retention policy of the database.
+        batch_size: Number of points that trigger a flush.
+        flush_interval: Maximum age of a buffered point in seconds.
+        max_buffer: Maximum number of points kept while the database is offline.
+        precision: Precision of the timestamps sent, "s", "ms", "us" or "ns".
+
+    Examples:
+        with InfluxWriter("test", batch_size=100) as writer:
+            writer.write(data)
+
+    """
+
+    def __init__(self, db: str, user: str = None, password: str = None,
+                 influx_url: str = "http://localhost:8086",
+                 org: str = "-", retention_policy: str = "autogen",
+                 batch_size: int = 500, flush_interval: float = 10.0,
+                 max_buffer: int = 50_000, precision: str = "ms"):
+        self.bucket = f"{db}/{retention_policy}"
+        self.name = "influx"  # of the sink in the metrics
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.encoder = LineProtocolEncoder(precision)
+        self._client = InfluxDBClient(url=influx_url, token=f"{user}:{password}", org=org)
+        self._write_api = self._client.write_api(write_options=SYNCHRONOUS)
+        self._buffer = []
+        self._oldest = None  # monotonic time of the oldest buffered point
+        self._lock = threading.Lock()  # guards the buffer
+        self._send_lock = threading.Lock()  # only one request at a time
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically,
+                                         name="influx-flusher", daemon=True)
+        self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def write(self, data: list):
+        """Adds the points to the buffer and flushes if the batch is full.
+
+        Args:
+            data: A list of points as returned by handler.collect_measurements.
+
+        Raises:
+            Exception: Whatever the client raises if a triggered flush fails.
+                The points are kept in the buffer in this case.
+
+        """
+        with self._lock:
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.extend(data)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self.flush()
+
+    def send(self, data):
+        """Sends the data to the database right away, without buffering.
+
+        Args:
+            data: A list of Points, encoded line protocol as bytes,
+                or a list of dicts in the old json format.
+
+        """
+        with self._send_lock:
+            if data and isinstance(data, list) and isinstance(data[0], Point):
+                with profiler.span("serialize"):
+                    data = self.encoder.encode(data)
+            if isinstance(data, bytes):
+                count = data.count(b"\n") + 1 if data else 0
+            else:
+                count = len(data)
+            start = time.perf_counter()
+            ok = False
+            try:
+                with profiler.span("http", points=count):
+                    self._write_api.write(bucket=self.bucket, record=data,
+                                          write_precision=self.encoder.precision)
+                ok = True
+            finally:
+                metrics.observe_write(self.name, time.perf_counter() - start, ok, count)
+
+    def flush(self):
+        """Sends all buffered points.
+
+        Raises:
+            Exception: Whatever the client raises if sending fails.
+                The points are put back into the buffer in this case,
+                unless the database rejected them.
+
+        """
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            oldest, self._oldest = self._oldest, None
+        if not batch:
+            return
+        try:
+            self.send(batch)
+        except Exception as e:
+            if rejected(e):
+                metrics.observe_rejected(self.name, len(batch))
+                log.warning(e)
+                log.warning(f"The database rejected {len(batch)} points, they are dropped!")
+                return
+            with self._lock:
+                self._buffer[:0] = batch
+                self._oldest = oldest
+                dropped = len(self._buffer) - self.max_buffer
+                if dropped > 0:
+                    del self._buffer[:dropped]
+                    log.warning(f"Writer buffer full, dropped {dropped} points!")
+            raise
+
+    def close(self):
+        """Stops the flusher thread, sends the remaining points and closes the client."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._flusher.join()
+        try:
+            self.flush()
+        except Exception as e:
+            log.warning(e)
+            log.warning(f"Could not send {len(self._buffer)} buffered points on exit!")
+        finally:
+            self._write_api.close()
+            self._client.close()
+
+    def _flush_periodically(self):
+        """Runs in the flusher thread and sends points older than flush_interval."""
+        while not self._closed.wait(min(1.0, self.flush_interval)):
+            oldest = self._oldest
+            if oldest is None or time.monotonic() - oldest < self.flush_interval:
+                continue
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning(e)
+                log.warning("Could not send data to database! Is it online?")
@@ -0,0 +1,23 @@
+import cv2
+import numpy as np
+
+
+class StubCamera:
+    """Stands in for picamera.PiCamera and writes a gray jpeg or yuv frame."""
+    resolution = (60, 40)  # padded to 64x48 like the real camera
+
+    def __init__(self):
+        self.closed = False
+        frame = np.full((48, 64, 3), 128, dtype=np.uint8)
+        self.jpeg = cv2.imencode(".jpg", frame)[1].tobytes()
+
+    def capture(self, output, format):
+        if format == "jpeg":
+            output.write(self.jpeg)
+        else:
+            assert format == "yuv"
+            output[:48] = np.arange(48 * 64).reshape(48, 64) % 256
+            output[48:] = 128
+
+    def close(self):
+        self.closed = True
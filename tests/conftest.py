@@ -0,0 +1,25 @@
+import pytest
+
+from sensorpi.sensors import handler
+
+
+@pytest.fixture
+def fake_driver():
+    """Registers the sensor type "fake", so no real driver is imported."""
+    def as_json(measurement, sensor_name, comment=None, **kwargs):
+        return [{"measurement": measurement, "tags": {"sensor": sensor_name}, "fields": {"v": 1.0}}]
+    handler.sensor_funcs["fake"] = as_json
+    yield
+    del handler.sensor_funcs["fake"]
+
+
+@pytest.fixture
+def session(monkeypatch):
+    """A CameraSession with a StubCamera, used by the camera driver."""
+    from sensorpi.sensors import camera  # needs cv2, only for the camera tests
+    from tests.camera_stub import StubCamera
+    warmups = []
+    session = camera.CameraSession(backend=StubCamera, sleep=warmups.append)
+    session.warmups = warmups
+    monkeypatch.setattr(camera, "session", session)
+    return session
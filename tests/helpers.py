@@ -0,0 +1,9 @@
+import time
+
+
+def wait_for(condition, timeout=5.0):
+    """Waits until condition() is true, at most timeout seconds."""
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
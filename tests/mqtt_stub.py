@@ -0,0 +1,70 @@
+import socket
+import struct
+import threading
+
+
+class MqttStub:
+    """A local stand-in for an MQTT broker.
+
+    Accepts every connection and records the client ids and the published
+    messages as (topic, payload). Only understands CONNECT, PUBLISH with
+    QoS 0 and DISCONNECT, which is all the MqttSink sends.
+
+    Examples:
+        with MqttStub() as stub:
+            publish(stub.port)
+            assert stub.messages == [("sensorpi/weather/dht", b"...")]
+
+    """
+
+    def __init__(self):
+        self.clients = []
+        self.messages = []
+        self._lock = threading.Lock()
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn, conn.makefile("rb") as stream:
+            while True:
+                header = stream.read(1)
+                if not header:
+                    return
+                length, shift = 0, 0
+                while True:
+                    byte = stream.read(1)[0]
+                    length |= (byte & 0x7f) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = stream.read(length)
+                kind = header[0] >> 4
+                if kind == 1:  # CONNECT
+                    protocol, = struct.unpack("!H", body[:2])
+                    client_length, = struct.unpack("!H", body[2 + protocol + 4:2 + protocol + 6])
+                    with self._lock:
+                        self.clients.append(body[2 + protocol + 6:][:client_length].decode())
+                    conn.sendall(b"\x20\x02\x00\x00")
+                elif kind == 3:  # PUBLISH
+                    topic_length, = struct.unpack("!H", body[:2])
+                    with self._lock:
+                        self.messages.append((body[2:2 + topic_length].decode(),
+                                              body[2 + topic_length:]))
+                elif kind == 14:  # DISCONNECT
+                    return
@@ -0,0 +1,12 @@
+"""A sensor driver that takes a while to import, like one importing numpy on a slow board."""
+import os
+import time
+
+IMPORT_SECONDS = 1.5
+
+time.sleep(IMPORT_SECONDS)
+
+
+def pid_sensor(measurement, sensor_name, **kwargs):
+    return [{"measurement": measurement, "tags": {"sensor": sensor_name},
+             "fields": {"pid": os.getpid()}}]
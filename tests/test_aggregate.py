@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from sensorpi.aggregate import Aggregator, RingBuffer, summarize
+from sensorpi.points import Point
+
+SECOND = 1_000_000_000
+
+
+def sample(sensor, t, **fields):
+    return Point("weather", {"sensor": sensor}, fields, round(t * SECOND))
+
+
+def test_ring_buffer_keeps_the_newest_samples():
+    buffer = RingBuffer(4)
+    for i in range(6):
+        buffer.append()[0] = i
+    assert buffer.dropped == 2
+    assert buffer.window()[:, 0].tolist() == [2, 3, 4, 5]
+
+
+def test_summarize_ignores_missing_values():
+    window = np.array([[1.0, np.nan], [3.0, np.nan], [5.0, 2.0]])
+    mean, low, high, std, count = summarize(window)
+    assert mean.tolist() == [3.0, 2.0]
+    assert low.tolist() == [1.0, 2.0] and high.tolist() == [5.0, 2.0]
+    assert std[0] == pytest.approx(np.std([1, 3, 5]))
+    assert count.tolist() == [3, 1]
+
+
+def test_one_point_per_window():
+    sensors = {"bme": {"type": "bme280", "interval": 0.2, "aggregate": {"window": 10}},
+               "ds": {"type": "ds18b20"}}
+    aggregator = Aggregator(sensors, 60)
+    out = []
+    pressures = []
+    for i in range(100):  # 20 seconds at 5 Hz
+        pressure = 1000 + i % 7
+        if i < 50:
+            pressures.append(pressure)
+        out += aggregator.add([sample("bme", 1000 + i * 0.2, pressure=pressure, comment="x"),
+                               sample("ds", 1000 + i * 0.2, temperature=20.0)])
+    aggregated = [p for p in out if dict(p.tags)["sensor"] == "bme"]
+    assert len([p for p in out if dict(p.tags)["sensor"] == "ds"]) == 100
+    assert len(aggregated) == 1
+    point = aggregated[0]
+    assert dict(point.tags)["window"] == "10s"
+    assert point.time == 1000 * SECOND
+    assert point.fields["pressure_mean"] == pytest.approx(np.mean(pressures))
+    assert point.fields["pressure_std"] == pytest.approx(np.std(pressures))
+    assert point.fields["pressure_min"] == 1000 and point.fields["pressure_max"] == 1006
+    assert point.fields["pressure_count"] == 50
+    assert point.fields["comment"] == "x"
+    (last,) = aggregator.flush()
+    assert last.time == 1010 * SECOND and last.fields["pressure_count"] == 50
+
+
+def test_raw_samples_are_kept_if_wanted():
+    aggregator = Aggregator({"lux": {"aggregate": {"window": 1, "raw": True}}}, 0.1)
+    points = [sample("lux", 5 + i / 10, lux=float(i)) for i in range(10)]
+    assert aggregator.add(points) == points
+    (point,) = aggregator.flush()
+    assert point.fields["lux_mean"] == 4.5
+
+
+def test_mean_of_integer_fields_does_not_replace_them():
+    aggregator = Aggregator({"tsl": {"aggregate": {"window": 1, "raw": True}}}, 0.5)
+    raw = aggregator.add([sample("tsl", 5, IR=3), sample("tsl", 5.5, IR=4)])
+    (point,) = aggregator.flush()
+    assert "IR" not in point.fields
+    assert point.fields["IR_mean"] == 3.5
+    assert all(isinstance(p.fields["IR"], int) for p in raw)
+
+
+def test_changed_window_starts_over():
+    aggregator = Aggregator({"a": {"aggregate": {"window": 10}}}, 1)
+    aggregator.add([sample("a", 1, v=1.0)])
+    aggregator.update({"a": {"aggregate": {"window": 5}}}, 1)
+    assert aggregator.flush() == []
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+
+from benchmarks.influx_stub import InfluxStub
+from sensorpi import aio
+from sensorpi.points import Point
+from sensorpi.sensors import handler
+
+
+def point(i):
+    return Point("test", {"sensor": "DS18B20"}, {"temperature": 20.0 + i},
+                 1_650_000_000_000_000_000 + i * 1_000_000)
+
+
+def test_requests_in_flight_are_bounded():
+    async def main(url):
+        writer = aio.AsyncInfluxWriter("test", influx_url=url, batch_size=10, max_in_flight=2)
+        await writer.start()
+        writer.write([point(i) for i in range(60)])
+        await writer.close()
+
+    with InfluxStub(delay=0.2) as stub:
+        asyncio.run(main(stub.url))
+    assert len(stub.lines) == 60
+    assert stub.requests == 6
+    assert stub.max_active == 2
+    assert stub.connections == 2
+
+
+def test_failed_points_stay_buffered():
+    async def main(url):
+        writer = aio.AsyncInfluxWriter("test", influx_url=url, batch_size=10)
+        await writer.start()
+        writer.write([point(i) for i in range(5)])
+        await writer.close()
+        return len(writer)
+
+    with InfluxStub(status=500) as stub:
+        assert asyncio.run(main(stub.url)) == 5
+
+
+def test_rejected_points_are_dropped():
+    async def main(url):
+        writer = aio.AsyncInfluxWriter("test", influx_url=url, batch_size=10)
+        await writer.start()
+        writer.write([point(i) for i in range(5)])
+        await writer.close()
+        return len(writer)
+
+    with InfluxStub(status=400) as stub:
+        assert asyncio.run(main(stub.url)) == 0
+    assert stub.requests == 1
+
+
+def test_failed_batch_keeps_its_age():
+    async def main(url):
+        writer = aio.AsyncInfluxWriter("test", influx_url=url, batch_size=10, flush_interval=60)
+        await writer.start()
+        writer.write([point(i) for i in range(5)])
+        oldest = writer._oldest
+        await writer._send_batch()
+        await asyncio.sleep(0.01)
+        writer.write([point(5)])  # while the batch is in flight
+        await asyncio.gather(*writer._in_flight)
+        assert len(writer) == 6 and writer._oldest == oldest
+        await writer.close()
+
+    with InfluxStub(status=503) as stub:
+        asyncio.run(main(stub.url))
+
+
+class Recorder:
+    """Records how long after its tick every cycle reached the writer."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.lateness = []
+
+    async def start(self):
+        await self.writer.start()
+
+    def write(self, data):
+        if data:
+            self.lateness.append(time.time() - data[0].time / 1e9)
+        self.writer.write(data)
+
+    async def close(self):
+        await self.writer.close()
+
+
+def test_slow_database_does_not_delay_measurements(monkeypatch):
+    def fast(measurement, sensor_name, **kwargs):
+        return [{"measurement": measurement, "tags": {"sensor": sensor_name},
+                 "fields": {"value": 1.0}}]
+    monkeypatch.setitem(handler.sensor_funcs, "fast", fast)
+    sensors = {"a": {"type": "fast"}, "b": {"type": "fast"}}
+    config = {"influxdb": {"db": "test"}}
+
+    async def main(url):
+        writer = Recorder(aio.AsyncInfluxWriter("test", influx_url=url, batch_size=4))
+        stop = asyncio.Event()
+        asyncio.get_running_loop().call_later(1.5, stop.set)
+        await aio.loop(0.1, sensors, "test", config, writer, workers=2, stop=stop)
+        return writer
+
+    with InfluxStub(delay=0.5) as stub:
+        start = time.monotonic()
+        writer = asyncio.run(main(stub.url))
+        elapsed = time.monotonic() - start
+    cycles = len(writer.lateness)
+    assert cycles >= 12
+    assert max(writer.lateness) < 0.1  # while every request takes 0.5 seconds
+    assert len(stub.lines) == 2 * cycles  # everything was flushed on shutdown
+    assert elapsed < 5
+
+
+class ThreadRecorder:
+    """A blocking store and writer, remembers the threads it was used from."""
+
+    def __init__(self):
+        self.threads = set()
+        self.points = 0
+
+    def write(self, data):
+        self.threads.add(threading.get_ident())
+        self.points += len(data)
+
+    def close(self):
+        pass
+
+
+def test_store_and_blocking_writers_stay_off_the_event_loop(monkeypatch):
+    def fast(measurement, sensor_name, **kwargs):
+        return [{"measurement": measurement, "tags": {"sensor": sensor_name},
+                 "fields": {"value": 1.0}}]
+    monkeypatch.setitem(handler.sensor_funcs, "fast", fast)
+    store, writer = ThreadRecorder(), ThreadRecorder()
+
+    async def main():
+        stop = asyncio.Event()
+        asyncio.get_running_loop().call_later(0.5, stop.set)
+        await aio.loop(0.1, {"a": {"type": "fast"}}, "test", {"influxdb": {"db": "test"}},
+                       writer, store=store, stop=stop)
+        return threading.get_ident()
+
+    event_loop_thread = asyncio.run(main())
+    assert store.points >= 3 and writer.points == store.points
+    assert event_loop_thread not in store.threads | writer.threads
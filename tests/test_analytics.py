@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from sensorpi.config import ConfigError, compile_config
+from sensorpi.sensors import camera, handler
+from sensorpi.sensors.analytics import RoiAnalyzer, parse_rect
+
+
+def naive(region: np.ndarray, saturation=250) -> dict:
+    """The metrics of one region with a copy of it, to compare with."""
+    values = region.ravel()
+    return {"mean": values.mean(), "std": values.std(), "min": values.min(),
+            "max": values.max(), "saturated": (values >= saturation).mean(),
+            "p5": np.percentile(values, 5, method="inverted_cdf"),
+            "p50": np.percentile(values, 50, method="inverted_cdf"),
+            "p95": np.percentile(values, 95, method="inverted_cdf")}
+
+
+def test_parse_rect():
+    assert parse_rect([10, 20, 30, 40], 100, 50) == (10, 20, 40, 50)
+    assert parse_rect([0.5, 0.0, 0.5, 1.0], 640, 480) == (320, 0, 640, 480)
+    assert parse_rect([-5, 0, 20, 10], 100, 50) == (0, 0, 15, 10)
+
+
+@pytest.mark.parametrize("shape", [(480, 640), (97, 131)])
+def test_overlapping_regions_match_copies(shape):
+    rng = np.random.default_rng(0)
+    luma = rng.integers(0, 256, size=shape, dtype=np.uint8)
+    h, w = shape
+    rois = {"all": [0, 0, w, h], "top": [0, 0, w, h // 2], "middle": [w // 4, h // 4, w // 2, h // 2],
+            "corner": [w - 10, h - 10, 50, 50], "outside": [w + 1, 0, 10, 10]}
+    metrics = ["mean", "std", "min", "max", "saturated", "p5", "p50", "p95"]
+    fields = RoiAnalyzer(rois, metrics, w, h, chunk=1000).fields(luma)
+    for name, rect in rois.items():
+        x0, y0, x1, y1 = parse_rect(rect, w, h)
+        if name == "outside":
+            assert not any(k.startswith("outside") for k in fields)
+            continue
+        for metric, value in naive(luma[y0:y1, x0:x1]).items():
+            assert fields[f"{name}_{metric}"] == pytest.approx(value), (name, metric)
+
+
+def test_histograms_per_channel():
+    bgr = np.zeros((4, 8, 3), dtype=np.uint8)
+    bgr[..., 2] = 255  # red
+    bgr[:, :4, 0] = 100  # blue in the left half
+    luma = np.full((4, 8), 76, dtype=np.uint8)
+    fields = RoiAnalyzer({"left": [0, 0, 4, 4]}, ["hist"], 8, 4, bins=4).fields(luma, bgr)
+    assert [fields[f"left_hist_b{i}"] for i in range(4)] == [0.0, 1.0, 0.0, 0.0]
+    assert [fields[f"left_hist_r{i}"] for i in range(4)] == [0.0, 0.0, 0.0, 1.0]
+    assert fields["left_hist_g0"] == 1.0
+
+
+def test_regions_of_a_rotated_frame():
+    yuv = np.zeros((24, 32), dtype=np.uint8)
+    yuv[:4, :8] = 200  # the top left of the sensor, the bottom right when rotated
+    frame = camera.Frame(yuv, 32, 16)
+    fields = camera.roi_fields(frame, {"bottom_right": [24, 12, 8, 4]}, ["mean"], rotate=True)
+    assert fields == {"bottom_right_mean": 200.0}
+    assert camera.roi_fields(frame, None, ["max"], rotate=True) == {"frame_max": 200.0}
+
+
+def test_camera_sends_region_metrics(session):
+    sensors = {"cam": {"type": "camera", "analytics": "luma",
+                       "rois": {"left": [0.0, 0.0, 0.5, 1.0]}, "metrics": ["mean", "p95"]}}
+    (point,) = handler.collect_measurements(sensors, "test", 0)
+    luma = (np.arange(48 * 64).reshape(48, 64) % 256)[:40, :60]
+    assert set(point.fields) == {"left_mean", "left_p95"}
+    assert point.fields["left_mean"] == pytest.approx(luma[:, 30:].mean())  # flipped
+
+
+def test_metrics_are_validated():
+    config = {"influxdb": {"db": "test"},
+              "sensors": {"cam": {"type": "camera", "rois": {"sky": [0, 0, 10]},
+                                  "metrics": ["mean", "p101", "median"]}}}
+    with pytest.raises(ConfigError) as e:
+        compile_config(config, 10)
+    assert ":rois of sensor cam" in str(e.value)
+    assert ":metrics of sensor cam" in str(e.value)
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from benchmarks import simulated, suite
+from sensorpi.sensors import handler
+from sensorpi.sensors.registry import SensorRegistry
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    # the simulated drivers replace the real ones, keep that out of other tests
+    monkeypatch.setattr(handler, "sensor_funcs", SensorRegistry(group="none"))
+
+
+def test_simulated_driver_fails_at_its_rate():
+    driver = simulated.SimulatedDriver(0.0, {"temperature": 20.0}, failure_rate=0.5, seed=1)
+    for _ in range(200):
+        try:
+            data = driver("m", sensor_name="A")
+            assert data[0]["tags"]["sensor"] == "A"
+        except RuntimeError:
+            pass
+    assert driver.reads == 200
+    assert 70 < driver.failures < 130
+
+
+def test_simulated_sensors_compile_like_a_config():
+    simulated.install(scale=0)
+    sensors = simulated.sensors(10, interval=1)
+    points = handler.collect_measurements(sensors, "m", 0.0)
+    assert len(points) == 10
+    assert {point.time for point in points} == {0}
+
+
+def test_suite_writes_comparable_results(tmp_path, capsys):
+    output = tmp_path / "results.json"
+    args = ["--sensors", "4", "--cycles", "3", "--loop-cycles", "2", "--interval", "0.1",
+            "--workers", "2", "--scale", "0.001", "--failure-rate", "0", "--output", str(output)]
+    suite.main(args)
+    results = json.loads(output.read_text())
+    assert set(results["scenarios"]) == {"collect", "collect-2", "loop", "loop-spool",
+                                           "loop-profile"}
+    assert results["scenarios"]["collect"]["points"] == 12
+    assert results["scenarios"]["loop"]["points"] == 8
+    suite.main(args + ["--compare", str(output)])
+    assert "%)" in capsys.readouterr().out
+
+
+def test_suite_restores_the_log_levels(tmp_path):
+    before = handler.log.level
+    suite.main(["--sensors", "1", "--cycles", "1", "--loop-cycles", "1", "--interval", "0.05",
+                "--workers", "1", "--scale", "0", "--output", str(tmp_path / "results.json")])
+    assert handler.log.level == before
@@ -0,0 +1,63 @@
+import cv2
+import numpy as np
+import pytest
+
+from sensorpi.sensors import camera, handler
+
+
+def test_session_warms_up_once(session):
+    for _ in range(5):
+        assert camera.capture().shape == (48, 64, 3)
+    assert session.opens == 1
+    assert session.warmups == [2.0]
+    assert session.captures == 5
+    assert session.last_latency < 1.0
+
+
+def test_save_and_histogram_share_one_frame(session, tmp_path):
+    sensors = {"cam": {"type": "camera",
+                       "save": {"path": str(tmp_path / "latest.png")}}}
+    data = handler.collect_measurements(sensors, "test", 0)
+    assert data[0].fields["Integrated Histogram"] > 0
+    assert camera.saver.flush(5)
+    assert (tmp_path / "latest.png").exists()
+    assert session.captures == 1
+
+
+def test_luma_frame_is_a_view_of_the_reused_buffer(session):
+    first = camera.capture(analytics="luma")
+    second = camera.capture(analytics="luma")
+    assert first.luma.shape == (40, 60)
+    assert np.shares_memory(first.luma, second.luma)
+    assert second.bgr().shape == (40, 60, 3)
+
+
+@pytest.mark.parametrize("shape", [(480, 640), (972, 1296), (37, 61)])
+def test_luma_histogram_matches_opencv_histogram(shape):
+    rng = np.random.default_rng(0)
+    gray = rng.integers(0, 256, size=shape, dtype=np.uint8)
+    expected = camera.calc_histogram(np.dstack([gray] * 3))
+    assert np.array_equal(camera.luma_histogram(gray), expected)
+    assert camera.integrate_histogram(camera.luma_histogram(gray)) == \
+        pytest.approx(camera.integrate_histogram(expected))
+
+
+def test_luma_histogram_of_padded_view():
+    rng = np.random.default_rng(1)
+    padded = rng.integers(0, 256, size=(48, 64), dtype=np.uint8)
+    view = padded[:40, :60]
+    assert not view.flags.c_contiguous
+    assert np.array_equal(camera.luma_histogram(view),
+                          np.bincount(view.copy().ravel(), minlength=256))
+
+
+def test_luma_save_encodes_only_the_saved_frame(session, tmp_path):
+    sensors = {"cam": {"type": "camera", "analytics": "luma",
+                       "save": {"path": str(tmp_path / "latest.png")}}}
+    data = handler.collect_measurements(sensors, "test", 0)
+    luma = (np.arange(48 * 64).reshape(48, 64) % 256)[:40, :60]
+    hist = np.bincount(luma.ravel(), minlength=256)
+    assert data[0].fields["Integrated Histogram"] == pytest.approx(np.trapz(hist))
+    assert camera.saver.flush(5)
+    assert cv2.imread(str(tmp_path / "latest.png")).shape == (40, 60, 3)
+    assert session.captures == 1
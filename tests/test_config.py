@@ -0,0 +1,109 @@
+import os
+import pickle
+
+import pytest
+
+from sensorpi import config as cfg
+from sensorpi.sensors import handler
+
+CONFIG = """
+{:influxdb {:db "test"}
+ :sensors {:Fake {:type "fake" :interval 5}
+           :Other {:type "fake" :comment "b"}}}
+"""
+
+
+pytestmark = pytest.mark.usefixtures("fake_driver")
+
+
+class Exploit:
+    """Creates a file when it is unpickled."""
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    def __reduce__(self):
+        return open, (self.path, "w")
+
+
+def write(path, text):
+    path.write_text(text)
+    # make sure the watcher sees a new mtime even on coarse file systems
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+def test_cached_config_is_not_parsed_again(tmp_path, monkeypatch):
+    path = tmp_path / "config.edn"
+    path.write_text(CONFIG)
+    config, digest = cfg.load_config(str(path))
+    assert (tmp_path / ".config.edn.cache").exists()
+
+    def fail(text):
+        raise AssertionError("edn parsed again")
+    monkeypatch.setattr(cfg.edn_format, "loads", fail)
+    assert cfg.load_config(str(path)) == (config, digest)
+
+
+def test_config_cache_is_not_unpickled(tmp_path):
+    path = tmp_path / "config.edn"
+    path.write_text(CONFIG)
+    config, digest = cfg.load_config(str(path))
+    (tmp_path / ".config.edn.cache").write_bytes(pickle.dumps(
+        {"version": 1, "digest": digest, "config": Exploit(tmp_path / "exploited")}))
+    assert cfg.load_config(str(path)) == (config, digest)
+    assert not (tmp_path / "exploited").exists()
+
+
+def test_compile_collects_all_errors():
+    config = {"sensors": {"A": {"type": "nope"}, "B": {"type": "fake", "interval": -1},
+                          "C": {"comment": "no type"}}}
+    with pytest.raises(cfg.ConfigError) as e:
+        cfg.compile_config(config, 10)
+    message = str(e.value)
+    for part in (":influxdb", "nope", "interval of sensor B", "Sensor C has no :type"):
+        assert part in message
+
+
+def test_missing_required_parameter():
+    handler.sensor_funcs["needs"] = lambda measurement, sensor_name, pin: []
+    try:
+        with pytest.raises(cfg.ConfigError, match=":pin"):
+            cfg.compile_config({"influxdb": {"db": "x"}, "sensors": {"A": {"type": "needs"}}}, 10)
+    finally:
+        del handler.sensor_funcs["needs"]
+
+
+def test_plan_is_immutable_and_reads(tmp_path):
+    path = tmp_path / "config.edn"
+    path.write_text(CONFIG)
+    plan = cfg.load_plan(str(path), 10)
+    fake = plan.sensors["Fake"]
+    assert fake.interval == 5 and plan.sensors["Other"].interval == 10
+    with pytest.raises(TypeError):
+        plan.sensors["New"] = fake
+    assert handler.read_sensor("Fake", fake, "m")[0]["tags"] == {"sensor": "Fake"}
+
+
+def test_watcher_reloads_only_changed_sensors(tmp_path):
+    path = tmp_path / "config.edn"
+    path.write_text(CONFIG)
+    plan = cfg.load_plan(str(path), 10)
+    watcher = cfg.ConfigWatcher(str(path), plan, 10)
+    assert watcher.poll() is None
+    write(path, CONFIG.replace(':comment "b"', ':comment "c"'))
+    new = watcher.poll()
+    assert new is not None
+    assert new.sensors["Fake"] is plan.sensors["Fake"]
+    assert new.sensors["Other"] is not plan.sensors["Other"]
+    assert new.sensors["Other"]["comment"] == "c"
+
+
+def test_invalid_change_keeps_old_plan(tmp_path):
+    path = tmp_path / "config.edn"
+    path.write_text(CONFIG)
+    plan = cfg.load_plan(str(path), 10)
+    watcher = cfg.ConfigWatcher(str(path), plan, 10)
+    write(path, CONFIG.replace('"fake" :interval 5', '"unknown"'))
+    assert watcher.poll() is None
+    assert watcher.plan is plan
@@ -0,0 +1,60 @@
+import pytest
+
+from sensorpi.config import ConfigError, compile_config
+from sensorpi.deadband import DeadbandFilter
+from sensorpi.points import Point
+
+SECOND = 1_000_000_000
+
+
+def reading(t, sensor="ds", **fields):
+    return Point("weather", {"sensor": sensor}, fields, t * SECOND)
+
+
+def test_only_changes_beyond_the_band_are_sent():
+    band = DeadbandFilter({"ds": {"deadband": {"abs": 0.5}}})
+    temperatures = [20.0, 20.2, 20.4, 20.6, 19.9, 20.0]
+    sent = [p.fields["temperature"] for t, value in enumerate(temperatures)
+            for p in band.filter([reading(t, temperature=value)])]
+    assert sent == [20.0, 20.6, 19.9]
+    assert (band.passed, band.dropped) == (3, 3)
+
+
+def test_relative_band_and_field_overrides():
+    band = DeadbandFilter({"ds": {"deadband": {"rel": 0.01, "fields": {"humidity": {"abs": 5}}}}})
+    assert band.filter([reading(0, pressure=1000.0, humidity=40.0)])[0].fields == \
+        {"pressure": 1000.0, "humidity": 40.0}
+    (point,) = band.filter([reading(1, pressure=1011.0, humidity=44.0, comment="x")])
+    assert point.fields == {"pressure": 1011.0, "comment": "x"}
+    assert band.filter([reading(2, pressure=1012.0, humidity=46.0)])[0].fields == {"humidity": 46.0}
+
+
+def test_heartbeat_sends_flat_series():
+    band = DeadbandFilter({"ds": {"deadband": {"abs": 1, "heartbeat": 60}}})
+    sent = [t for t in range(0, 200, 10) if band.filter([reading(t, temperature=20.0)])]
+    assert sent == [0, 60, 120, 180]
+
+
+def test_other_sensors_and_series_are_independent():
+    band = DeadbandFilter({"ds": {"deadband": {"abs": 1}}})
+    probe = [Point("weather", {"sensor": "ds", "rom": rom}, {"temperature": 20.0}, 0)
+             for rom in ("28-a", "28-b")]
+    assert len(band.filter(probe)) == 2
+    other = [reading(t, sensor="dht", humidity=40.0) for t in range(3)]
+    assert band.filter(other) == other
+
+
+def test_unchanged_sensor_keeps_its_state_on_reload():
+    sensors = {"ds": {"deadband": {"abs": 1}}}
+    band = DeadbandFilter(sensors)
+    band.filter([reading(0, temperature=20.0)])
+    band.update({**sensors, "dht": {}})
+    assert band.filter([reading(1, temperature=20.5)]) == []
+    band.update({"ds": {"deadband": {"abs": 0.1}}})
+    assert band.filter([reading(2, temperature=20.5)])
+
+
+def test_invalid_deadband_is_rejected():
+    with pytest.raises(ConfigError, match="deadband"):
+        compile_config({"influxdb": {"db": "x"},
+                        "sensors": {"ds": {"type": "ds18b20", "deadband": {"abs": "much"}}}}, 10)
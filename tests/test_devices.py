@@ -0,0 +1,109 @@
+import importlib
+import sys
+import types
+
+import pytest
+
+from sensorpi import sensors
+from sensorpi.sensors import devices
+
+
+class FakeBus:
+    opened = 0
+
+    def __init__(self):
+        FakeBus.opened += 1
+        self.released = False
+
+    def deinit(self):
+        self.released = True
+
+
+class FakeTSL2591:
+    fail = False
+
+    def __init__(self, i2c):
+        self.i2c = i2c
+        self.released = False
+
+    @property
+    def lux(self):
+        if FakeTSL2591.fail:
+            raise OSError(121, "Remote I/O error")
+        return 100.0
+
+    infrared = visible = full_spectrum = 1
+
+    def deinit(self):
+        self.released = True
+
+
+class FakeClock:
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def tsl2591(monkeypatch):
+    """The tsl2591 driver, imported with fakes of board and adafruit_tsl2591."""
+    monkeypatch.setitem(sys.modules, "board", types.SimpleNamespace(I2C=FakeBus, SPI=FakeBus))
+    monkeypatch.setitem(sys.modules, "adafruit_tsl2591",
+                        types.SimpleNamespace(TSL2591=FakeTSL2591))
+    monkeypatch.delitem(sys.modules, "sensorpi.sensors.tsl2591", raising=False)
+    monkeypatch.delattr(sensors, "tsl2591", raising=False)
+    return importlib.import_module("sensorpi.sensors.tsl2591")
+
+
+@pytest.fixture
+def pool(monkeypatch, tsl2591):
+    FakeBus.opened = 0
+    FakeTSL2591.fail = False
+    pool = devices.DevicePool(clock=FakeClock())
+    monkeypatch.setattr(tsl2591, "pool", pool)
+    return pool
+
+
+def test_bus_and_device_are_opened_once(pool, tsl2591):
+    for _ in range(10):
+        assert tsl2591.as_json("test")[0]["fields"]["Lux"] == 100.0
+    assert FakeBus.opened == 1
+    assert pool.stats() == {"open": 2, "opens": 2, "reopens": 0, "failed opens": 0}
+
+
+def test_dead_handle_is_reopened(pool, tsl2591):
+    tsl2591.as_json("test")
+    sensor = pool.get(tsl2591.KEY, None)
+    FakeTSL2591.fail = True
+    assert tsl2591.as_json("test") is None
+    assert sensor.released
+    FakeTSL2591.fail = False
+    assert tsl2591.as_json("test") is not None
+    assert pool.reopens == 1
+    assert FakeBus.opened == 1
+
+
+def test_failed_open_backs_off(pool):
+    def broken():
+        raise OSError("no device")
+
+    with pytest.raises(OSError):
+        pool.get("broken", broken)
+    with pytest.raises(devices.DeviceUnavailable):
+        pool.get("broken", broken)
+    pool._clock.now += 1.0
+    with pytest.raises(OSError):
+        pool.get("broken", broken)
+    pool._clock.now += 1.0  # the backoff doubled to 2 seconds
+    with pytest.raises(devices.DeviceUnavailable):
+        pool.get("broken", broken)
+    assert pool.failed_opens == 2
+
+
+def test_close_releases_everything(pool, tsl2591):
+    tsl2591.as_json("test")
+    bus, sensor = pool.get("i2c", None), pool.get(tsl2591.KEY, None)
+    pool.close()
+    assert bus.released and sensor.released
+    assert len(pool) == 0
@@ -0,0 +1,85 @@
+import pytest
+
+from sensorpi.sensors import ds18b20
+
+
+def add_probe(base, rom, millidegrees, crc="YES"):
+    probe = base / rom
+    probe.mkdir()
+    (probe / "w1_slave").write_text(
+        f"72 01 4b 46 7f ff 0e 10 57 : crc=57 {crc}\n"
+        f"72 01 4b 46 7f ff 0e 10 57 t={millidegrees}\n")
+
+
+@pytest.fixture
+def bus(tmp_path, monkeypatch):
+    (tmp_path / "w1_bus_master1").mkdir()
+    for i in range(40):
+        add_probe(tmp_path, f"28-{i:012x}", 20000 + i * 125)
+    monkeypatch.setattr(ds18b20, "index", ds18b20.ProbeIndex(str(tmp_path)))
+    return tmp_path
+
+
+def test_reads_all_probes(bus):
+    data = ds18b20.as_json("test")
+    assert len(data) == 40
+    assert data[0]["tags"]["rom"] == "28-000000000000"
+    assert data[-1]["fields"]["temperature"] == pytest.approx(20 + 39 * 0.125)
+
+
+def test_addresses_probe_by_rom(bus):
+    data = ds18b20.as_json("test", rom="28-000000000003")
+    assert data == [{"measurement": "test",
+                     "tags": {"sensor": "DS18B20", "comment": None},
+                     "fields": {"temperature": 20.375}}]
+
+
+def test_bus_is_only_scanned_when_it_changes(bus):
+    for _ in range(5):
+        ds18b20.as_json("test")
+    assert ds18b20.index.scans == 1
+    add_probe(bus, "28-ffffffffffff", 1000)
+    assert len(ds18b20.as_json("test")) == 41
+    assert ds18b20.index.scans == 2
+
+
+def test_unknown_rom_triggers_rescan(bus):
+    ds18b20.index.probes()
+    add_probe(bus, "28-aaaaaaaaaaaa", 1000)
+    st = bus.stat()  # pretend the directory did not change
+    ds18b20.index._signature = (st.st_mtime_ns, st.st_nlink)
+    assert ds18b20.as_json("test", rom="28-aaaaaaaaaaaa")[0]["fields"]["temperature"] == 1.0
+    assert ds18b20.index.scans == 2
+
+
+def test_failed_crc_is_dropped(bus):
+    add_probe(bus, "28-bad000000000", 85000, crc="NO")
+    data = ds18b20.as_json("test", roms=["28-bad000000000", "28-000000000001"])
+    assert [d["tags"]["rom"] for d in data] == ["28-000000000001"]
+
+
+def test_single_probe_is_not_tagged(bus):
+    data = ds18b20.as_json("test", roms=["28-000000000002"])
+    assert [d["tags"] for d in data] == [{"sensor": "DS18B20", "comment": None}]
+
+
+def test_pool_has_a_thread_per_probe(bus):
+    ds18b20.shutdown()
+    ds18b20.as_json("test", roms=["28-000000000001", "28-000000000002"])
+    assert ds18b20._executor._max_workers == 2
+    assert len(ds18b20.as_json("test")) == 40
+    assert ds18b20._executor._max_workers == 40
+    ds18b20.shutdown()
+
+
+def test_vanished_probe_triggers_rescan(bus):
+    ds18b20.as_json("test")
+    (bus / "28-000000000005" / "w1_slave").unlink()
+    (bus / "28-000000000005").rmdir()
+    st = bus.stat()  # pretend the directory did not change
+    ds18b20.index._signature = (st.st_mtime_ns, st.st_nlink)
+    assert len(ds18b20.as_json("test")) == 39
+    assert ds18b20.index.scans == 1
+    assert len(ds18b20.as_json("test")) == 39
+    assert ds18b20.index.scans == 2
+    assert "28-000000000005" not in ds18b20.index.probes()
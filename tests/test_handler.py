@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from sensorpi.sensors import handler
+from tests.helpers import wait_for
+
+
+@pytest.fixture(autouse=True)
+def fresh_pool(monkeypatch):
+    """Gives every test its own worker pool and busy sensors, hung reads do not leak into the next test."""
+    monkeypatch.setattr(handler, "_busy", set())
+    monkeypatch.setattr(handler, "_pool", None)
+    yield
+    if handler._pool is not None:
+        handler._pool.stop()
+
+
+def slow_sensor(seconds):
+    def as_json(measurement, sensor_name, **kwargs):
+        time.sleep(seconds)
+        return [{"measurement": measurement,
+                 "tags": {"sensor": sensor_name},
+                 "fields": {"value": seconds}}]
+    return as_json
+
+
+def test_parallel_reads_on_independent_buses(monkeypatch):
+    monkeypatch.setitem(handler.sensor_funcs, "slow", slow_sensor(0.3))
+    sensors = {f"s{i}": {"type": "slow"} for i in range(4)}
+    start = time.monotonic()
+    data = handler.collect_measurements(sensors, "test", 0, workers=4)
+    assert time.monotonic() - start < 1.0
+    assert [dict(d.tags)["sensor"] for d in data] == ["s0", "s1", "s2", "s3"]
+
+
+def test_shared_bus_is_serialized(monkeypatch):
+    running = []
+    overlap = threading.Event()
+
+    def as_json(measurement, sensor_name, **kwargs):
+        if running:
+            overlap.set()
+        running.append(sensor_name)
+        time.sleep(0.05)
+        running.remove(sensor_name)
+        return [{"measurement": measurement, "tags": {}, "fields": {"value": 1}}]
+
+    monkeypatch.setitem(handler.sensor_funcs, "shared", as_json)
+    sensors = {f"s{i}": {"type": "shared", "bus": "i2c"} for i in range(4)}
+    assert len(handler.collect_measurements(sensors, "test", 0, workers=4)) == 4
+    assert not overlap.is_set()
+
+
+def test_sensor_missing_its_deadline_is_dropped(monkeypatch):
+    monkeypatch.setitem(handler.sensor_funcs, "fast", slow_sensor(0))
+    monkeypatch.setitem(handler.sensor_funcs, "hung", slow_sensor(1))
+    sensors = {"fast": {"type": "fast"}, "hung": {"type": "hung", "timeout": 0.1}}
+    start = time.monotonic()
+    data = handler.collect_measurements(sensors, "test", 0, workers=2)
+    assert time.monotonic() - start < 0.5
+    assert [dict(d.tags)["sensor"] for d in data] == ["fast"]
+    # the hung read is still running, so the sensor is skipped
+    data = handler.collect_measurements(sensors, "test", 0, workers=2)
+    assert [dict(d.tags)["sensor"] for d in data] == ["fast"]
+
+
+def test_a_sensor_is_read_once_at_a_time(monkeypatch):
+    monkeypatch.setitem(handler.sensor_funcs, "slow", slow_sensor(0.2))
+    pool = handler.WorkerPool(2)
+    sensor = {"type": "slow"}
+    future = handler.start_read("slow", sensor, "test", pool)
+    assert handler.start_read("slow", sensor, "test", pool) is None
+    assert future.result(5)[0]["tags"]["sensor"] == "slow"
+    assert handler.start_read("slow", sensor, "test", pool).result(5)
+
+
+def test_old_workers_end_when_the_pool_is_resized(monkeypatch):
+    monkeypatch.setitem(handler.sensor_funcs, "fast", slow_sensor(0))
+    sensors = {"a": {"type": "fast"}}
+    before = threading.active_count()
+    for workers in (3, 2, 3, 1):
+        assert len(handler.collect_measurements(sensors, "test", 0, workers=workers)) == 1
+    wait_for(lambda: threading.active_count() <= before + 1)
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from sensorpi.sensors import camera
+from sensorpi.sensors.images import ImageSaver, Retention, write_atomic
+
+
+def image(value=128):
+    return np.full((16, 16, 3), value, dtype=np.uint8)
+
+
+def test_write_atomic_replaces_the_file(tmp_path):
+    path = str(tmp_path / "latest.jpg")
+    write_atomic(path, image(0))
+    write_atomic(path, image(255), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    assert os.listdir(tmp_path) == ["latest.jpg"]
+    assert cv2.imread(path).mean() > 250
+
+
+def test_full_queue_drops_the_oldest_image(tmp_path):
+    saver = ImageSaver(depth=2)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return image()
+
+    saver.save(str(tmp_path / "0.png"), slow, key="cam")
+    assert started.wait(5)  # the saver is busy with the first image
+    for i in range(1, 5):
+        saver.save(str(tmp_path / f"{i}.png"), image(), key="cam")
+    release.set()
+    assert saver.flush(5)
+    assert sorted(os.listdir(tmp_path)) == ["0.png", "3.png", "4.png"]
+    assert (saver.saved, saver.dropped) == (3, 2)
+    saver.close()
+    saver.save(str(tmp_path / "5.png"), image())
+    assert saver.saved == 3
+
+
+def test_every_key_has_its_own_depth(tmp_path):
+    saver = ImageSaver(depth=1)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return image()
+
+    saver.save(str(tmp_path / "busy.png"), slow)
+    assert started.wait(5)
+    for i in range(3):
+        saver.save(str(tmp_path / f"a{i}.png"), image(), depth=3, key="a")
+        saver.save(str(tmp_path / f"b{i}.png"), image(), key="b")
+    assert saver.depth == 1
+    release.set()
+    assert saver.flush(5)
+    assert sorted(os.listdir(tmp_path)) == ["a0.png", "a1.png", "a2.png", "b2.png", "busy.png"]
+    assert saver.dropped == 2
+
+
+def test_retention_by_count_age_and_bytes(tmp_path):
+    now = time.time()
+    for i in range(5):
+        path = tmp_path / f"cam_{i}.png"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (now - 100 + i, now - 100 + i))
+    (tmp_path / "other_0.png").write_bytes(b"x")
+
+    def add(retention, i):
+        path = tmp_path / f"cam_{i}.png"
+        path.write_bytes(b"x" * 100)
+        retention.add(str(path), now)
+
+    retention = Retention(str(tmp_path), "cam_", ".png", count=4)
+    assert len(retention) == 5
+    add(retention, 5)
+    assert sorted(os.listdir(tmp_path)) == ["cam_2.png", "cam_3.png", "cam_4.png", "cam_5.png",
+                                            "other_0.png"]
+    add(Retention(str(tmp_path), "cam_", ".png", seconds=97.5), 6)
+    assert sorted(os.listdir(tmp_path)) == ["cam_3.png", "cam_4.png", "cam_5.png", "cam_6.png",
+                                            "other_0.png"]
+    add(Retention(str(tmp_path), "cam_", ".png", bytes=250), 7)
+    assert sorted(os.listdir(tmp_path)) == ["cam_6.png", "cam_7.png", "other_0.png"]
+
+
+def test_time_lapse_keeps_the_newest_images(tmp_path, monkeypatch):
+    monkeypatch.setattr(camera, "saver", ImageSaver())
+    times = iter(range(10))
+    monkeypatch.setattr(camera.time, "strftime", lambda fmt: f"{next(times):02}")
+    for _ in range(5):
+        camera.save_img(image(), str(tmp_path / "cam.png"), timestamp=True,
+                        format="jpg", quality=80, keep={"count": 3})
+        assert camera.saver.flush(5)
+    assert sorted(os.listdir(tmp_path)) == ["cam_02.jpg", "cam_03.jpg", "cam_04.jpg"]
+    camera.saver.close()
+
+
+def test_frame_is_copied_before_it_is_queued(tmp_path, monkeypatch):
+    monkeypatch.setattr(camera, "saver", ImageSaver())
+    yuv = np.full((24, 16), 128, dtype=np.uint8)
+    yuv[:16] = 200
+    release = threading.Event()
+    camera.saver.save(str(tmp_path / "first.png"), lambda: release.wait(5) and image())
+    camera.save_img(camera.Frame(yuv, 16, 16), str(tmp_path / "frame.png"))
+    yuv[:16] = 0  # the next capture reuses the buffer
+    release.set()
+    assert camera.saver.flush(5)
+    assert cv2.imread(str(tmp_path / "frame.png")).mean() > 150
+    camera.saver.close()
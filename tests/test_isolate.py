@@ -0,0 +1,127 @@
+import os
+import time
+
+import pytest
+
+from sensorpi.config import ConfigError, compile_config
+from sensorpi.sensors import handler, isolate
+
+
+def pid_sensor(measurement, sensor_name, **kwargs):
+    return [{"measurement": measurement, "tags": {"sensor": sensor_name},
+             "fields": {"pid": os.getpid(), "cpus": len(os.sched_getaffinity(0))}}]
+
+
+def hanging_sensor(measurement, sensor_name, flag, **kwargs):
+    if os.path.exists(flag):
+        time.sleep(60)
+    return pid_sensor(measurement, sensor_name)
+
+
+def crashing_sensor(measurement, sensor_name, **kwargs):
+    os._exit(1)
+
+
+def failing_sensor(measurement, sensor_name, **kwargs):
+    raise ValueError("checksum did not validate")
+
+
+def test_reads_in_own_process():
+    driver = isolate.IsolatedDriver("a", {"type": "pid"}, pid_sensor)
+    try:
+        first = driver.read("m")[0]["fields"]["pid"]
+        assert first != os.getpid()
+        assert driver.read("m")[0]["fields"]["pid"] == first
+        assert driver.starts == 1
+    finally:
+        driver.close()
+
+
+def test_hung_worker_is_killed_and_restarted(tmp_path):
+    flag = tmp_path / "hang"
+    flag.touch()
+    driver = isolate.IsolatedDriver("a", {"flag": str(flag)}, hanging_sensor, timeout=1.0)
+    try:
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            driver.read("m")
+        assert time.monotonic() - start < 3
+        flag.unlink()
+        assert driver.read("m")[0]["fields"]["pid"] == driver.pid
+        assert (driver.starts, driver.hangs) == (2, 1)
+    finally:
+        driver.close()
+
+
+def test_crashed_worker_is_restarted():
+    driver = isolate.IsolatedDriver("a", {}, crashing_sensor)
+    try:
+        with pytest.raises(RuntimeError, match="died"):
+            driver.read("m")
+        driver.func = pid_sensor
+        assert driver.read("m")
+    finally:
+        driver.close()
+
+
+def test_exceptions_of_the_driver_are_raised():
+    driver = isolate.IsolatedDriver("a", {}, failing_sensor)
+    try:
+        with pytest.raises(ValueError, match="checksum"):
+            driver.read("m")
+        assert driver.starts == 1  # the worker survives
+    finally:
+        driver.close()
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="linux only")
+def test_isolated_sensor_in_config_is_pinned(monkeypatch):
+    monkeypatch.setitem(handler.sensor_funcs, "pid", pid_sensor)
+    plan = compile_config({"influxdb": {"db": "x"},
+                           "sensors": {"dht": {"type": "pid", "isolate": True, "cpu": 0},
+                                       "other": {"type": "pid"}}}, 10)
+    try:
+        points = handler.collect_measurements(plan.sensors, "m", 0)
+        fields = {dict(p.tags)["sensor"]: p.fields for p in points}
+        assert fields["dht"]["pid"] != os.getpid() and fields["dht"]["cpus"] == 1
+        assert fields["other"]["pid"] == os.getpid()
+    finally:
+        isolate.close_all()
+
+
+def test_read_timeout_starts_after_the_driver_was_imported():
+    from tests import slow_driver
+    driver = isolate.IsolatedDriver("a", {}, slow_driver.pid_sensor, timeout=0.5)
+    try:
+        assert driver.read("m")[0]["fields"]["pid"] == driver.pid
+        assert (driver.starts, driver.hangs) == (1, 0)
+    finally:
+        driver.close()
+
+
+def test_worker_that_does_not_start_is_killed():
+    from tests import slow_driver
+    driver = isolate.IsolatedDriver("a", {}, slow_driver.pid_sensor, start_timeout=0.2)
+    try:
+        with pytest.raises(TimeoutError, match="did not start"):
+            driver.read("m")
+        assert driver.pid is None
+    finally:
+        driver.close()
+
+
+def test_rejected_reload_keeps_the_worker(monkeypatch):
+    monkeypatch.setitem(handler.sensor_funcs, "pid", pid_sensor)
+    config = {"influxdb": {"db": "x"}, "sensors": {"dht": {"type": "pid", "isolate": True}}}
+    plan = compile_config(config, 10)
+    try:
+        pid = handler.read_sensor("dht", plan.sensors["dht"], "m")[0]["fields"]["pid"]
+        changed = {"influxdb": {"db": "x"},
+                   "sensors": {"dht": {"type": "pid", "isolate": True, "timeout": 3},
+                               "bad": {"type": "unknown"}}}
+        with pytest.raises(ConfigError):
+            compile_config(changed, 10, previous=plan)
+        assert handler.read_sensor("dht", plan.sensors["dht"], "m")[0]["fields"]["pid"] == pid
+        assert isolate._drivers["dht"].starts == 1
+    finally:
+        isolate.close_all()
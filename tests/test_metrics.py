@@ -0,0 +1,99 @@
+import time
+import urllib.request
+
+import pytest
+
+from benchmarks.influx_stub import InfluxStub
+from sensorpi import metrics as metrics_module
+from sensorpi import writer as writer_module
+from sensorpi.metrics import Histogram, Metrics, MetricsServer, Reporter
+from sensorpi.points import Point
+from sensorpi.sensors import handler
+from sensorpi.writer import InfluxWriter
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    fresh = Metrics()
+    for module in (metrics_module, handler, writer_module):
+        monkeypatch.setattr(module, "metrics", fresh)
+    return fresh
+
+
+def fields(points, **tag):
+    (point,) = [p for p in points if dict(p.tags) == tag]
+    return point.fields
+
+
+def test_histogram_quantiles():
+    h = Histogram((0.01, 0.1, 1.0))
+    for value in [0.005] * 90 + [0.5] * 10:
+        h.observe(value)
+    assert h.quantile(0.5) == 0.01
+    assert h.quantile(0.95) == 0.5  # capped at the largest observed value
+    assert h.count == 100 and h.max == 0.5
+
+
+def test_reads_are_counted_per_sensor(metrics, monkeypatch):
+    calls = iter([ValueError("checksum"), None, 21.0])
+
+    def flaky(measurement, sensor_name, **kwargs):
+        result = next(calls)
+        if isinstance(result, Exception):
+            raise result
+        if result is None:
+            return None  # like drivers that print an error and return nothing
+        return [{"measurement": measurement, "tags": {}, "fields": {"t": result}}]
+    monkeypatch.setitem(handler.sensor_funcs, "flaky", flaky)
+    for _ in range(3):
+        handler.collect_measurements({"dht": {"type": "flaky"}}, "m", 0)
+    read = fields(metrics.points(), sensor="dht")
+    assert (read["ok"], read["failures"], read["points"]) == (1, 2, 1)
+
+
+def test_writes_and_queue_depth(metrics):
+    with InfluxStub() as stub:
+        writer = InfluxWriter("test", influx_url=stub.url, batch_size=1000)
+        metrics.gauge("influx", "queue_points", writer.__len__)
+        writer.write([Point("m", {}, {"v": 1.0}, 0)] * 3)
+        queued = fields(metrics.points(), sink="influx")
+        writer.flush()
+        writer.close()
+    points = metrics.points()
+    write = [p.fields for p in points if dict(p.tags) == {"sink": "influx"} and "ok" in p.fields][0]
+    assert queued["queue_points"] == 3
+    assert (write["ok"], write["points"]) == (1, 3)
+
+
+def test_prometheus_endpoint(metrics):
+    metrics.observe_read("bme280", 0.003)
+    metrics.observe_read("bme280", 0.2, ok=False)
+    metrics.gauge("spool", "queue_bytes", lambda: 42)
+    server = MetricsServer(metrics, port=0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+            text = response.read().decode()
+    finally:
+        server.close()
+    assert 'sensorpi_read_seconds_bucket{sensor="bme280",le="0.005"} 1' in text
+    assert 'sensorpi_read_seconds_count{sensor="bme280"} 2' in text
+    assert 'sensorpi_read_failures_total{sensor="bme280"} 1' in text
+    assert 'sensorpi_queue_bytes{sink="spool"} 42' in text
+
+
+def test_reporter_publishes_every_interval(metrics):
+    metrics.observe_read("a", 0.01)
+    reporter = Reporter(metrics, interval=0.05)
+    assert reporter.poll(1.0) == []
+    time.sleep(0.06)
+    points = reporter.poll(1.0)
+    assert [p.measurement for p in points] == ["sensorpi"]
+    assert points[0].time == 1_000_000_000
+    assert reporter.poll(1.0) == []
+
+
+def test_observing_is_cheap(metrics):
+    start = time.perf_counter()
+    for _ in range(10_000):
+        metrics.observe_read("a", 0.01)
+    assert (time.perf_counter() - start) / 10_000 < 50e-6
@@ -0,0 +1,50 @@
+import pytest
+
+from sensorpi.points import LineProtocolEncoder, Point, as_dicts
+
+
+def test_encodes_fields_tags_and_precision():
+    point = Point("weather station", {"sensor": "DHT11", "comment": None, "room": "a=b,c"},
+                  {"temperature": 21.5, "humidity": 40, "ok": True, "note": 'say "hi"'},
+                  1_650_000_000_123_456_789)
+    assert LineProtocolEncoder("ms").encode([point]) == (
+        b'weather\\ station,room=a\\=b\\,c,sensor=DHT11 '
+        b'temperature=21.5,humidity=40i,ok=true,note="say \\"hi\\"" 1650000000123')
+
+
+@pytest.mark.parametrize("precision, stamp", [("s", b"1650000000"), ("us", b"1650000000123456"),
+                                              ("ns", b"1650000000123456789")])
+def test_precision(precision, stamp):
+    point = Point("m", {}, {"v": 1.0}, 1_650_000_000_123_456_789)
+    assert LineProtocolEncoder(precision).encode([point]) == b"m v=1.0 " + stamp
+
+
+def test_skips_unrepresentable_fields_and_empty_points():
+    points = [Point("m", {}, {"lux": None, "ir": float("nan")}, 1),
+              Point("m", {}, {"lux": None, "ir": 3}, 2)]
+    assert LineProtocolEncoder("ns").encode(points) == b"m ir=3i 2"
+
+
+def test_empty_tags_are_left_out():
+    point = Point("m", {"sensor": "DHT11", "comment": ""}, {"v": 1.0}, 1)
+    assert point.as_dict()["tags"] == {"sensor": "DHT11"}
+    assert LineProtocolEncoder("ns").encode([point]) == b"m,sensor=DHT11 v=1.0 1"
+
+
+def test_dict_adapter_round_trip():
+    data = {"measurement": "m", "tags": {"sensor": "BME280"},
+            "fields": {"pressure": 1013.2}, "timestamp": 1650000000.5}
+    point = Point.from_dict(data)
+    assert point.time == 1_650_000_000_500_000_000
+    assert as_dicts([point]) == [{"measurement": "m", "tags": {"sensor": "BME280"},
+                                  "fields": {"pressure": 1013.2},
+                                  "time": 1_650_000_000_500_000_000}]
+    assert Point.from_dict(point.as_dict()) == point
+
+
+def test_names_are_interned():
+    a = Point("".join(["me", "as"]), {"".join(["sen", "sor"]): "x"}, {"".join(["va", "l"]): 1})
+    b = Point("meas", {"sensor": "x"}, {"val": 1})
+    assert a.measurement is b.measurement
+    assert a.tags[0][0] is b.tags[0][0]
+    assert next(iter(a.fields)) is next(iter(b.fields))
@@ -0,0 +1,114 @@
+import builtins
+import json
+import pstats
+import threading
+import time
+
+import pytest
+
+from benchmarks.influx_stub import InfluxStub
+from sensorpi import pipeline, profiling
+from sensorpi import writer as writer_module
+from sensorpi.profiling import NO_SPAN, Profiler
+from sensorpi.sensors import handler
+from sensorpi.writer import InfluxWriter
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    fresh = Profiler()
+    for module in (profiling, pipeline, handler, writer_module):
+        monkeypatch.setattr(module, "profiler", fresh)
+    yield fresh
+    fresh.stop()
+
+
+def sensor(measurement, sensor_name, **kwargs):
+    time.sleep(0.001)
+    return [{"measurement": measurement, "tags": {"sensor": sensor_name}, "fields": {"value": 1}}]
+
+
+def spans(path, name=None):
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    return [e for e in events if e["ph"] == "X" and name in (None, e["name"])]
+
+
+def test_disabled_profiler_records_nothing(profiler):
+    assert profiler.span("read", sensor="a") is NO_SPAN
+    assert profiler.cycle() is NO_SPAN
+    assert [e["ph"] for e in profiler.trace()["traceEvents"]] == ["M"]
+
+
+def test_stages_of_a_cycle_are_traced(profiler, monkeypatch, tmp_path):
+    monkeypatch.setitem(handler.sensor_funcs, "fake", sensor)
+    path = tmp_path / "trace.json"
+    profiler.start(str(path))
+    with InfluxStub() as stub:
+        writer = InfluxWriter("test", influx_url=stub.url)
+        with profiler.cycle():
+            data = handler.collect_measurements({"a": {"type": "fake"}, "b": {"type": "fake"}},
+                                                "m", 0.0)
+            assert pipeline.process(data, 0.0, writer) == 2
+            writer.flush()
+        writer.close()
+    profiler.stop()
+    names = {e["name"] for e in spans(path)}
+    assert {"cycle", "read", "transform", "write", "serialize", "http"} <= names
+    assert [e["args"]["sensor"] for e in spans(path, "read")] == ["a", "b"]
+    (cycle,) = spans(path, "cycle")
+    for event in spans(path):
+        assert cycle["ts"] <= event["ts"] <= event["ts"] + event["dur"] <= cycle["ts"] + cycle["dur"]
+
+
+def test_the_trace_keeps_the_latest_spans(profiler, tmp_path):
+    path = tmp_path / "trace.json"
+    profiler.start(str(path), events=5, write_interval=0)
+    for i in range(10):
+        with profiler.span("read", sensor=str(i)):
+            pass
+    with profiler.cycle():  # writes the trace, its interval is over
+        pass
+    assert profiler.flush(5)
+    assert [e["args"].get("sensor") for e in spans(path)] == ["6", "7", "8", "9", None]
+
+
+def test_the_slowest_sampled_cycles_are_kept(profiler, tmp_path):
+    profiler.start(str(tmp_path / "trace.json"), sample_every=2, keep=2)
+    seconds = {2: 0.03, 4: 0.001, 6: 0.02, 8: 0.001, 10: 0.002}
+    for i in range(1, 11):
+        with profiler.cycle():
+            time.sleep(seconds.get(i, 0.04))  # the cycles not sampled are never kept
+    assert profiler.flush(5)
+    kept = sorted(p.name for p in tmp_path.glob("*.prof"))
+    assert [name.split("-")[1] for name in kept] == ["cycle2", "cycle6"]
+    stats = pstats.Stats(str(tmp_path / kept[0]))
+    assert any(func[2] == "<built-in method time.sleep>" for func in stats.stats)
+
+
+def test_cycles_never_write_files(profiler, monkeypatch, tmp_path):
+    writers = set()
+    real_open = builtins.open
+
+    def recording_open(file, *args, **kwargs):
+        if str(file).startswith(str(tmp_path)):
+            writers.add(threading.get_ident())
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "open", recording_open)
+    profiler.start(str(tmp_path / "trace.json"), write_interval=0, sample_every=1, keep=2)
+    for _ in range(3):
+        with profiler.cycle():
+            time.sleep(0.001)
+    assert profiler.flush(5)
+    assert len(list(tmp_path.glob("*.prof"))) == 2 and (tmp_path / "trace.json").exists()
+    assert writers and threading.get_ident() not in writers
+
+
+def test_spans_are_cheap(profiler, tmp_path):
+    profiler.start(str(tmp_path / "trace.json"))
+    start = time.perf_counter()
+    for _ in range(10_000):
+        with profiler.span("read", sensor="a"):
+            pass
+    assert (time.perf_counter() - start) / 10_000 < 20e-6
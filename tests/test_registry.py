@@ -0,0 +1,46 @@
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from sensorpi.sensors.registry import SensorRegistry
+
+
+def test_importing_the_handler_imports_no_driver():
+    code = textwrap.dedent("""
+        import sys
+        import sensorpi.sensors.handler
+        heavy = {"cv2", "numpy", "picamera", "board", "adafruit_dht", "sensorpi.sensors.camera"}
+        print(sorted(heavy & set(sys.modules)))
+    """)
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "[]"
+
+
+def test_driver_is_imported_on_first_use():
+    registry = SensorRegistry({"ds18b20": "sensorpi.sensors.ds18b20:as_json"}, group="none")
+    assert registry.import_times == {}
+    from sensorpi.sensors import ds18b20
+    assert registry["ds18b20"] is ds18b20.as_json
+    assert list(registry.import_times) == ["sensorpi.sensors.ds18b20"]
+
+
+def test_unknown_sensor_raises_key_error():
+    with pytest.raises(KeyError):
+        SensorRegistry({}, group="none")["scd30"]
+
+
+def test_third_party_driver_from_entry_point(tmp_path, monkeypatch):
+    (tmp_path / "sensorpi_fake.py").write_text(
+        "def as_json(measurement, **kwargs):\n"
+        "    return [{'measurement': measurement, 'tags': {}, 'fields': {'co2': 400}}]\n")
+    dist = tmp_path / "sensorpi_fake-0.1.dist-info"
+    dist.mkdir()
+    (dist / "METADATA").write_text("Metadata-Version: 2.1\nName: sensorpi-fake\nVersion: 0.1\n")
+    (dist / "entry_points.txt").write_text("[sensorpi.sensors]\nscd30 = sensorpi_fake:as_json\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    registry = SensorRegistry({})
+    assert "scd30" in registry
+    assert registry["scd30"]("test")[0]["fields"] == {"co2": 400}
+    assert "sensorpi_fake:as_json (entry point scd30)" in registry.import_times
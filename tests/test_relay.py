@@ -0,0 +1,151 @@
+import asyncio
+import socket
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+from benchmarks.influx_stub import InfluxStub
+from sensorpi.config import ConfigError, compile_config
+from sensorpi.points import Point
+from sensorpi.relay import Relay, series_key
+from sensorpi.sinks import QueuedSink, RelaySink
+from sensorpi.writer import InfluxWriter
+from tests.helpers import wait_for
+
+SECOND = 1_000_000_000
+
+
+def reading(i, node="node-0"):
+    return Point("weather", {"node": node, "sensor": "dht"}, {"temperature": 20.0 + i},
+                 (1_700_000_000 + i) * SECOND)
+
+
+class GatedWriter:
+    """Keeps the sent lines, send() waits until the gate is open."""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.gate.set()
+        self.sent = []
+
+    def send(self, data):
+        assert self.gate.wait(10)
+        self.sent.append(data)
+
+
+class Rejected(Exception):
+    status = 400
+
+
+class RejectingWriter(GatedWriter):
+    """Rejects the batches that contain a line with "bad"."""
+
+    def send(self, data):
+        if b"bad" in data:
+            raise Rejected("field type conflict")
+        super().send(data)
+
+
+@contextmanager
+def running(relay):
+    event_loop = asyncio.new_event_loop()
+    started = threading.Event()
+    stop = []
+
+    async def serve():
+        stop.append(asyncio.Event())
+        await relay.start()
+        started.set()
+        await stop[0].wait()
+        await relay.close()
+
+    thread = threading.Thread(target=event_loop.run_until_complete, args=(serve(),))
+    thread.start()
+    assert started.wait(5)
+    try:
+        yield relay
+    finally:
+        event_loop.call_soon_threadsafe(stop[0].set)
+        thread.join(10)
+        event_loop.close()
+
+
+def test_series_key():
+    assert series_key(b"weather,sensor=a\\ b temperature=1 17") == (b"weather,sensor=a\\ b", b"17")
+    assert series_key(b'weather,sensor=a note="x y" 17') == (b"weather,sensor=a", b"17")
+
+
+def test_many_nodes_are_coalesced_into_large_writes():
+    with InfluxStub() as stub:
+        writer = InfluxWriter("test", influx_url=stub.url, precision="ns")
+        with running(Relay(writer, "127.0.0.1", 0, batch_size=5000, flush_interval=0.2)) as relay:
+            nodes = [QueuedSink(RelaySink(f"relay-{n}", "127.0.0.1", relay.port, f"node-{n}"),
+                                batch_size=20, flush_interval=0.05) for n in range(50)]
+            for n, node in enumerate(nodes):
+                node.write([reading(i, f"node-{n}") for i in range(100)])
+            wait_for(lambda: len(stub.lines) == 5000, timeout=20)
+            for node in nodes:
+                node.close()
+        writer.close()
+    assert len(set(stub.lines)) == 5000
+    assert relay.frames >= 50
+    assert stub.requests <= 10  # instead of one per batch of a node
+
+
+def test_frames_and_points_sent_again_are_written_once():
+    writer = GatedWriter()
+    with running(Relay(writer, "127.0.0.1", 0, flush_interval=0.1)) as relay:
+        sink = RelaySink("relay", "127.0.0.1", relay.port)
+        sink.send([reading(i) for i in range(10)])
+        sink.seq -= 1  # as if the ACK got lost
+        sink.send([reading(i) for i in range(10)])
+        sink.send([reading(i) for i in range(5, 15)])  # a batch that overlaps the first
+        wait_for(lambda: writer.sent)
+        sink.close()
+    lines = b"\n".join(writer.sent).split(b"\n")
+    assert relay.duplicates == 1
+    assert relay.merged == 5
+    assert len(lines) == len(set(lines)) == 15
+
+
+def test_a_busy_node_waits_for_room():
+    writer = GatedWriter()
+    writer.gate.clear()
+    with running(Relay(writer, "127.0.0.1", 0, batch_size=10, flush_interval=60,
+                       max_node_points=10)) as relay:
+        busy = RelaySink("relay", "127.0.0.1", relay.port, "busy", timeout=0.3)
+        other = RelaySink("relay", "127.0.0.1", relay.port, "other", timeout=0.3)
+        busy.send([reading(i, "busy") for i in range(10)])
+        with pytest.raises(socket.timeout):  # the relay does not read while the write hangs
+            busy.send([reading(i, "busy") for i in range(10, 20)])
+        other.send([reading(i, "other") for i in range(5)])  # other nodes are still read
+        assert len(writer.sent) == 0 and relay.frames == 2
+        writer.gate.set()
+        wait_for(lambda: relay.written >= 10)
+        busy.send([reading(i, "busy") for i in range(10, 20)])  # sent again
+        busy.close()
+        other.close()
+    lines = b"\n".join(writer.sent).split(b"\n")
+    assert len(set(lines)) == 25
+
+
+def test_rejected_batches_do_not_stop_the_nodes():
+    writer = RejectingWriter()
+    with running(Relay(writer, "127.0.0.1", 0, batch_size=5, flush_interval=0.05,
+                       max_points=10, retry_interval=60)) as relay:
+        sink = RelaySink("relay", "127.0.0.1", relay.port, timeout=2)
+        sink.send([Point("bad", {"sensor": "dht"}, {"x": 1.0}, i) for i in range(5)])
+        for n in range(4):
+            sink.send([reading(i) for i in range(5 * n, 5 * n + 5)])
+        wait_for(lambda: relay.written == 20)
+        sink.close()
+    assert relay.rejected == 5
+    assert len(relay) == 0
+
+
+def test_relay_sink_needs_a_host():
+    config = {"sinks": {"relay": {"type": "relay"}},
+              "sensors": {"a": {"type": "ds18b20", "rom": "28-1"}}}
+    with pytest.raises(ConfigError, match="host"):
+        compile_config(config, 10)
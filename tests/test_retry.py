@@ -0,0 +1,114 @@
+import pytest
+
+from sensorpi.config import compile_config
+from sensorpi.sensors import handler
+from sensorpi.sensors.retry import ReadCache, cached
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class Flaky:
+    """Fails the given number of times, then reads 40.0"""
+
+    def __init__(self, clock, failures, duration=0.05):
+        self.clock = clock
+        self.failures = failures
+        self.duration = duration
+        self.polls = []
+
+    def __call__(self, measurement, **kwargs):
+        self.polls.append(self.clock.now)
+        self.clock.now += self.duration
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("Checksum did not validate. Try again.")
+        return [{"measurement": measurement, "tags": {"sensor": "dht"},
+                 "fields": {"humidity": 40.0}}]
+
+
+def make(clock, read, **kwargs):
+    return ReadCache(read, clock=clock.monotonic, sleep=clock.sleep, **kwargs)
+
+
+def test_retries_respect_the_min_period():
+    clock = FakeClock()
+    sensor = Flaky(clock, failures=2)
+    cache = make(clock, sensor, budget=3, min_period=1.0)
+    assert cache.read("m")[0]["fields"]["humidity"] == 40.0
+    assert sensor.polls == [0.0, 1.0, 2.0]
+    assert (cache.attempts, cache.failures) == (3, 2)
+
+
+def test_budget_ends_the_retries_and_the_last_good_value_is_used():
+    clock = FakeClock()
+    sensor = Flaky(clock, failures=0)
+    cache = make(clock, sensor, budget=1.5, min_period=1.0, max_stale=30)
+    cache.read("m")
+    clock.now = 10.0
+    sensor.failures = 100
+    data = cache.read("m")
+    assert len(sensor.polls) == 3  # at 10 and 11, 12 would end after the budget
+    assert data[0]["tags"] == {"sensor": "dht", "stale": "true"}
+    assert data[0]["fields"] == {"humidity": 40.0, "age": pytest.approx(11.05)}
+    clock.now = 40.0
+    with pytest.raises(RuntimeError, match="Checksum"):
+        cache.read("m")
+
+
+def test_never_polls_faster_than_the_hardware():
+    clock = FakeClock()
+    sensor = Flaky(clock, failures=0)
+    cache = make(clock, sensor, min_period=2.0)
+    cache.read("m")
+    clock.now = 1.0
+    assert cache.read("m")[0]["tags"]["stale"] == "true"
+    assert len(sensor.polls) == 1
+
+
+def test_no_busy_loop_without_min_period():
+    clock = FakeClock()
+    sensor = Flaky(clock, failures=100, duration=0)
+    cache = make(clock, sensor, budget=1.0)
+    with pytest.raises(RuntimeError):
+        cache.read("m")
+    assert len(sensor.polls) == 11
+    assert min(clock.sleeps) == pytest.approx(0.1)
+
+
+def test_retry_from_config(monkeypatch):
+    calls = []
+
+    def flaky(measurement, sensor_name, **kwargs):
+        calls.append(kwargs["retry"])
+        if len(calls) == 1:
+            raise RuntimeError("checksum")
+        return [{"measurement": measurement, "tags": {"sensor": sensor_name}, "fields": {"h": 1.0}}]
+    monkeypatch.setitem(handler.sensor_funcs, "flaky", flaky)
+    plan = compile_config({"influxdb": {"db": "x"},
+                           "sensors": {"a": {"type": "flaky",
+                                             "retry": {"budget": 1, "min-period": 0.05}}}}, 10)
+    assert len(handler.collect_measurements(plan.sensors, "m", 0)) == 1
+    assert len(calls) == 2
+
+
+def test_new_read_function_gets_a_new_cache():
+    def first(measurement, **kwargs):
+        return [{"measurement": measurement, "fields": {"v": 1.0}}]
+
+    def second(measurement, **kwargs):
+        return [{"measurement": measurement, "fields": {"v": 2.0}}]
+    sensor = {"type": "dht22", "retry": {"budget": 1}}
+    cache = cached("new-read", sensor, first)
+    assert cached("new-read", sensor, first) is cache
+    assert cached("new-read", sensor, second).read("m")[0]["fields"] == {"v": 2.0}
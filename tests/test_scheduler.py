@@ -0,0 +1,88 @@
+import pytest
+
+from sensorpi.scheduler import Scheduler
+
+
+class FakeClock:
+    def __init__(self, start=1_650_000_000.25):
+        self.now = start
+
+    def monotonic(self):
+        return self.now - 1_000_000
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def make(intervals, clock, **kwargs):
+    return Scheduler(intervals, clock=clock.monotonic, wall=clock.time,
+                     sleep=clock.sleep, **kwargs)
+
+
+def test_ticks_are_aligned_to_wall_clock():
+    clock = FakeClock()
+    scheduler = make({"pressure": 1, "cam": 300}, clock)
+    ticks = [scheduler.next_tick() for _ in range(3)]
+    assert [t.timestamp for t in ticks] == [1_650_000_001, 1_650_000_002, 1_650_000_003]
+    assert all(t.names == ("pressure",) for t in ticks)
+    assert all(t.lateness == pytest.approx(0) for t in ticks)
+
+
+def test_different_intervals_share_boundaries():
+    clock = FakeClock(1_650_000_000.5)
+    scheduler = make({"pressure": 1, "cam": 300}, clock)
+    names = [scheduler.next_tick().names for _ in range(300)]
+    assert names.count(("pressure", "cam")) == 1
+    assert names.count(("pressure",)) == 299
+
+
+def test_rounded_interval_does_not_hang():
+    clock = FakeClock(1_700_000_000.1)
+    # 0.8999999999999999, now / interval rounds below the index of the fourth deadline
+    scheduler = make({"s": 0.3 * 3}, clock)
+    ticks = [scheduler.next_tick(timeout=5) for _ in range(20)]
+    assert all(tick is not None and tick.missed == 0 for tick in ticks)
+    assert len({tick.timestamp for tick in ticks}) == 20
+
+
+def test_skip_drops_late_deadlines():
+    clock = FakeClock()
+    scheduler = make({"s": 1}, clock, policy="skip")
+    scheduler.next_tick()
+    clock.now += 3.7  # the cycle took far too long
+    tick = scheduler.next_tick()
+    assert tick.timestamp == 1_650_000_005
+    assert tick.lateness == pytest.approx(0)
+
+
+def test_coalesce_reads_right_away():
+    clock = FakeClock()
+    scheduler = make({"s": 1}, clock, policy="coalesce")
+    scheduler.next_tick()
+    clock.now += 3.7
+    tick = scheduler.next_tick()
+    assert tick.timestamp == 1_650_000_004
+    assert tick.lateness == pytest.approx(0.7)
+    assert tick.missed == 2
+
+
+def test_update_keeps_unchanged_deadlines():
+    clock = FakeClock()
+    scheduler = make({"a": 10, "b": 10}, clock)
+    scheduler.update({"a": 10, "c": 5})
+    tick = scheduler.next_tick()
+    assert tick.timestamp == 1_650_000_005
+    assert tick.names == ("c",)
+
+
+def test_poll_never_sleeps():
+    clock = FakeClock()
+    scheduler = make({"pressure": 1}, clock)
+    assert scheduler.poll() is None
+    assert scheduler.delay() == pytest.approx(0.75)
+    clock.now += scheduler.delay()
+    assert scheduler.poll().timestamp == 1_650_000_001
+    assert scheduler.poll() is None
@@ -0,0 +1,206 @@
+import csv
+import io
+import threading
+import time
+
+import pytest
+
+from benchmarks.influx_stub import InfluxStub
+from sensorpi import __main__ as cli
+from sensorpi.config import ConfigError, compile_config
+from sensorpi.points import Point
+from sensorpi.sinks import CsvSink, FanOut, MqttSink, QueuedSink, Sink, StdoutSink
+from tests.helpers import wait_for
+from tests.mqtt_stub import MqttStub
+
+SECOND = 1_000_000_000
+
+
+def reading(i, sensor="dht"):
+    return Point("weather", {"sensor": sensor}, {"temperature": 20.0 + i}, (1_700_000_000 + i) * SECOND)
+
+
+class ListSink(Sink):
+    def __init__(self, name="list", fail=0, delay=0.0, error=None):
+        super().__init__(name)
+        self.batches = []
+        self.fail = fail
+        self.delay = delay
+        self.error = error or ConnectionError("offline")
+        self.release = threading.Event()
+
+    def _send(self, points):
+        if self.delay:
+            self.release.wait(self.delay)
+        if self.fail:
+            self.fail -= 1
+            raise self.error
+        self.batches.append(points)
+
+
+def test_batches_by_size_and_age():
+    sink = ListSink()
+    queued = QueuedSink(sink, batch_size=10, flush_interval=0.2)
+    queued.write([reading(i) for i in range(25)])
+    wait_for(lambda: sum(map(len, sink.batches)) == 25)
+    assert [len(batch) for batch in sink.batches] == [10, 10, 5]
+    queued.close()
+
+
+def test_failed_batches_are_sent_again():
+    sink = ListSink(fail=2)
+    queued = QueuedSink(sink, batch_size=3, flush_interval=60, retry_interval=0.01)
+    queued.write([reading(i) for i in range(3)])
+    wait_for(lambda: sink.batches)
+    assert sink.batches == [[reading(i) for i in range(3)]]
+    queued.close()
+
+
+def test_batches_that_can_never_be_sent_are_dropped():
+    sink = ListSink(fail=1, error=KeyError("room"))
+    queued = QueuedSink(sink, batch_size=3, flush_interval=60, retry_interval=60)
+    queued.write([reading(i) for i in range(6)])
+    wait_for(lambda: sink.batches)
+    assert sink.batches == [[reading(i) for i in range(3, 6)]]
+    queued.close()
+
+
+def test_new_points_do_not_cut_the_retry_wait_short():
+    sink = ListSink(fail=1)
+    queued = QueuedSink(sink, batch_size=1, flush_interval=60, retry_interval=0.5)
+    queued.write([reading(0)])
+    wait_for(lambda: sink.fail == 0)
+    start = time.monotonic()
+    for i in range(1, 20):
+        queued.write([reading(i)])  # every write fills a batch
+        time.sleep(0.01)
+    wait_for(lambda: sink.batches)
+    assert time.monotonic() - start >= 0.4
+    queued.close()
+    assert sum(map(len, sink.batches)) == 20
+
+
+@pytest.mark.parametrize("policy, kept", [("drop-oldest", list(range(5, 10))),
+                                          ("drop-newest", list(range(5)))])
+def test_full_queue_policies(policy, kept):
+    sink = ListSink(fail=1)
+    queued = QueuedSink(sink, max_points=5, batch_size=100, flush_interval=60,
+                        policy=policy, retry_interval=60)
+    queued.write([reading(i) for i in range(10)])
+    assert queued.dropped == 5
+    queued.close(timeout=0)  # the first send fails, the points stay queued
+    assert [p.fields["temperature"] - 20 for p in queued._queue] == kept
+
+
+def test_block_policy_waits_for_room():
+    sink = ListSink(delay=0.1)
+    queued = QueuedSink(sink, max_points=2, batch_size=2, flush_interval=60,
+                        policy="block", block_timeout=5)
+    start = time.monotonic()
+    for i in range(6):
+        queued.write([reading(i)])
+    assert time.monotonic() - start >= 0.1
+    queued.close()
+    assert queued.dropped == 0
+    assert sum(map(len, sink.batches)) == 6
+
+
+def test_slow_sink_does_not_hold_up_the_others():
+    slow, fast = ListSink("slow", delay=60), ListSink("fast")
+    writer = FanOut({"slow": QueuedSink(slow, batch_size=1, max_points=3),
+                     "fast": QueuedSink(fast, batch_size=1)}, {})
+    start = time.monotonic()
+    for i in range(20):
+        writer.write([reading(i)])
+    assert time.monotonic() - start < 1
+    wait_for(lambda: len(fast.batches) == 20)
+    assert writer.sinks["slow"].dropped > 0
+    slow.release.set()
+    writer.close()
+
+
+def test_sensors_go_to_their_sinks():
+    a, b = ListSink("a"), ListSink("b")
+    writer = FanOut({"a": QueuedSink(a, flush_interval=0.05), "b": QueuedSink(b, flush_interval=0.05)},
+                    {"dht": {"sinks": ["a"]}, "ds": {}})
+    writer.write([reading(0, "dht"), reading(1, "ds"), Point("sensorpi", {}, {"uptime": 1.0}, 0)])
+    writer.close()
+    assert [p.tags for batch in a.batches for p in batch] == \
+        [(("sensor", "dht"),), (("sensor", "ds"),), ()]
+    assert [p.tags for batch in b.batches for p in batch] == [(("sensor", "ds"),), ()]
+    writer.update({"ds": {"sinks": []}})
+
+
+def test_csv_sink(tmp_path):
+    path = str(tmp_path / "out" / "readings.csv")
+    for i in range(2):  # appends to the file, one header
+        sink = CsvSink("csv", path)
+        sink.send([reading(i)])
+        sink.close()
+    with open(path, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows == [["time", "measurement", "tags", "field", "value"],
+                    [str(1_700_000_000 * SECOND), "weather", "sensor=dht", "temperature", "20.0"],
+                    [str(1_700_000_001 * SECOND), "weather", "sensor=dht", "temperature", "21.0"]]
+
+
+def test_parquet_sink(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    from sensorpi.sinks import ParquetSink
+    sink = ParquetSink("parquet", str(tmp_path))
+    sink.send([reading(i) for i in range(3)])
+    (path,) = tmp_path.glob("*.parquet")
+    assert pq.read_table(path).column("value").to_pylist() == [20.0, 21.0, 22.0]
+
+
+def test_stdout_sink():
+    stream = io.StringIO()
+    StdoutSink("stdout", stream=stream).send([reading(0)])
+    assert stream.getvalue() == f"weather,sensor=dht temperature=20.0 {1_700_000_000 * SECOND}\n"
+
+
+def test_mqtt_sink():
+    with MqttStub() as stub:
+        sink = MqttSink("mqtt", port=stub.port, client_id="pi-1")
+        sink.send([reading(0), reading(1, "ds")])
+        sink.close()
+        wait_for(lambda: len(stub.messages) == 2)
+    assert stub.clients == ["pi-1"]
+    assert stub.messages[1] == \
+        ("sensorpi/weather/ds", f"weather,sensor=ds temperature=21.0 {1_700_000_001 * SECOND}".encode())
+
+
+def test_mqtt_topic_with_a_missing_tag_is_permanent():
+    with MqttStub() as stub:
+        sink = MqttSink("mqtt", port=stub.port, topic="sensorpi/{room}")
+        with pytest.raises(KeyError) as e:
+            sink.send([reading(0)])
+        sink.close()
+    assert sink.permanent(e.value)
+
+
+def test_sinks_from_config(fake_driver, tmp_path):
+    config = {"influxdb": {"db": "test"},
+              "sinks": {"influx": {"type": "influx", "flush-interval": 0.05},
+                        "csv": {"type": "csv", "path": str(tmp_path / "r.csv"), "policy": "drop-newest"}},
+              "sensors": {"dht": {"type": "fake", "sinks": ["csv"]}}}
+    plan = compile_config(config, 10)
+    with InfluxStub() as stub:
+        writer = cli.create_sinks({**config, "influxdb": {"db": "test", "url": stub.url}}, plan.sensors)
+        assert writer.sinks["csv"].policy == "drop-newest"
+        writer.write([reading(0), reading(1, "other")])
+        wait_for(lambda: stub.lines)
+        writer.close()
+    assert len(stub.lines) == 1 and stub.lines[0].startswith("weather,sensor=other")
+    assert len((tmp_path / "r.csv").read_text().splitlines()) == 3
+
+
+def test_sinks_are_validated(fake_driver):
+    config = {"sinks": {"out": {"type": "ftp"}},
+              "sensors": {"dht": {"type": "fake", "sinks": ["nowhere"]}}}
+    with pytest.raises(ConfigError) as e:
+        compile_config(config, 10)
+    assert "Sink out needs a :type" in str(e.value)
+    assert "The :sinks of sensor dht" in str(e.value)
+    compile_config({"sinks": {"out": {"type": "stdout"}},
+                    "sensors": {"dht": {"type": "fake"}}}, 10)
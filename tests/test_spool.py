@@ -0,0 +1,70 @@
+import time
+
+from benchmarks.influx_stub import InfluxStub
+from sensorpi.points import Point
+from sensorpi.spool import Spool, SpooledWriter
+from sensorpi.writer import InfluxWriter
+from tests.helpers import wait_for
+
+
+def test_read_and_commit_across_segments(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=64)
+    spool.append([f"record {i}".encode() for i in range(20)])
+    records, position = spool.read(15)
+    assert records == [f"record {i}".encode() for i in range(15)]
+    spool.commit(position)
+    records, position = spool.read(100)
+    assert records == [f"record {i}".encode() for i in range(15, 20)]
+    assert len(list(tmp_path.glob("*.seg"))) >= 1
+
+
+def test_survives_restart(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append([b"a", b"b", b"c"])
+    records, position = spool.read(1)
+    spool.commit(position)
+    spool.close()
+    spool = Spool(str(tmp_path))
+    spool.append([b"d"])
+    assert spool.read(10)[0] == [b"b", b"c", b"d"]
+
+
+def test_evicts_oldest_segments(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=100, max_bytes=300)
+    for i in range(100):
+        spool.append([f"{i:09d}".encode()])
+    records = spool.read(1000)[0]
+    assert records[-1] == b"000000099"
+    assert len(records) < 100
+    assert sum(f.stat().st_size for f in tmp_path.glob("*.seg")) <= 300
+
+
+def test_replays_backlog_when_database_is_back(tmp_path):
+    point = Point("test", {"sensor": "DHT11"}, {"humidity": 40.0}, 1_650_000_000_000_000_000)
+    with InfluxStub(status=503) as stub:
+        writer = SpooledWriter(InfluxWriter("test", influx_url=stub.url),
+                               Spool(str(tmp_path)), chunk_size=10,
+                               retry_interval=0.1, max_retry_interval=0.1)
+        writer.write([point] * 25)
+        time.sleep(0.3)
+        stub.status = 204
+        stub.lines.clear()
+        wait_for(lambda: len(stub.lines) >= 25)
+        writer.close()
+    assert len(stub.lines) == 25
+    assert len(Spool(str(tmp_path))) == 0
+
+
+def test_rejected_chunks_are_skipped(tmp_path):
+    point = Point("test", {"sensor": "DHT11"}, {"humidity": 40.0}, 1_650_000_000_000_000_000)
+    with InfluxStub(status=400) as stub:
+        writer = SpooledWriter(InfluxWriter("test", influx_url=stub.url),
+                               Spool(str(tmp_path)), chunk_size=10, rate=1e6)
+        writer.write([point] * 25)
+        wait_for(lambda: len(writer) == 0)
+        time.sleep(0.2)
+        assert stub.requests == 3  # every chunk was sent once
+        stub.status = 204
+        writer.write([point])
+        wait_for(lambda: stub.requests == 4)
+        writer.close()
@@ -0,0 +1,84 @@
+import json
+import sys
+
+from sensorpi import __main__ as cli
+from sensorpi.points import Point
+from sensorpi.store import LocalStore
+
+SECOND = 1_000_000_000
+START = 1_700_000_000
+
+
+def reading(t, sensor="dht", **fields):
+    return Point("weather", {"sensor": sensor}, fields, round((START + t) * SECOND))
+
+
+def fill(store, seconds, sensor="dht"):
+    for t in range(seconds):
+        store.write([reading(t, sensor, temperature=20.0 + t % 10, humidity=40.0, ok=True)])
+
+
+def test_query_time_range(tmp_path):
+    with LocalStore(str(tmp_path / "store.db")) as store:
+        fill(store, 100)
+        rows = store.query(sensor="dht", field="temperature", start=START + 10, end=START + 20)
+        assert [row.time for row in rows] == [START + t for t in range(10, 20)]
+        assert [row.mean for row in rows] == [20.0 + t for t in range(10)]
+        assert rows[0].tags == {"sensor": "dht"}
+        assert {row.field for row in store.query(sensor="dht")} == {"temperature", "humidity"}
+        assert store.query(sensor="other") == []
+
+
+def test_downsampled_query(tmp_path):
+    with LocalStore(str(tmp_path / "store.db")) as store:
+        fill(store, 60)
+        rows = store.query(field="temperature", every=20)
+        assert [row.time for row in rows] == [START, START + 20, START + 40]
+        assert all((row.mean, row.min, row.max, row.count) == (24.5, 20.0, 29.0, 20)
+                   for row in rows)
+
+
+def test_series_survive_reopening(tmp_path):
+    path = str(tmp_path / "store.db")
+    with LocalStore(path) as store:
+        fill(store, 10)
+    with LocalStore(path) as store:
+        fill(store, 10, sensor="other")
+        store.write([reading(20, temperature=1.0)])
+        series = store.series()
+    assert [(tags["sensor"], field, count) for _, tags, field, count, _, _ in series] == \
+        [("dht", "humidity", 10), ("dht", "temperature", 11),
+         ("other", "humidity", 10), ("other", "temperature", 10)]
+
+
+def test_oldest_samples_are_deleted_when_full(tmp_path):
+    with LocalStore(str(tmp_path / "store.db"), max_bytes=256 * 1024, check_every=500) as store:
+        fill(store, 20_000)
+        assert store.rollovers > 0
+        assert store.size() <= 256 * 1024
+        rows = store.query(field="temperature")
+        assert rows[-1].time == START + 19_999
+        assert rows[0].time > START
+
+
+def test_query_command(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / "store.db")
+    with LocalStore(path) as store:
+        fill(store, 60)
+    monkeypatch.setattr(sys, "argv", ["sensorpi", "query", "--db", path, "--field", "temperature",
+                                      "--since", str(START), "--every", "20", "--format", "json"])
+    cli.main_with_prompt()
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(row["time"], row["count"]) for row in rows] == [(START + t, 20) for t in (0, 20, 40)]
+
+    cli.query_with_prompt(["--db", path, "--since", str(START), "--format", "csv",
+                           "--sensor", "dht", "--field", "humidity"])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "time,measurement,tags,field,mean,min,max,count"
+    assert len(lines) == 61 and lines[1].endswith(",weather,sensor=dht,humidity,40,40,40,1")
+
+
+def test_parse_time():
+    assert cli.parse_time("15m", 10_000) == 10_000 - 900
+    assert cli.parse_time("2h", 10_000) == 10_000 - 7200
+    assert cli.parse_time("1700000000", 0) == 1_700_000_000
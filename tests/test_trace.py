@@ -0,0 +1,123 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from sensorpi import __main__ as cli
+from sensorpi import pipeline, trace
+from sensorpi.aggregate import Aggregator
+from sensorpi.deadband import DeadbandFilter
+from sensorpi.points import Point
+
+SECOND = 1_000_000_000
+START = 1_700_000_000
+
+
+def cycle_points(i):
+    return [Point("weather", {"sensor": "bme"}, {"temperature": 20.0 + i % 7, "pressure": 1000 + i},
+                  (START + i) * SECOND),
+            Point("weather", {"sensor": "ds", "rom": "28-1"}, {"temperature": 10.0 + (i // 5)},
+                  (START + i) * SECOND)]
+
+
+def record(path, cycles=20, **kwargs):
+    with trace.Recorder(str(path), **kwargs) as recorder:
+        for i in range(cycles):
+            recorder.record(START + i, cycle_points(i), monotonic=i * SECOND)
+
+
+class ListWriter:
+    def __init__(self):
+        self.points = []
+
+    def write(self, data):
+        self.points.extend(data)
+
+    def close(self):
+        pass
+
+
+def test_trace_round_trip(tmp_path):
+    path = tmp_path / "field.trace"
+    record(path, 10, block_cycles=3)
+    cycles = list(trace.read_trace(str(path)))
+    assert [c.timestamp for c in cycles] == [START + i for i in range(10)]
+    assert [c.monotonic for c in cycles] == [i * SECOND for i in range(10)]
+    assert [c.points for c in cycles] == [cycle_points(i) for i in range(10)]
+
+
+def test_numpy_fields_are_recorded(tmp_path):
+    path = tmp_path / "np.trace"
+    with trace.Recorder(str(path)) as recorder:
+        recorder.record(START, [Point("cam", {}, {"mean": np.float32(1.5), "n": np.int64(3)}, 0)])
+    (cycle,) = trace.read_trace(str(path))
+    assert cycle.points[0].fields == {"mean": 1.5, "n": 3}
+
+
+def test_torn_block_is_ignored(tmp_path):
+    path = tmp_path / "torn.trace"
+    record(path, 10, block_cycles=4)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 5)
+    assert len(list(trace.read_trace(str(path)))) == 8
+
+
+def test_replay_keeps_the_pace(tmp_path):
+    path = tmp_path / "pace.trace"
+    record(path, 5)
+    now = [100.0]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(round(seconds, 6))
+        now[0] += seconds
+
+    cycles = list(trace.replay(str(path), speed=100, clock=lambda: now[0], sleep=sleep))
+    assert len(cycles) == 5
+    assert waits == [0.01] * 4
+    assert list(trace.replay(str(path), speed=0, sleep=sleep)) and len(waits) == 4
+
+
+def test_retime_shifts_the_points(tmp_path):
+    path = tmp_path / "retime.trace"
+    record(path, 3)
+    cycles = list(trace.replay(str(path), speed=0, retime=True))
+    shift = cycles[0].points[0].time - START * SECOND
+    assert shift > 0
+    assert [c.points[0].time for c in cycles] == [(START + i) * SECOND + shift for i in range(3)]
+
+
+def test_replay_gives_the_output_of_the_live_pipeline(tmp_path):
+    path = tmp_path / "pipeline.trace"
+    record(path, 200)
+    sensors = {"bme": {"aggregate": {"window": 30}}, "ds": {"deadband": {"abs": 0.5}}}
+    live = ListWriter()
+    aggregator, deadband = Aggregator(sensors, 1), DeadbandFilter(sensors)
+    for i in range(200):
+        pipeline.process(cycle_points(i), START + i, live, None, aggregator, deadband)
+    live.write(aggregator.flush())
+    for speed in (0, 1000):
+        replayed = ListWriter()
+        assert cli.replay_trace(str(path), sensors, replayed, 1, speed) == 200
+        assert replayed.points == live.points
+    assert len(live.points) < 100  # aggregated and filtered
+
+
+def test_replay_command(tmp_path, monkeypatch, capsys):
+    path = tmp_path / "cli.trace"
+    record(path, 3)
+    config = tmp_path / "config.edn"
+    config.write_text('{:influxdb {:db "test"} :sensors {:bme {:type "bme280"}}}')
+    monkeypatch.setattr(sys, "argv", ["sensorpi", "replay", str(path), "--config", str(config),
+                                      "--speed", "0", "--stdout"])
+    cli.main_with_prompt()
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 6
+    assert lines[0] == f"weather,sensor=bme temperature=20.0,pressure=1000i {START * SECOND}"
+
+
+def test_not_a_trace(tmp_path):
+    (tmp_path / "x").write_bytes(b"hello")
+    with pytest.raises(ValueError):
+        list(trace.read_trace(str(tmp_path / "x")))
@@ -0,0 +1,79 @@
+from benchmarks.influx_stub import InfluxStub
+from sensorpi import writer as writer_module
+from sensorpi.metrics import Metrics
+from sensorpi.points import Point
+from sensorpi.writer import InfluxWriter
+from tests.helpers import wait_for
+
+
+def point(i):
+    return Point("test", {"sensor": "DS18B20"}, {"temperature": 20.0 + i},
+                 1_650_000_000_000_000_000 + i * 1_000_000)
+
+
+def test_batches_by_size_on_one_connection():
+    with InfluxStub() as stub:
+        writer = InfluxWriter("test", influx_url=stub.url, batch_size=10, flush_interval=60)
+        for i in range(50):
+            writer.write([point(i)])
+        writer.close()
+    assert stub.requests == 5
+    assert stub.connections == 1
+    assert len(stub.lines) == 50
+
+
+def test_flushes_by_age():
+    with InfluxStub() as stub:
+        writer = InfluxWriter("test", influx_url=stub.url, batch_size=1000, flush_interval=0.2)
+        writer.write([point(0), point(1)])
+        wait_for(lambda: stub.requests > 0)
+        assert stub.requests == 1
+        assert len(writer) == 0
+        writer.close()
+    assert stub.requests == 1
+
+
+def test_close_flushes_remaining_points():
+    with InfluxStub() as stub:
+        with InfluxWriter("test", influx_url=stub.url, batch_size=1000, flush_interval=60) as writer:
+            writer.write([point(i) for i in range(3)])
+            assert stub.requests == 0
+    assert stub.requests == 1
+    assert len(stub.lines) == 3
+
+
+def test_keeps_points_when_database_is_offline():
+    with InfluxStub(status=500) as stub:
+        writer = InfluxWriter("test", influx_url=stub.url, batch_size=1000, flush_interval=60)
+        writer.write([point(0)])
+        try:
+            writer.flush()
+        except Exception:
+            pass
+        assert len(writer) == 1
+        stub.status = 204
+        writer.close()
+    assert stub.lines[-1].startswith("test,sensor=DS18B20 temperature=20")
+
+
+def test_rejected_points_are_dropped(monkeypatch):
+    metrics = Metrics()
+    monkeypatch.setattr(writer_module, "metrics", metrics)
+    with InfluxStub(status=400) as stub:
+        writer = InfluxWriter("test", influx_url=stub.url, batch_size=1000, flush_interval=60)
+        writer.write([point(0), point(1)])
+        writer.flush()  # does not raise, sending them again would fail again
+        assert len(writer) == 0
+        stub.status = 204
+        writer.write([point(2)])
+        writer.close()
+    assert stub.requests == 2
+    assert stub.lines[-1].startswith("test,sensor=DS18B20 temperature=22")
+    assert metrics.points()[0].fields["rejected"] == 2
+
+
+def test_sends_line_protocol_with_precision():
+    with InfluxStub() as stub:
+        with InfluxWriter("test", influx_url=stub.url, precision="s") as writer:
+            writer.write([point(0)])
+    assert stub.lines == ["test,sensor=DS18B20 temperature=20.0 1650000000"]